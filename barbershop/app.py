@@ -1,7 +1,15 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import (Flask, Blueprint, render_template, request, redirect, url_for, flash, jsonify, session, abort,
+                   current_app, make_response)
+from markupsafe import Markup
 from datetime import datetime
+import functools
+import hashlib
 import os
+import threading
 from dotenv import load_dotenv
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy import tuple_
+from sqlalchemy.orm import joinedload, selectinload
 import logging
 
 # Set up logging
@@ -11,64 +19,181 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-app = Flask(__name__)
-app.secret_key = os.getenv('SECRET_KEY', 'dev-secret-key')
-
-# Database configuration - using SQLite
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URI', 'sqlite:///barbershop.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
 # Import database and models
-from db import db, init_db
+from db import db, init_db, create_schema, read_only
 from models import Location, Barber, Service, Appointment
+from availability import occupancy_cache, appointment_cell, find_available_slots, parse_service_ids
+from catalog import catalog, fragments
+from booking import book_appointment, check_slot_free, BookingError
+from outbox import OutboxDispatcher, cancel_appointment_messages
+import metrics
+from query_audit import init_query_audit
+from session_store import history_cursor
+
+bp = Blueprint('main', __name__)
+
+_assistant_lock = threading.Lock()
+
+def create_app(config=None):
+    """Build the Flask app
+
+    Nothing here touches the database or builds the assistant, so importing
+    the module and creating the app stay cheap in every worker. Create the
+    schema with ``flask --app app init-db`` (or ``python seed_data.py``).
+    """
+    app = Flask(__name__)
+    app.secret_key = os.getenv('SECRET_KEY', 'dev-secret-key')
+    
+    # Database configuration - using SQLite
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URI', 'sqlite:///barbershop.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    
+    # Deliver queued emails from this process (disable when running "python outbox.py" separately)
+    app.config['EMAIL_OUTBOX_AUTOSTART'] = os.getenv('EMAIL_OUTBOX_AUTOSTART', 'true').lower() == 'true'
+    
+    # Admin dashboard pagination
+    app.config['DASHBOARD_PAGE_SIZE'] = int(os.getenv('DASHBOARD_PAGE_SIZE', 50))
+    app.config['DASHBOARD_MAX_PAGE_SIZE'] = 500
+    
+    # Request, SQL, assistant and email timings served at /metrics (METRICS_TOKEN requires a bearer token)
+    app.config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+    app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+    
+    # Development/test: record each request's SQL, flag N+1 patterns and query budget overruns
+    app.config['QUERY_AUDIT'] = os.getenv('QUERY_AUDIT', 'false').lower() == 'true'
+    app.config['QUERY_AUDIT_STRICT'] = os.getenv('QUERY_AUDIT_STRICT', 'false').lower() == 'true'
+    
+    if config:
+        app.config.update(config)
+    
+    init_db(app)
+    metrics.init_metrics(app)
+    init_query_audit(app)
+    app.register_blueprint(bp)
+    
+    # Background delivery of queued emails, started by the first request
+    app.extensions['email_outbox'] = OutboxDispatcher(app)
+    
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create missing tables and indexes and run pending migrations"""
+        create_schema()
+        print("Database is up to date")
+    
+    return app
+
+def get_assistant():
+    """The app's AI assistant, built on first use"""
+    assistant = current_app.extensions.get('barber_assistant')
+    if assistant is None:
+        with _assistant_lock:
+            assistant = current_app.extensions.get('barber_assistant')
+            if assistant is None:
+                from voice_assistant import BarberAssistant
+                assistant = BarberAssistant(current_app._get_current_object())
+                current_app.extensions['barber_assistant'] = assistant
+    return assistant
+
+def catalog_page(view):
+    """Serve a page that only changes with the catalog with a strong ETag
+
+    The ETag covers the catalog version, the URL, the templates and the
+    year in the footer, so a matching If-None-Match gets a 304 without
+    the page being rendered. Pages with flash messages waiting to be
+    shown are always rendered.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if '_flashes' in session:
+            return view(*args, **kwargs)
+        
+        etag = _catalog_etag(catalog.get().version)
+        if etag in request.if_none_match:
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return wrapper
+
+def _catalog_etag(version):
+    key = f"{version}|{request.full_path}|{datetime.now().year}|{_template_stamp(current_app.root_path)}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+@functools.lru_cache(maxsize=None)
+def _template_stamp(root_path):
+    """Latest template modification time, so a deploy with new templates changes the ETags"""
+    templates = os.path.join(root_path, 'templates')
+    return max((os.path.getmtime(os.path.join(folder, name))
+                for folder, _, names in os.walk(templates) for name in names), default=0)
+
+def _catalog_fragment(template, location_id, load):
+    """Rendered catalog fragment from the fragment cache
 
-# Initialize database with app
-init_db(app)
+    ``load`` returns the template context when the fragment has to be
+    rendered. Only known locations are cached, so arbitrary location_id
+    values can't grow the cache.
+    """
+    render = lambda: Markup(render_template(template, **load()))
+    snapshot = catalog.get()
+    if location_id is not None and not any(str(location.id) == location_id for location in snapshot.locations):
+        return render()
+    return fragments.get(template, location_id, snapshot.version, render)
 
-# Initialize the AI assistant
-from voice_assistant import BarberAssistant
-barber_assistant = BarberAssistant(app)
+@bp.before_app_request
+def start_outbox():
+    """Start delivering queued emails once this worker serves requests"""
+    if current_app.config['EMAIL_OUTBOX_AUTOSTART']:
+        current_app.extensions['email_outbox'].start()
 
 # Add current year to all templates
-@app.context_processor
+@bp.app_context_processor
 def inject_now():
     return {'now': datetime.now()}
 
 # Error handlers
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def page_not_found(e):
     logger.error(f"Page not found: {request.path}")
     return render_template('error.html', error="Page not found"), 404
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def server_error(e):
     logger.error(f"Server error: {str(e)}")
     return render_template('error.html', error="Internal server error"), 500
 
-@app.route('/')
+@bp.route('/')
 def home():
     """Home page with hero image and gallery"""
     return render_template('home.html')
 
 # AI assistant routes
-@app.route('/assistant', methods=['GET'])
+@bp.route('/assistant', methods=['GET'])
 def assistant():
     """AI assistant chat interface"""
     return render_template('assistant.html')
 
-@app.route('/api/assistant/start', methods=['POST'])
+@bp.route('/api/assistant/start', methods=['POST'])
 def start_assistant_conversation():
     """Start a new conversation with the AI assistant"""
     session_id = request.json.get('session_id', f"web-session-{datetime.now().strftime('%Y%m%d%H%M%S')}")
-    greeting = barber_assistant.start_conversation(session_id)
+    try:
+        cursor = history_cursor(request.json)
+    except ValueError:
+        return jsonify({'error': 'cursor must be a non-negative integer'}), 400
+    
+    greeting = get_assistant().start_conversation(session_id)
     
     return jsonify({
         'session_id': session_id,
         'message': greeting,
-        'history': barber_assistant.get_conversation_history(session_id)
+        **_history_delta(session_id, cursor)
     })
 
-@app.route('/api/assistant/message', methods=['POST'])
+@bp.route('/api/assistant/message', methods=['POST'])
 def process_assistant_message():
     """Process a message from the user to the AI assistant"""
     session_id = request.json.get('session_id')
@@ -76,43 +201,78 @@ def process_assistant_message():
     
     if not session_id or not user_message:
         return jsonify({'error': 'Session ID and message are required'}), 400
+    try:
+        cursor = history_cursor(request.json)
+    except ValueError:
+        return jsonify({'error': 'cursor must be a non-negative integer'}), 400
     
-    response = barber_assistant.process_message(session_id, user_message)
+    response = get_assistant().process_message(session_id, user_message)
     
     return jsonify({
         'session_id': session_id,
         'message': response,
-        'history': barber_assistant.get_conversation_history(session_id)
+        **_history_delta(session_id, cursor)
     })
 
-@app.route('/book', methods=['GET'])
+@bp.route('/api/assistant/history', methods=['POST'])
+def assistant_history():
+    """Conversation history after the client's cursor (all of it on resync)"""
+    session_id = request.json.get('session_id')
+    if not session_id:
+        return jsonify({'error': 'Session ID is required'}), 400
+    try:
+        cursor = history_cursor(request.json)
+    except ValueError:
+        return jsonify({'error': 'cursor must be a non-negative integer'}), 400
+    
+    return jsonify({
+        'session_id': session_id,
+        **_history_delta(session_id, cursor or 0)
+    })
+
+def _history_delta(session_id, cursor):
+    """Messages the client hasn't seen yet plus the cursor to send next time"""
+    messages, start, next_cursor = get_assistant().get_history_since(session_id, cursor)
+    return {'messages': messages, 'start': start, 'cursor': next_cursor}
+
+@bp.route('/book', methods=['GET'])
+@read_only
+@catalog_page
 def book():
     """First step of booking process - select location"""
     try:
-        locations = Location.query.all()
-        logger.info(f"Found {len(locations)} locations")
-        return render_template('booking/location.html', locations=locations)
+        locations_html = _catalog_fragment('booking/fragments/locations.html', None,
+                                           lambda: {'locations': Location.query.all()})
+        return render_template('booking/location.html', catalog_html=locations_html)
     except Exception as e:
         logger.error(f"Error in book route: {str(e)}")
         flash('Something went wrong. Please try again later.', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
 
-@app.route('/book/specialist', methods=['GET'])
+@bp.route('/book/specialist', methods=['GET'])
+@read_only
+@catalog_page
 def book_specialist():
     """Second step - select specialist/barber"""
     location_id = request.args.get('location_id')
-    barbers = Barber.query.filter_by(location_id=location_id).all()
-    return render_template('booking/specialist.html', barbers=barbers, location_id=location_id)
+    barbers_html = _catalog_fragment('booking/fragments/barbers.html', location_id,
+                                      lambda: {'barbers': Barber.query.filter_by(location_id=location_id).all(),
+                                               'location_id': location_id})
+    return render_template('booking/specialist.html', catalog_html=barbers_html, location_id=location_id)
 
-@app.route('/book/services', methods=['GET'])
+@bp.route('/book/services', methods=['GET'])
+@read_only
+@catalog_page
 def book_services():
     """Third step - select services"""
     location_id = request.args.get('location_id')
     barber_id = request.args.get('barber_id')
-    services = Service.query.all()
-    return render_template('booking/services.html', services=services, location_id=location_id, barber_id=barber_id)
+    services_html = _catalog_fragment('booking/fragments/services.html', None,
+                                      lambda: {'services': Service.query.all()})
+    return render_template('booking/services.html', catalog_html=services_html,
+                           location_id=location_id, barber_id=barber_id)
 
-@app.route('/book/datetime', methods=['GET'])
+@bp.route('/book/datetime', methods=['GET'])
 def book_datetime():
     """Fourth step - select date and time"""
     location_id = request.args.get('location_id')
@@ -120,7 +280,32 @@ def book_datetime():
     services = request.args.getlist('services')
     return render_template('booking/datetime.html', location_id=location_id, barber_id=barber_id, services=services)
 
-@app.route('/book/review', methods=['GET'])
+@bp.route('/api/availability', methods=['GET'])
+@read_only
+def api_availability():
+    """Free time slots for a barber (or any barber) at a location"""
+    location_id = request.args.get('location_id')
+    barber_id = request.args.get('barber_id')
+    services = request.args.getlist('services')
+    start_date = request.args.get('date')
+    days = request.args.get('days', 1)
+    
+    if not location_id and barber_id in (None, '', 'any'):
+        return jsonify({'error': 'location_id or barber_id is required'}), 400
+    
+    try:
+        result = find_available_slots(location_id=location_id,
+                                      barber_id=barber_id,
+                                      service_ids=services,
+                                      start_date=start_date,
+                                      days=days)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid parameter: {str(e)}'}), 400
+    
+    return jsonify(result)
+
+@bp.route('/book/review', methods=['GET'])
+@read_only
 def book_review():
     """Fifth step - review booking details"""
     location_id = request.args.get('location_id')
@@ -140,7 +325,7 @@ def book_review():
                           date=date,
                           time=time)
 
-@app.route('/book/confirm', methods=['POST'])
+@bp.route('/book/confirm', methods=['POST'])
 def book_confirm():
     """Create appointment and send confirmation"""
     first_name = request.form.get('first_name')
@@ -160,37 +345,32 @@ def book_confirm():
     if barber_id == 'any' or not barber_id:
         barber_id = None
     
-    # Create new appointment
-    appointment = Appointment(
-        location_id=location_id,
-        barber_id=barber_id,  # Will be None for "any barber"
-        client_name=f"{first_name} {last_name}",
-        client_email=email,
-        date=appointment_date,
-        start_time=time,
-        services=','.join(services)
-    )
-    
-    db.session.add(appointment)
-    db.session.commit()
-    
-    # Send confirmation email
-    from email_service import send_confirmation_email
-    selected_services = Service.query.filter(Service.id.in_([int(s) for s in services])).all()
-    
-    # Check if we should use test mode (force console output)
-    email_test_mode = os.getenv('EMAIL_TEST_MODE', 'true').lower() == 'true'
+    # Create the appointment atomically - fails cleanly if the slot was taken
+    try:
+        appointment = book_appointment(location_id=location_id,
+                                       barber_id=barber_id,  # None for "any barber"
+                                       client_name=f"{first_name} {last_name}",
+                                       client_email=email,
+                                       appointment_date=appointment_date,
+                                       start_time=time,
+                                       service_ids=services,
+                                       send_confirmation=True)
+    except BookingError as e:
+        logger.info(f"Booking rejected for {date} {time}: {str(e)}")
+        flash(f"{str(e)} Please choose another time.", 'danger')
+        return redirect(url_for('main.book_datetime',
+                                location_id=location_id,
+                                barber_id=barber_id or 'any',
+                                services=services))
     
-    if email_test_mode:
-        logger.info("Email test mode is enabled - printing to console instead of sending")
-        
-    send_confirmation_email(appointment, selected_services, test_mode=email_test_mode)
+    # The confirmation email was queued with the booking; deliver it now
+    current_app.extensions['email_outbox'].notify()
     
     flash('Appointment booked successfully!', 'success')
     return render_template('booking/confirmation.html', appointment=appointment)
 
 # Admin routes
-@app.route('/admin/login', methods=['GET', 'POST'])
+@bp.route('/admin/login', methods=['GET', 'POST'])
 def admin_login():
     """Admin login page"""
     if request.method == 'POST':
@@ -200,17 +380,18 @@ def admin_login():
         # Simple credential check - in production use secure authentication
         if username == os.getenv('ADMIN_USERNAME', 'admin') and password == os.getenv('ADMIN_PASSWORD', 'password'):
             session['admin'] = True
-            return redirect(url_for('admin_dashboard'))
+            return redirect(url_for('main.admin_dashboard'))
         
         flash('Invalid credentials', 'danger')
         
     return render_template('admin/login.html')
 
-@app.route('/admin/dashboard')
+@bp.route('/admin/dashboard')
+@read_only
 def admin_dashboard():
     """Admin dashboard - appointment list"""
     if not session.get('admin'):
-        return redirect(url_for('admin_login'))
+        return redirect(url_for('main.admin_login'))
     
     # Get filter params
     date_filter = request.args.get('date')
@@ -222,7 +403,6 @@ def admin_dashboard():
     
     # Apply filters if they exist
     if date_filter:
-        from datetime import datetime
         filter_date = datetime.strptime(date_filter, '%Y-%m-%d').date()
         query = query.filter(Appointment.date == filter_date)
     
@@ -232,40 +412,117 @@ def admin_dashboard():
     if barber_id:
         query = query.filter(Appointment.barber_id == barber_id)
     
-    # Get all appointments based on filters
-    appointments = query.order_by(Appointment.date, Appointment.start_time).all()
+    # Page size from config, optionally overridden per request up to a cap
+    page_size = min(request.args.get('per_page', current_app.config['DASHBOARD_PAGE_SIZE'], type=int),
+                    current_app.config['DASHBOARD_MAX_PAGE_SIZE'])
+    page_size = max(page_size, 1)
+    
+    # Keyset pagination: continue after the (date, start_minute, id) of the last row shown
+    after = request.args.get('after')
+    if after:
+        try:
+            after_date, after_minute, after_id = after.split(',')
+            after_key = (datetime.strptime(after_date, '%Y-%m-%d').date(), int(after_minute), int(after_id))
+        except ValueError:
+            abort(400)
+        query = query.filter(tuple_(Appointment.date, Appointment.start_minute, Appointment.id) > after_key)
+    
+    # Location and barber come in the same query, services in one extra query
+    appointments = (query.options(joinedload(Appointment.location),
+                                  joinedload(Appointment.barber),
+                                  selectinload(Appointment.service_items))
+                    .order_by(Appointment.date, Appointment.start_minute, Appointment.id)
+                    .limit(page_size + 1)
+                    .all())
+    
+    next_cursor = None
+    if len(appointments) > page_size:
+        appointments = appointments[:page_size]
+        last = appointments[-1]
+        next_cursor = f"{last.date.isoformat()},{last.start_minute},{last.id}"
+    
+    filters = {key: value for key, value in (('date', date_filter),
+                                             ('location_id', location_id),
+                                             ('barber_id', barber_id),
+                                             ('per_page', request.args.get('per_page'))) if value}
     
     # Get all locations and barbers for the filter dropdowns
     locations = Location.query.all()
     barbers = Barber.query.all()
-    services = Service.query.all()
     
     return render_template('admin/dashboard.html', 
                           appointments=appointments,
                           locations=locations,
                           barbers=barbers,
-                          services=services)
+                          filters=filters,
+                          next_cursor=next_cursor,
+                          is_first_page=not after)
 
-@app.route('/admin/appointment/<int:id>', methods=['GET', 'POST'])
+@bp.route('/admin/cache-stats')
+def admin_cache_stats():
+    """Occupancy and catalog fragment cache sizes and hit/miss counters"""
+    if not session.get('admin'):
+        return redirect(url_for('main.admin_login'))
+    
+    return jsonify({**occupancy_cache.stats(), 'catalog_fragments': fragments.stats()})
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    """Performance metrics in the Prometheus text format"""
+    if not current_app.config['METRICS_ENABLED']:
+        abort(404)
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        abort(401)
+    return current_app.response_class(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@bp.route('/admin/appointment/<int:id>', methods=['GET', 'POST'])
 def admin_edit_appointment(id):
     """Edit appointment"""
     if not session.get('admin'):
-        return redirect(url_for('admin_login'))
+        return redirect(url_for('main.admin_login'))
         
     appointment = Appointment.query.get_or_404(id)
     
     if request.method == 'POST':
-        appointment.location_id = request.form.get('location_id')
-        appointment.barber_id = request.form.get('barber_id')
-        appointment.client_name = request.form.get('client_name')
-        appointment.client_email = request.form.get('client_email')
-        appointment.date = request.form.get('date')
-        appointment.start_time = request.form.get('time')
-        appointment.services = ','.join(request.form.getlist('services'))
+        barber_id = request.form.get('barber_id')
+        location_id = int(request.form.get('location_id'))
+        barber_id = None if barber_id in (None, '', 'any') else int(barber_id)
+        appointment_date = datetime.strptime(request.form.get('date'), '%Y-%m-%d').date()
+        start_time = request.form.get('time')
+        service_ids = parse_service_ids(request.form.getlist('services'))
+        
+        # The slot it leaves; the cache only changes once the move is committed
+        old_cell = appointment_cell(appointment)
         
-        db.session.commit()
+        try:
+            # The same locked overlap check as new bookings, before the changes are flushed
+            check_slot_free(location_id, barber_id, appointment_date, start_time, service_ids, moving=old_cell)
+            appointment.location_id = location_id
+            appointment.barber_id = barber_id
+            appointment.client_name = request.form.get('client_name')
+            appointment.client_email = request.form.get('client_email')
+            appointment.date = appointment_date
+            appointment.start_time = start_time
+            appointment.set_services(service_ids)
+            db.session.commit()
+        except BookingError as e:
+            db.session.rollback()
+            flash(str(e), 'danger')
+            return redirect(url_for('main.admin_edit_appointment', id=id))
+        except IntegrityError:
+            db.session.rollback()
+            flash('That barber already has an appointment starting at this time', 'danger')
+            return redirect(url_for('main.admin_edit_appointment', id=id))
+        except OperationalError as e:
+            db.session.rollback()
+            logger.warning(f"Appointment {id} not updated: {str(e)}")
+            flash('The schedule is busy right now. Please try again in a moment.', 'danger')
+            return redirect(url_for('main.admin_edit_appointment', id=id))
+        occupancy_cache.release_cell(old_cell)
+        occupancy_cache.add_appointment(appointment)
         flash('Appointment updated successfully', 'success')
-        return redirect(url_for('admin_dashboard'))
+        return redirect(url_for('main.admin_dashboard'))
         
     locations = Location.query.all()
     barbers = Barber.query.all()
@@ -277,20 +534,24 @@ def admin_edit_appointment(id):
                           barbers=barbers,
                           services=services)
 
-@app.route('/admin/appointment/delete/<int:id>', methods=['POST'])
+@bp.route('/admin/appointment/delete/<int:id>', methods=['POST'])
 def admin_delete_appointment(id):
     """Delete appointment"""
     if not session.get('admin'):
-        return redirect(url_for('admin_login'))
+        return redirect(url_for('main.admin_login'))
         
     appointment = Appointment.query.get_or_404(id)
+    cell = appointment_cell(appointment)
+    cancel_appointment_messages(appointment.id)
     db.session.delete(appointment)
     db.session.commit()
+    occupancy_cache.release_cell(cell)
     
     flash('Appointment deleted successfully', 'success')
-    return redirect(url_for('admin_dashboard'))
+    return redirect(url_for('main.admin_dashboard'))
 
 if __name__ == '__main__':
+    app = create_app()
     with app.app_context():
-        db.create_all()
-    app.run(debug=True) 
\ No newline at end of file
+        create_schema()
+    app.run(debug=True)
@@ -0,0 +1,290 @@
+"""ASGI entry point for the AI assistant
+
+Serves the assistant's JSON API with the same requests and responses as
+the Flask app (POST /api/assistant/start, /message and /history) and a
+WebSocket at /ws/assistant that keeps a conversation open:
+
+    ws://host/ws/assistant?session_id=abc&cursor=0
+    -> {"message": "I'd like a haircut tomorrow", "cursor": 2}
+    <- {"session_id": "abc", "message": "...", "messages": [...], "start": 2, "cursor": 4}
+
+Sessions are handled on an asyncio event loop, so an open connection
+waiting for the customer to type costs a coroutine rather than a worker
+thread. The work of a turn (entity matching, catalog and availability
+lookups, booking) runs on a small pool of ASSISTANT_DB_THREADS threads,
+since SQLite has no async driver; the in-memory session store is used
+on the event loop directly, the SQLite one from the pool. Run it next to
+the Flask app with any ASGI server:
+
+    uvicorn assistant_asgi:app --workers 1
+
+python -m benchmarks.bench_assistant_concurrency compares how many open
+sessions this and the threaded Flask worker handle.
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs
+from session_store import AsyncSessionStore, history_cursor
+from metrics import HTTP_REQUEST_SECONDS
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Threads that run assistant turns (and SQLite session store calls)
+ASSISTANT_DB_THREADS = int(os.getenv('ASSISTANT_DB_THREADS', 8))
+# Open WebSocket connections per worker; further ones are closed with "try again later"
+ASSISTANT_MAX_CONNECTIONS = int(os.getenv('ASSISTANT_MAX_CONNECTIONS', 10000))
+
+MAX_BODY_BYTES = 64 * 1024
+WEBSOCKET_PATH = '/ws/assistant'
+WEBSOCKET_TRY_AGAIN_LATER = 1013
+
+CURSOR_ERROR = 'cursor must be a non-negative integer'
+
+
+class RequestError(Exception):
+    """A request the API answers with a 4xx JSON error"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class AssistantASGI:
+    """ASGI app for the assistant, sharing the Flask app's assistant and session store"""
+
+    def __init__(self, flask_app=None, threads=ASSISTANT_DB_THREADS, max_connections=ASSISTANT_MAX_CONNECTIONS):
+        self.flask_app = flask_app
+        self.threads = threads
+        self.max_connections = max_connections
+        self.assistant = None
+        self.sessions = None
+        self.executor = None
+        self.open_connections = 0
+        self._starting = None
+        self.routes = {
+            '/api/assistant/start': self.start,
+            '/api/assistant/message': self.message,
+            '/api/assistant/history': self.history,
+        }
+
+    async def startup(self):
+        """Build the Flask app and assistant (once, also without lifespan events)"""
+        if self._starting is None:
+            self._starting = asyncio.ensure_future(self._startup())
+        await self._starting
+
+    async def _startup(self):
+        from app import create_app, get_assistant
+
+        if self.flask_app is None:
+            self.flask_app = create_app()
+        self.executor = ThreadPoolExecutor(self.threads, thread_name_prefix='assistant-turn')
+        with self.flask_app.app_context():
+            self.assistant = get_assistant()
+        self.sessions = AsyncSessionStore(self.assistant.conversation_state, self.executor)
+        if self.flask_app.config['EMAIL_OUTBOX_AUTOSTART']:
+            self.flask_app.extensions['email_outbox'].start()
+        logger.info(f"Assistant ASGI app ready with {self.threads} turn threads")
+
+    async def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        if self.flask_app is not None and self.flask_app.config['EMAIL_OUTBOX_AUTOSTART']:
+            self.flask_app.extensions['email_outbox'].stop()
+
+    # Conversation operations, shared by the HTTP and WebSocket endpoints
+
+    async def _in_thread(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def start_conversation(self, session_id):
+        async with self.sessions.lock(session_id):
+            return await self.sessions.call(self.assistant.start_conversation, session_id)
+
+    async def process_message(self, session_id, user_message):
+        """Same as BarberAssistant.process_message, with only the turn itself on a thread"""
+        async with self.sessions.lock(session_id):
+            state = await self.sessions.load(session_id)
+            if state is None:
+                state = self.assistant.new_conversation()
+            response = await self._in_thread(self.assistant.take_turn, state, user_message)
+            await self.sessions.save(session_id, state)
+            return response
+
+    async def history_delta(self, session_id, cursor):
+        """Messages the client hasn't seen yet plus the cursor to send next time"""
+        messages, start, next_cursor = await self.sessions.call(self.assistant.get_history_since, session_id, cursor)
+        return {'messages': messages, 'start': start, 'cursor': next_cursor}
+
+    # HTTP endpoints
+
+    async def start(self, payload):
+        session_id = payload.get('session_id', f"web-session-{datetime.now().strftime('%Y%m%d%H%M%S')}")
+        cursor = _cursor(payload)
+        greeting = await self.start_conversation(session_id)
+        return {'session_id': session_id, 'message': greeting, **await self.history_delta(session_id, cursor)}
+
+    async def message(self, payload):
+        session_id = payload.get('session_id')
+        user_message = payload.get('message')
+        if not session_id or not user_message:
+            raise RequestError('Session ID and message are required')
+        cursor = _cursor(payload)
+        response = await self.process_message(session_id, user_message)
+        return {'session_id': session_id, 'message': response, **await self.history_delta(session_id, cursor)}
+
+    async def history(self, payload):
+        session_id = payload.get('session_id')
+        if not session_id:
+            raise RequestError('Session ID is required')
+        cursor = _cursor(payload)
+        return {'session_id': session_id, **await self.history_delta(session_id, cursor or 0)}
+
+    # ASGI
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        await self.startup()
+        if scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        elif scope['type'] == 'websocket':
+            await self._websocket(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            event = await receive()
+            if event['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    logger.exception("Assistant ASGI app failed to start")
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif event['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        started = time.perf_counter()
+        route = scope['path'] if scope['path'] in self.routes else 'unmatched'
+        try:
+            if route == 'unmatched':
+                raise RequestError('Not found', 404)
+            if scope['method'] != 'POST':
+                raise RequestError('Method not allowed', 405)
+            payload = await _read_json(receive)
+            status, body = 200, await self.routes[route](payload)
+        except RequestError as e:
+            status, body = e.status, {'error': str(e)}
+        except Exception as e:
+            logger.error(f"Server error: {str(e)}")
+            status, body = 500, {'error': 'Internal server error'}
+
+        data = json.dumps(body).encode()
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(data)).encode())]})
+        await send({'type': 'http.response.body', 'body': data})
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route, scope['method'], str(status))
+
+    async def _websocket(self, scope, receive, send):
+        event = await receive()
+        if event['type'] != 'websocket.connect':
+            return
+        if scope['path'] != WEBSOCKET_PATH:
+            await send({'type': 'websocket.close', 'code': 1008})
+            return
+        if self.open_connections >= self.max_connections:
+            await send({'type': 'websocket.close', 'code': WEBSOCKET_TRY_AGAIN_LATER})
+            return
+
+        query = {key: values[0] for key, values in parse_qs(scope.get('query_string', b'').decode()).items()}
+        session_id = query.get('session_id') or f"ws-session-{uuid.uuid4().hex}"
+        self.open_connections += 1
+        try:
+            await send({'type': 'websocket.accept'})
+            # A new session is greeted; a resumed one gets the history after the client's cursor
+            if await self.sessions.load(session_id) is None:
+                greeting, cursor = await self.start_conversation(session_id), None
+            else:
+                greeting, cursor = None, int(query['cursor']) if query.get('cursor', '').isdigit() else 0
+            await _send_json(send, {'session_id': session_id, 'message': greeting,
+                                    **await self.history_delta(session_id, cursor)})
+
+            while True:
+                event = await receive()
+                if event['type'] == 'websocket.disconnect':
+                    break
+                if event['type'] != 'websocket.receive':
+                    continue
+                try:
+                    reply = await self._websocket_turn(session_id, event)
+                except RequestError as e:
+                    reply = {'session_id': session_id, 'error': str(e)}
+                await _send_json(send, reply)
+        except Exception as e:
+            logger.error(f"Assistant WebSocket for session {session_id} failed: {str(e)}")
+            await send({'type': 'websocket.close', 'code': 1011})
+        finally:
+            self.open_connections -= 1
+
+    async def _websocket_turn(self, session_id, event):
+        """Answer one frame: JSON like {"message": ..., "cursor": ...} or plain text"""
+        text = event.get('text')
+        if text is None:
+            text = (event.get('bytes') or b'').decode('utf-8', 'replace')
+        try:
+            payload = json.loads(text)
+        except ValueError:
+            payload = {'message': text}
+        if not isinstance(payload, dict):
+            payload = {'message': str(payload)}
+        user_message = payload.get('message')
+        if not user_message:
+            raise RequestError('Message is required')
+        cursor = _cursor(payload)
+        response = await self.process_message(session_id, user_message)
+        return {'session_id': session_id, 'message': response, **await self.history_delta(session_id, cursor)}
+
+
+def _cursor(payload):
+    try:
+        return history_cursor(payload)
+    except ValueError:
+        raise RequestError(CURSOR_ERROR)
+
+
+async def _read_json(receive):
+    body = b''
+    while True:
+        event = await receive()
+        if event['type'] == 'http.disconnect':
+            raise RequestError('Client disconnected')
+        body += event.get('body', b'')
+        if len(body) > MAX_BODY_BYTES:
+            raise RequestError('Request body too large', 413)
+        if not event.get('more_body'):
+            break
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise RequestError('Request body must be JSON')
+    if not isinstance(payload, dict):
+        raise RequestError('Request body must be a JSON object')
+    return payload
+
+
+async def _send_json(send, body):
+    await send({'type': 'websocket.send', 'text': json.dumps(body)})
+
+
+app = AssistantASGI()
@@ -0,0 +1,404 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_
+from db import db
+from models import Barber, Service, Appointment, DEFAULT_APPOINTMENT_MINUTES
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Opening hours used to generate bookable slots (minutes since midnight)
+OPENING_MINUTE = 9 * 60
+CLOSING_MINUTE = 18 * 60
+SLOT_INTERVAL_MINUTES = 30
+CLOSED_WEEKDAYS = {6}  # Sunday
+MAX_SEARCH_DAYS = 31
+
+# Occupancy bitmaps use one bit per 5-minute cell
+SLOT_GRANULARITY_MINUTES = 5
+CELLS_PER_DAY = 24 * 60 // SLOT_GRANULARITY_MINUTES
+
+
+def time_to_minutes(value):
+    """Convert an "HH:MM" string to minutes since midnight"""
+    hours, minutes = value.strip().split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def minutes_to_time(value):
+    """Convert minutes since midnight to an "HH:MM" string"""
+    return f"{value // 60:02d}:{value % 60:02d}"
+
+
+def parse_service_ids(services):
+    """Parse service ids from a CSV string or an iterable of strings/ints"""
+    if not services:
+        return []
+    if isinstance(services, str):
+        services = services.split(',')
+    return [int(s) for s in services if str(s).strip()]
+
+
+def service_durations():
+    """Map of service id to duration in minutes"""
+    return dict(db.session.query(Service.id, Service.duration_minutes).all())
+
+
+def appointment_duration(service_ids, durations):
+    """Total duration in minutes of a list of service ids"""
+    total = sum(durations.get(service_id, 0) for service_id in service_ids)
+    return total or DEFAULT_APPOINTMENT_MINUTES
+
+
+def occupancy_mask(start, duration):
+    """Bitmask of the 5-minute cells covered by [start, start + duration)"""
+    first = max(0, start // SLOT_GRANULARITY_MINUTES)
+    last = min(CELLS_PER_DAY, -(-(start + duration) // SLOT_GRANULARITY_MINUTES))
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def appointment_cell(appointment):
+    """Return the cache key and occupancy mask of an appointment, or None"""
+    if appointment.start_minute is None or appointment.end_minute is None:
+        return None
+    mask = occupancy_mask(appointment.start_minute, appointment.end_minute - appointment.start_minute)
+    if appointment.barber_id:
+        return ('barber', int(appointment.barber_id), appointment.date), mask
+    return ('unassigned', int(appointment.location_id), appointment.date), mask
+
+
+def _with_cell(key, value, mask, add):
+    """A cached bitmap (or tuple of "any barber" bitmaps) with a cell added or removed"""
+    if key[0] == 'barber':
+        return value | mask if add else value & ~mask
+    if add:
+        return value + (mask,)
+    if mask in value:
+        masks = list(value)
+        masks.remove(mask)
+        return tuple(masks)
+    return value
+
+
+class OccupancyCache:
+    """LRU cache of per-(barber, date) occupancy bitmaps
+
+    Each day is stored as an int with one bit per 5-minute cell, so slot
+    checks are a single AND against a mask. Appointments booked for "any
+    barber" are kept per (location, date) as a tuple of bitmaps, one per
+    appointment. Entries expire after ``ttl_seconds`` so bookings made by
+    other worker processes are picked up.
+    """
+
+    def __init__(self, max_entries=4096, ttl_seconds=30):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (loaded_at, bitmap)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_many(self, keys, loader):
+        """Return bitmaps for keys, loading all misses with one loader call"""
+        result = {}
+        missing = []
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and now - entry[0] < self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    result[key] = entry[1]
+                    self.hits += 1
+                else:
+                    missing.append(key)
+                    self.misses += 1
+
+        if missing:
+            loaded = loader(missing)
+            with self._lock:
+                for key in missing:
+                    value = loaded.get(key, 0 if key[0] == 'barber' else ())
+                    self._store(key, value, now)
+                    result[key] = value
+        return result
+
+    def _store(self, key, value, loaded_at):
+        self._entries[key] = (loaded_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _update(self, cell, add):
+        if cell is None:
+            return
+        key, mask = cell
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                # Not cached; the next lookup loads it from the database
+                return
+            loaded_at, value = entry
+            self._entries[key] = (loaded_at, _with_cell(key, value, mask, add))
+
+    def add_appointment(self, appointment):
+        """Mark an appointment's time as occupied in cached bitmaps"""
+        self._update(appointment_cell(appointment), add=True)
+
+    def remove_appointment(self, appointment):
+        """Release an appointment's time in cached bitmaps"""
+        self._update(appointment_cell(appointment), add=False)
+
+    def release_cell(self, cell):
+        """Release a cell taken with appointment_cell() before the appointment changed"""
+        self._update(cell, add=False)
+
+    def clear(self):
+        """Drop all cached bitmaps"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Size and hit/miss counters for tuning ``max_entries``"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+occupancy_cache = OccupancyCache(
+    max_entries=int(os.getenv('OCCUPANCY_CACHE_SIZE', 4096)),
+    ttl_seconds=float(os.getenv('OCCUPANCY_CACHE_TTL', 30)),
+)
+
+
+def _load_occupancy(keys):
+    """Build bitmaps for cache keys with a single appointment query"""
+    barber_ids = {key[1] for key in keys if key[0] == 'barber'}
+    location_ids = {key[1] for key in keys if key[0] == 'unassigned'}
+    days = {key[2] for key in keys}
+    wanted = set(keys)
+
+    conditions = []
+    if barber_ids:
+        conditions.append(Appointment.barber_id.in_(barber_ids))
+    if location_ids:
+        conditions.append(and_(Appointment.barber_id.is_(None), Appointment.location_id.in_(location_ids)))
+
+    query = Appointment.query.with_entities(
+        Appointment.barber_id,
+        Appointment.location_id,
+        Appointment.date,
+        Appointment.start_minute,
+        Appointment.end_minute,
+        Appointment.start_time,
+    ).filter(Appointment.date >= min(days), Appointment.date <= max(days), or_(*conditions))
+    if len(days) <= (max(days) - min(days)).days:
+        query = query.filter(Appointment.date.in_(days))  # scattered days, don't read the gaps
+
+    bitmaps = {}
+    for row in query:
+        cell = appointment_cell(row)
+        if cell is None:
+            logger.warning(f"Skipping appointment with invalid start time: {row.start_time!r}")
+            continue
+        key, mask = cell
+        if key not in wanted:
+            continue
+        if key[0] == 'barber':
+            bitmaps[key] = bitmaps.get(key, 0) | mask
+        else:
+            bitmaps[key] = bitmaps.get(key, ()) + (mask,)
+    return bitmaps
+
+
+class AvailabilityIndex:
+    """Occupancy bitmaps for a set of barbers over a date range
+
+    Bitmaps come from the shared :data:`occupancy_cache`; only cache misses
+    hit the database, in a single query, after which every slot check is
+    a bitwise AND.
+    """
+
+    def __init__(self, durations, barbers_by_location, bitmaps):
+        self.durations = durations
+        self.barbers_by_location = barbers_by_location
+        self.bitmaps = bitmaps
+
+    @classmethod
+    def load(cls, start_date, end_date, location_id=None, barber_id=None, use_cache=True, days=None):
+        """Load occupancy for a barber, or every barber at a location
+
+        Pass ``use_cache=False`` to read straight from the database, e.g.
+        inside the booking transaction where stale data is not acceptable,
+        and ``days`` to load only those days of the range.
+        """
+        durations = service_durations()
+
+        # A specific barber still shares the location's capacity with
+        # "any barber" bookings, so the whole location is always loaded
+        barbers_query = db.session.query(Barber.id, Barber.location_id)
+        if location_id:
+            barbers_query = barbers_query.filter(Barber.location_id == location_id)
+        elif barber_id:
+            barbers_query = barbers_query.filter(Barber.location_id == db.session.query(Barber.location_id)
+                                                 .filter(Barber.id == barber_id).scalar_subquery())
+        barbers_by_location = {}
+        for barber_id_, barber_location_id in barbers_query.order_by(Barber.id):
+            barbers_by_location.setdefault(barber_location_id, []).append(barber_id_)
+
+        if days is None:
+            days = [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+        keys = []
+        for day in days:
+            for barber_location_id, barber_ids in barbers_by_location.items():
+                keys.extend(('barber', barber_id_, day) for barber_id_ in barber_ids)
+                keys.append(('unassigned', barber_location_id, day))
+
+        if not keys:
+            bitmaps = {}
+        elif use_cache:
+            bitmaps = occupancy_cache.get_many(keys, _load_occupancy)
+        else:
+            bitmaps = _load_occupancy(keys)
+        return cls(durations, barbers_by_location, bitmaps)
+
+    def duration_for(self, service_ids):
+        """Total duration in minutes of a list of service ids"""
+        return appointment_duration(service_ids, self.durations)
+
+    def is_barber_free(self, barber_id, day, mask):
+        """Check whether a barber has no booking inside ``mask``"""
+        return not self.bitmaps.get(('barber', barber_id, day), 0) & mask
+
+    def has_capacity(self, location_id, day, mask):
+        """Check that every cell in ``mask`` has a barber to spare
+
+        Appointments booked for "any barber" are not tied to a barber, so
+        each of them takes up one barber at the location for its duration.
+        """
+        barber_bitmaps = [self.bitmaps.get(('barber', barber_id, day), 0)
+                          for barber_id in self.barbers_by_location.get(location_id, [])]
+        unassigned = [bitmap for bitmap in self.bitmaps.get(('unassigned', location_id, day), ())
+                      if bitmap & mask]
+        if not unassigned:
+            return any(not bitmap & mask for bitmap in barber_bitmaps)
+
+        capacity = len(barber_bitmaps)
+        remaining = mask
+        while remaining:
+            cell = remaining & -remaining
+            load = sum(1 for bitmap in barber_bitmaps if bitmap & cell)
+            load += sum(1 for bitmap in unassigned if bitmap & cell)
+            if load >= capacity:
+                return False
+            remaining ^= cell
+        return True
+
+    def is_location_free(self, location_id, day, mask):
+        """Check whether an "any barber" booking fits ``mask`` at a location"""
+        barber_ids = self.barbers_by_location.get(location_id, [])
+        if not any(self.is_barber_free(barber_id, day, mask) for barber_id in barber_ids):
+            return False
+        return self.has_capacity(location_id, day, mask)
+
+    def is_free(self, day, mask, barber_id=None, location_id=None):
+        """Check a slot for a specific barber, or any barber at a location"""
+        if barber_id:
+            return self.is_barber_free(barber_id, day, mask) and self.has_capacity(location_id, day, mask)
+        return self.is_location_free(location_id, day, mask)
+
+    def release_cell(self, cell):
+        """Leave out an appointment_cell(), e.g. of an appointment that is being moved"""
+        if cell is not None and cell[0] in self.bitmaps:
+            key, mask = cell
+            self.bitmaps[key] = _with_cell(key, self.bitmaps[key], mask, add=False)
+
+    def add(self, day, mask, barber_id=None, location_id=None):
+        """Mark ``mask`` as booked, e.g. for an appointment that isn't saved yet"""
+        if barber_id:
+            key = ('barber', barber_id, day)
+            self.bitmaps[key] = self.bitmaps.get(key, 0) | mask
+        else:
+            key = ('unassigned', location_id, day)
+            self.bitmaps[key] = self.bitmaps.get(key, ()) + (mask,)
+
+    def free_slots(self, day, duration, barber_id=None, location_id=None, now=None):
+        """Return the free start times (minutes) for one day"""
+        if day.weekday() in CLOSED_WEEKDAYS:
+            return []
+
+        earliest = OPENING_MINUTE
+        now = now or datetime.now()
+        if day < now.date():
+            return []
+        if day == now.date():
+            earliest = max(earliest, now.hour * 60 + now.minute + 1)
+
+        slots = []
+        for start in range(OPENING_MINUTE, CLOSING_MINUTE - duration + 1, SLOT_INTERVAL_MINUTES):
+            if start < earliest:
+                continue
+            if self.is_free(day, occupancy_mask(start, duration), barber_id, location_id):
+                slots.append(start)
+        return slots
+
+
+def find_available_slots(location_id=None, barber_id=None, service_ids=(), start_date=None, days=1):
+    """Compute free appointment slots for a barber or a whole location
+
+    Args:
+        location_id: Location to search; derived from the barber if omitted
+        barber_id: Barber to search, or None/"any" for any barber at the location
+        service_ids: Services that make up the appointment (sets its duration)
+        start_date: First day to search (defaults to today)
+        days: Number of consecutive days to search
+
+    Returns:
+        Dict with the appointment duration and a mapping of ISO date to "HH:MM" slots
+    """
+    if barber_id in ('any', '', None):
+        barber_id = None
+    else:
+        barber_id = int(barber_id)
+
+    if barber_id and not location_id:
+        barber = db.session.get(Barber, barber_id)
+        location_id = barber.location_id if barber else None
+    location_id = int(location_id) if location_id else None
+
+    start_date = start_date or datetime.now().date()
+    if isinstance(start_date, str):
+        start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+    days = max(1, min(int(days), MAX_SEARCH_DAYS))
+    end_date = start_date + timedelta(days=days - 1)
+
+    index = AvailabilityIndex.load(start_date, end_date, location_id=location_id, barber_id=barber_id)
+    duration = index.duration_for(parse_service_ids(service_ids))
+
+    now = datetime.now()
+    slots = {}
+    for offset in range(days):
+        day = start_date + timedelta(days=offset)
+        free = index.free_slots(day, duration, barber_id=barber_id, location_id=location_id, now=now)
+        slots[day.isoformat()] = [minutes_to_time(start) for start in free]
+
+    return {
+        'location_id': location_id,
+        'barber_id': barber_id,
+        'duration_minutes': duration,
+        'slots': slots,
+    }
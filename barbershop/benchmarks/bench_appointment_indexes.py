@@ -0,0 +1,155 @@
+"""Admin dashboard query latency before and after the appointment indexes
+
+Builds a synthetic SQLite database with the original appointment schema
+(string start_time, no indexes), times the admin_dashboard filter
+queries, then runs the app's schema migrations (minute columns,
+association table backfill, composite indexes) on the same file and
+times the equivalent queries again.
+
+Run from the barbershop directory:
+
+    python -m benchmarks.bench_appointment_indexes --rows 1000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import date, timedelta
+
+ORIGINAL_SCHEMA = """
+CREATE TABLE location (
+    id INTEGER NOT NULL, name VARCHAR(100) NOT NULL, address VARCHAR(200) NOT NULL,
+    phone VARCHAR(20) NOT NULL, PRIMARY KEY (id));
+CREATE TABLE service (
+    id INTEGER NOT NULL, name VARCHAR(100) NOT NULL, duration_minutes INTEGER NOT NULL,
+    price_min FLOAT NOT NULL, price_max FLOAT, PRIMARY KEY (id));
+CREATE TABLE barber (
+    id INTEGER NOT NULL, name VARCHAR(100) NOT NULL, photo VARCHAR(200), languages VARCHAR(100),
+    rating FLOAT, location_id INTEGER NOT NULL, PRIMARY KEY (id),
+    FOREIGN KEY(location_id) REFERENCES location (id));
+CREATE TABLE appointment (
+    id INTEGER NOT NULL, location_id INTEGER NOT NULL, barber_id INTEGER,
+    client_name VARCHAR(100) NOT NULL, client_email VARCHAR(100) NOT NULL, date DATE NOT NULL,
+    start_time VARCHAR(5) NOT NULL, services TEXT NOT NULL, created_at DATETIME, PRIMARY KEY (id),
+    FOREIGN KEY(location_id) REFERENCES location (id), FOREIGN KEY(barber_id) REFERENCES barber (id));
+"""
+
+LOCATIONS = 20
+BARBERS_PER_LOCATION = 10
+SERVICE_DURATIONS = [45, 60, 20, 30, 30, 60]
+FIRST_DAY = date(2023, 1, 2)
+DAYS = 3 * 365
+
+
+def build_original_database(path, rows, seed=42):
+    """Create a database with the pre-index schema and ``rows`` appointments"""
+    rng = random.Random(seed)
+    connection = sqlite3.connect(path)
+    connection.executescript(ORIGINAL_SCHEMA)
+    connection.executemany("INSERT INTO location VALUES (?, ?, ?, ?)",
+                           [(i, f"Shop {i}", f"{i} Main Street", "(555) 000-0000")
+                            for i in range(1, LOCATIONS + 1)])
+    connection.executemany("INSERT INTO service VALUES (?, ?, ?, ?, NULL)",
+                           [(i, f"Service {i}", minutes, 30.0)
+                            for i, minutes in enumerate(SERVICE_DURATIONS, start=1)])
+    connection.executemany("INSERT INTO barber VALUES (?, ?, NULL, 'English', 4.5, ?)",
+                           [(i, f"Barber {i}", (i - 1) // BARBERS_PER_LOCATION + 1)
+                            for i in range(1, LOCATIONS * BARBERS_PER_LOCATION + 1)])
+
+    def appointments():
+        taken = set()
+        i = 0
+        while i < rows:
+            barber_id = rng.randint(1, LOCATIONS * BARBERS_PER_LOCATION)
+            day = FIRST_DAY + timedelta(days=rng.randrange(DAYS))
+            minute = 9 * 60 + 15 * rng.randrange(36)
+            if (barber_id, day, minute) in taken:
+                continue  # keep (barber, date, start_time) unique
+            taken.add((barber_id, day, minute))
+            i += 1
+            location_id = (barber_id - 1) // BARBERS_PER_LOCATION + 1
+            services = str(rng.randint(1, len(SERVICE_DURATIONS)))
+            yield (i, location_id, barber_id, f"Client {i}", f"client{i}@example.com",
+                   day.isoformat(), f"{minute // 60:02d}:{minute % 60:02d}", services)
+
+    connection.executemany("INSERT INTO appointment VALUES (?, ?, ?, ?, ?, ?, ?, ?, NULL)", appointments())
+    connection.commit()
+    connection.close()
+
+
+def dashboard_queries(order_column):
+    """The admin_dashboard filter combinations, sorted like the dashboard"""
+    day = (FIRST_DAY + timedelta(days=DAYS // 2)).isoformat()
+    base = "SELECT * FROM appointment WHERE {} ORDER BY date, " + order_column
+    return {
+        'date': (base.format("date = ?"), (day,)),
+        'location+date': (base.format("location_id = ? AND date = ?"), (7, day)),
+        'barber+date': (base.format("barber_id = ? AND date = ?"), (42, day)),
+        'location (first 50)': (base.format("location_id = ?") + " LIMIT 50", (7,)),
+    }
+
+
+def time_queries(path, queries, repeat):
+    """Median latency in milliseconds of each query"""
+    connection = sqlite3.connect(path)
+    results = {}
+    for name, (sql, params) in queries.items():
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            connection.execute(sql, params).fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+        plan = connection.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        results[name] = (statistics.median(timings), " / ".join(row[-1] for row in plan))
+    connection.close()
+    return results
+
+
+def migrate(path):
+    """Run the app's schema migrations against the database file"""
+    os.environ['DATABASE_URI'] = f"sqlite:///{path}"
+    from flask import Flask
+    from db import init_db, create_schema
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URI']
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    init_db(app)
+    with app.app_context():
+        create_schema()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix='barbershop-bench-'), 'bench.db')
+
+    started = time.perf_counter()
+    build_original_database(path, args.rows)
+    print(f"Built {args.rows} appointments in {time.perf_counter() - started:.1f}s ({path})")
+
+    before = time_queries(path, dashboard_queries('start_time'), args.repeat)
+
+    started = time.perf_counter()
+    migrate(path)
+    print(f"Startup migration took {time.perf_counter() - started:.1f}s")
+
+    after = time_queries(path, dashboard_queries('start_minute'), args.repeat)
+
+    print(f"\n{'query':<22}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+    for name in before:
+        b, a = before[name][0], after[name][0]
+        print(f"{name:<22}{b:>12.2f}{a:>12.2f}{b / a if a else float('inf'):>9.1f}x")
+    print("\nQuery plans after migration:")
+    for name, (_, plan) in after.items():
+        print(f"  {name}: {plan}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,287 @@
+"""Concurrent assistant sessions per worker: ASGI app vs threaded Flask
+
+Opens --sessions chat sessions against one worker process. Sessions arrive
+evenly over --ramp seconds and each sends a scripted five-message booking
+conversation, pausing --think seconds (+/- 50%) before every message the
+way a customer types. Each setup runs in a fresh interpreter:
+
+  * asgi: assistant_asgi over WebSockets on one event loop, turns on
+    --turn-threads threads; a connection stays open for the whole chat
+  * flask-requests: today's Flask endpoints, a request per message, served
+    by --threads threads (a threaded WSGI worker)
+  * flask-held: the Flask app with --threads threads where every open chat
+    holds a thread for its whole conversation, as a WebSocket or long-poll
+    connection does under a threaded WSGI server
+
+A session that waits longer than --timeout for its greeting gives up.
+Reports sessions served and timed out, peak open sessions, time to the
+greeting, reply latency p50/p95/p99, messages per second, peak threads
+and peak RSS.
+
+Run from the barbershop directory:
+
+    python -m benchmarks.bench_assistant_concurrency
+    python -m benchmarks.bench_assistant_concurrency --sessions 5000 --modes asgi --output asgi.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.fixtures import fixture_database
+from benchmarks.suite import WEEKDAYS, TIMES, _catalog, peak_rss_mb, summarise
+
+MODES = ('asgi', 'flask-requests', 'flask-held')
+FIRST_NAMES = ['Alex', 'Sam', 'Jordan', 'Chris', 'Taylor', 'Morgan']
+LAST_NAMES = ['Reed', 'Lopez', 'Kim', 'Patel', 'Nowak', 'Ferreira']
+
+
+class Stats:
+    """Counts and latencies shared by all sessions of a run"""
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.greetings = []
+        self.turns = []
+        self.errors = 0
+        self.served = 0
+        self.timed_out = 0
+        self.open = 0
+        self.peak_open = 0
+        self.peak_threads = threading.active_count()
+        self._lock = threading.Lock()
+
+    def opened(self, waited):
+        """Record a greeting after ``waited`` seconds; False if the client had given up"""
+        with self._lock:
+            if waited > self.timeout:
+                self.timed_out += 1
+                return False
+            self.greetings.append(waited)
+            self.open += 1
+            self.peak_open = max(self.peak_open, self.open)
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            return True
+
+    def turn(self, elapsed, ok):
+        with self._lock:
+            self.turns.append(elapsed)
+            self.errors += not ok
+
+    def closed(self):
+        with self._lock:
+            self.open -= 1
+            self.served += 1
+
+    def results(self, seconds):
+        turns = summarise(self.turns, self.errors)
+        turns.pop('req_per_s', None)  # one client's rate; messages_per_s below is the worker's
+        return {'served': self.served, 'timed_out': self.timed_out, 'peak_open_sessions': self.peak_open,
+                'peak_threads': self.peak_threads, 'seconds': round(seconds, 2),
+                'messages_per_s': round(len(self.turns) / seconds, 1) if seconds else 0.0,
+                'greeting': summarise(self.greetings, 0), 'reply': turns}
+
+
+def _sessions(app, args):
+    """(session_id, start offset, [(think seconds, message)]) for every session"""
+    with app.app_context():
+        barbers, _ = _catalog()
+    for i in range(args.sessions):
+        rng = random.Random(args.seed * 1000003 + i)
+        messages = ["Hi, I'd like to book a haircut",
+                    f"with {rng.choice(barbers)[2]} on {rng.choice(WEEKDAYS)}",
+                    rng.choice(TIMES),
+                    f"my name is {rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                    "yes"]
+        script = [(args.think * rng.uniform(0.5, 1.5), message) for message in messages]
+        yield f"concurrency-{i}", args.ramp * i / args.sessions, script
+
+
+async def _asgi_session(app, session_id, start, script, stats):
+    await asyncio.sleep(start)
+    to_app, from_app = asyncio.Queue(), asyncio.Queue()
+    scope = {'type': 'websocket', 'path': '/ws/assistant', 'headers': [],
+             'query_string': f"session_id={session_id}".encode()}
+    arrived = time.perf_counter()
+    connection = asyncio.ensure_future(app(scope, to_app.get, from_app.put))
+    await to_app.put({'type': 'websocket.connect'})
+    if (await from_app.get())['type'] != 'websocket.accept':
+        stats.opened(float('inf'))
+        await connection
+        return
+    await from_app.get()  # greeting
+    if not stats.opened(time.perf_counter() - arrived):
+        await to_app.put({'type': 'websocket.disconnect', 'code': 1000})
+        await connection
+        return
+
+    for think, message in script:
+        await asyncio.sleep(think)
+        sent = time.perf_counter()
+        await to_app.put({'type': 'websocket.receive', 'text': json.dumps({'message': message})})
+        event = await from_app.get()
+        ok = event['type'] == 'websocket.send' and 'error' not in json.loads(event['text'])
+        stats.turn(time.perf_counter() - sent, ok)
+        if event['type'] != 'websocket.send':
+            break
+    await to_app.put({'type': 'websocket.disconnect', 'code': 1000})
+    await connection
+    stats.closed()
+
+
+def run_asgi(app, args, stats):
+    from assistant_asgi import AssistantASGI
+
+    asgi_app = AssistantASGI(app, threads=args.turn_threads, max_connections=args.sessions)
+
+    async def run():
+        await asgi_app.startup()
+        await asyncio.gather(*(_asgi_session(asgi_app, session_id, start, script, stats)
+                               for session_id, start, script in _sessions(app, args)))
+        await asgi_app.shutdown()
+
+    asyncio.run(run())
+
+
+def run_flask_requests(app, args, stats):
+    """A request per message; the pool stands in for the WSGI worker's threads"""
+    local = threading.local()
+
+    def post(url, payload):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+        return client.post(url, json=payload).status_code == 200
+
+    async def session(session_id, start, script):
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(start)
+        arrived = time.perf_counter()
+        await loop.run_in_executor(pool, post, '/api/assistant/start', {'session_id': session_id})
+        if not stats.opened(time.perf_counter() - arrived):
+            return
+        for think, message in script:
+            await asyncio.sleep(think)
+            sent = time.perf_counter()
+            ok = await loop.run_in_executor(pool, post, '/api/assistant/message',
+                                            {'session_id': session_id, 'message': message})
+            stats.turn(time.perf_counter() - sent, ok)
+        stats.closed()
+
+    async def run():
+        await asyncio.gather(*(session(*spec) for spec in _sessions(app, args)))
+
+    with ThreadPoolExecutor(args.threads) as pool:
+        asyncio.run(run())
+
+
+def run_flask_held(app, args, stats):
+    """Every open chat keeps one of the worker's threads until it ends"""
+
+    def session(session_id, arrived, script):
+        if time.perf_counter() - arrived > stats.timeout:
+            stats.opened(float('inf'))
+            return
+        client = app.test_client()
+        client.post('/api/assistant/start', json={'session_id': session_id})
+        if not stats.opened(time.perf_counter() - arrived):
+            return
+        for think, message in script:
+            time.sleep(think)
+            sent = time.perf_counter()
+            response = client.post('/api/assistant/message', json={'session_id': session_id, 'message': message})
+            stats.turn(time.perf_counter() - sent, response.status_code == 200)
+        stats.closed()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as pool:
+        for session_id, start, script in _sessions(app, args):
+            time.sleep(max(0.0, started + start - time.perf_counter()))
+            pool.submit(session, session_id, time.perf_counter(), script)
+
+
+RUNNERS = {'asgi': run_asgi, 'flask-requests': run_flask_requests, 'flask-held': run_flask_held}
+
+
+def run_child(args):
+    """Run one setup against ``args.database`` and print its results as JSON"""
+    import logging
+    logging.disable(logging.WARNING)
+    from app import create_app
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database, 'EMAIL_OUTBOX_AUTOSTART': False})
+    stats = Stats(args.timeout)
+    started = time.perf_counter()
+    RUNNERS[args.child](app, args, stats)
+    print(json.dumps({'mode': args.child, **stats.results(time.perf_counter() - started),
+                      'peak_rss_mb': peak_rss_mb()}))
+
+
+def run_all(args):
+    env = dict(os.environ, EMAIL_TEST_MODE='true', ASSISTANT_SESSION_STORE='memory',
+               ASSISTANT_MAX_SESSIONS=str(max(args.sessions, 10000)), PYTHONPATH=os.getcwd())
+    settings = ['--sessions', str(args.sessions), '--think', str(args.think), '--ramp', str(args.ramp),
+                '--timeout', str(args.timeout), '--threads', str(args.threads),
+                '--turn-threads', str(args.turn_threads), '--seed', str(args.seed)]
+    results = []
+    for mode in args.modes:
+        # A fresh copy per setup, so bookings made by one don't take the next one's slots
+        uri = fixture_database(locations=args.locations, barbers_per_location=args.barbers_per_location,
+                               history_days=args.history_days, future_days=0, cache_dir=args.cache_dir)
+        print(f"{mode}: {args.sessions} sessions ...", file=sys.stderr)
+        output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_assistant_concurrency',
+                                 '--child', mode, '--database', uri, *settings],
+                                env=env, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        results.append(result)
+        print(f"  served {result['served']}, timed out {result['timed_out']}, "
+              f"peak open {result['peak_open_sessions']}, threads {result['peak_threads']}, "
+              f"{result['messages_per_s']} msg/s, greeting p95 {result['greeting'].get('p95_ms', 0)} ms, "
+              f"reply p50/p95/p99 {result['reply'].get('p50_ms', 0)}/{result['reply'].get('p95_ms', 0)}/"
+              f"{result['reply'].get('p99_ms', 0)} ms, {result['reply']['errors']} errors, "
+              f"peak RSS {result['peak_rss_mb']} MB", file=sys.stderr)
+
+    document = json.dumps({'settings': {key: getattr(args, key) for key in (
+        'sessions', 'think', 'ramp', 'timeout', 'threads', 'turn_threads', 'seed')}, 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(document + '\n')
+    else:
+        print(document)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--sessions', type=int, default=1000, help="Chat sessions opened against the worker")
+    parser.add_argument('--think', type=float, default=1.0, help="Mean seconds between a reply and the next message")
+    parser.add_argument('--ramp', type=float, default=5.0, help="Seconds over which the sessions arrive")
+    parser.add_argument('--timeout', type=float, default=10.0, help="Seconds a session waits for its greeting")
+    parser.add_argument('--threads', type=int, default=32, help="Threads of the Flask worker")
+    parser.add_argument('--turn-threads', type=int, default=int(os.getenv('ASSISTANT_DB_THREADS', 8)),
+                        help="Turn threads of the ASGI app")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--locations', type=int, default=5)
+    parser.add_argument('--barbers-per-location', type=int, default=6)
+    parser.add_argument('--history-days', type=int, default=60)
+    parser.add_argument('--cache-dir', default=os.path.join(tempfile.gettempdir(), 'barbershop-bench-fixtures'),
+                        help="Where generated databases are kept between runs")
+    parser.add_argument('--output', help="Write the JSON results here instead of stdout")
+    parser.add_argument('--child', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--database', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+    else:
+        run_all(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Cold start: time from importing the app to its first response
+
+Starts fresh interpreters against a synthetic SQLite database and times, in
+each one, importing the app, getting it ready and serving a first page and
+a first assistant reply through the test client. Two trees are compared:
+
+  * before: the code as it was before the app factory, exported from git
+    (--before, by default the parent of the commit that added create_app);
+    importing app.py runs create_all and the migrations, builds the
+    assistant and starts the outbox threads
+  * after: this tree's create_app(); the schema comes from ``flask init-db``
+    and the assistant is built on the first assistant request
+
+Each tree gets its own copy of the database. Run from the barbershop
+directory of a git checkout:
+
+    python -m benchmarks.bench_cold_start --runs 10
+    python -m benchmarks.bench_cold_start --before <revision>
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+from benchmarks.fixtures import fixture_database
+
+CHILD = r"""
+import json, sys, time
+started = time.perf_counter()
+import app as module
+imported = time.perf_counter()
+app = module.app if sys.argv[1] == 'before' else module.create_app()
+ready = time.perf_counter()
+client = app.test_client()
+page = client.get('/book')
+served = time.perf_counter()
+reply = client.post('/api/assistant/start', json={'session_id': 'cold-start'})
+assistant = time.perf_counter()
+assert page.status_code == 200 and reply.status_code == 200
+print(json.dumps({'import': imported - started, 'ready': ready - started,
+                  'first request': served - started, 'first assistant reply': assistant - started}))
+"""
+
+
+def _git(*args, cwd=None):
+    return subprocess.run(['git', *args], cwd=cwd, check=True, capture_output=True).stdout
+
+
+def factory_parent(top, package):
+    """The commit before the one that added create_app to app.py"""
+    added = _git('log', '--format=%H', '--reverse', '-S', 'def create_app', '--',
+                 f"{package}/app.py", cwd=top).decode().split()
+    if not added:
+        sys.exit("No commit adds create_app to app.py; pass --before")
+    return f"{added[0]}^"
+
+
+def export_tree(revision, top, package):
+    """Extract ``package`` at ``revision`` into a temporary directory and return its path"""
+    target = tempfile.mkdtemp(prefix='barbershop-cold-start-')
+    archive = _git('archive', '--format=tar', revision, package, cwd=top)
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(target)
+    return os.path.join(target, package)
+
+
+def run(mode, tree, uri):
+    env = dict(os.environ, DATABASE_URI=uri, EMAIL_TEST_MODE='true', PYTHONPATH=tree)
+    output = subprocess.run([sys.executable, '-c', CHILD, mode], cwd=tree, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--before', help="Revision to compare against (default: before the app factory)")
+    args = parser.parse_args()
+
+    here = os.getcwd()
+    top = _git('rev-parse', '--show-toplevel').decode().strip()
+    package = os.path.relpath(here, top)
+    before = args.before or factory_parent(top, package)
+    trees = {'before': export_tree(before, top, package), 'after': here}
+    databases = {mode: fixture_database(locations=2, barbers_per_location=2, history_days=90) for mode in trees}
+
+    # Alternate the trees so disk cache and CPU frequency affect both alike
+    results = {mode: [] for mode in trees}
+    for _ in range(args.runs):
+        for mode, tree in trees.items():
+            results[mode].append(run(mode, tree, databases[mode]))
+
+    medians = {mode: {stage: statistics.median(s[stage] for s in samples) * 1000 for stage in samples[0]}
+               for mode, samples in results.items()}
+    print(f"Median of {args.runs} cold starts (ms); before = {before}")
+    for mode, stages in medians.items():
+        print(f"  {mode:<7}" + '  '.join(f"{stage} {ms:7.1f}" for stage, ms in stages.items()))
+    for stage in medians['after']:
+        change = medians['after'][stage] - medians['before'][stage]
+        print(f"  {stage:<22}{change:+8.1f} ms ({change / medians['before'][stage]:+.0%})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Assistant entity extraction throughput
+
+Generates a temporary database with a large catalog (hundreds of barbers
+and services), then measures how many messages per second
+BarberAssistant._extract_entities handles. For comparison it also times
+the previous approach: a Python loop doing a lowercase substring test per
+barber, service and keyword, with time patterns compiled per message.
+
+Run from the barbershop directory:
+
+    python -m benchmarks.bench_entity_extraction --barbers 500 --services 200
+"""
+import argparse
+import os
+import random
+import re
+import time
+from benchmarks.fixtures import fixture_database
+
+MESSAGES = [
+    "I want to book a haircut",
+    "Can I see {barber} tomorrow afternoon?",
+    "any barber is fine, friday at 3:30pm please",
+    "I'd like a {service} with {barber} on monday",
+    "15:00",
+    "my name is Alex Morgan",
+    "day after tomorrow in the morning",
+    "do you have anything next week around 11am for a {service}?",
+    "yes",
+    "whoever is free on saturday evening",
+]
+
+
+def legacy_extract(message, snapshot):
+    """The substring-loop extraction this module replaced (barber, date, time, service)"""
+    extracted = {}
+    if any(phrase in message.lower() for phrase in ["any barber", "anyone", "whoever", "anybody"]):
+        extracted["any_barber"] = True
+    else:
+        for barber in snapshot.barbers:
+            if barber.name.lower() in message.lower():
+                extracted["barber_id"] = barber.id
+                break
+    for keyword in ["today", "tomorrow", "day after tomorrow", "next week",
+                    "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]:
+        if keyword.lower() in message.lower():
+            extracted["date"] = keyword
+            break
+    for keyword in ["morning", "afternoon", "evening"]:
+        if keyword.lower() in message.lower():
+            extracted["time"] = keyword
+            break
+    if "time" not in extracted:
+        for pattern in [r'(\d{1,2})(?::(\d{2}))?\s*(am|pm)', r'(\d{1,2})(?::(\d{2}))']:
+            if re.search(pattern, message.lower()):
+                extracted["time"] = pattern
+                break
+    for service in snapshot.services:
+        if service.name.lower() in message.lower():
+            extracted["service_id"] = service.id
+            break
+    return extracted
+
+
+def _throughput(function, messages, seconds):
+    """Messages per second over roughly ``seconds`` of work"""
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        for message in messages:
+            function(message)
+        count += len(messages)
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--barbers', type=int, default=500)
+    parser.add_argument('--services', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    # Only the catalog matters here, so no appointments
+    os.environ['DATABASE_URI'] = fixture_database(locations=10, barbers_per_location=max(1, args.barbers // 10),
+                                                  services=args.services, utilisation=0)
+    from app import create_app
+    from catalog import catalog
+    from session_store import MemorySessionStore
+    from voice_assistant import BarberAssistant
+
+    app = create_app()
+
+    rng = random.Random(11)
+    with app.app_context():
+        snapshot = catalog.get()
+        messages = [template.format(barber=rng.choice(snapshot.barbers).name,
+                                    service=rng.choice(snapshot.services).name)
+                    for template in MESSAGES for _ in range(10)]
+
+        assistant = BarberAssistant(app, session_store=MemorySessionStore())
+        started = time.perf_counter()
+        assistant._entity_matcher()
+        print(f"Compiled matcher for {len(snapshot.barbers)} barbers and {len(snapshot.services)} services "
+              f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+        current = _throughput(assistant._extract_entities, messages, args.seconds)
+        legacy = _throughput(lambda message: legacy_extract(message, snapshot), messages, args.seconds)
+
+    print(f"_extract_entities:        {current:>10.0f} messages/s")
+    print(f"substring loop (previous): {legacy:>9.0f} messages/s")
+    print(f"speedup: {current / legacy:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""SMTP sending throughput: one connection per message vs the connection pool
+
+Starts a local SMTP sink (aiosmtpd if it is installed, otherwise a small
+built-in server) and sends the same messages three ways:
+
+  * per-message: connect, EHLO, send, QUIT for every message (the old
+    email_service behaviour, minus STARTTLS/login)
+  * pool: email_service.SMTPConnectionPool.send from several threads
+  * batch: SMTPConnectionPool.send_many over one session
+
+--latency-ms adds a delay before every server reply to mimic a remote
+SMTP server; connection setup costs several round trips, which is what
+the pool saves.
+
+Afterwards the pool is checked against a server that answers DATA with a
+550 for some recipients: the refused message must fail without a retry
+and the session must be reused. Exits with status 1 if it isn't.
+
+Run from the barbershop directory:
+
+    python -m benchmarks.bench_smtp --messages 500 --latency-ms 5
+"""
+import argparse
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.text import MIMEText
+import smtplib
+
+
+# Messages to recipients containing this are refused with a 550 after DATA
+REJECTED_RECIPIENT = 'reject'
+
+
+class _SinkHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to accept and discard messages"""
+
+    def reply(self, line):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.server.connections += 1
+        rejecting = False
+        self.reply("220 localhost bench sink")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip().upper()
+            if command.startswith(("EHLO", "HELO")):
+                self.reply("250 localhost")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                if rejecting:
+                    self.server.rejected += 1
+                    self.reply("550 Message rejected")
+                else:
+                    self.server.received += 1
+                    self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:  # MAIL, RCPT, RSET, NOOP
+                if command.startswith("RCPT"):
+                    rejecting = rejecting or REJECTED_RECIPIENT.upper() in command
+                elif command.startswith(("MAIL", "RSET")):
+                    rejecting = False
+                self.reply("250 OK")
+
+
+class _Sink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_sink(latency):
+    """Start an SMTP sink on a free local port; returns (port, stop, received)"""
+    try:
+        from aiosmtpd.controller import Controller
+    except ImportError:
+        Controller = None
+
+    if Controller is not None and not latency:
+        class Handler:
+            received = 0
+
+            async def handle_DATA(self, server, session, envelope):
+                Handler.received += 1
+                return "250 OK"
+
+        controller = Controller(Handler(), hostname='127.0.0.1', port=0)
+        controller.start()
+        return controller.server.sockets[0].getsockname()[1], controller.stop, lambda: Handler.received
+
+    server = _start_builtin_sink(latency)
+    return server.server_address[1], server.shutdown, lambda: server.received
+
+
+def _start_builtin_sink(latency=0.0):
+    server = _Sink(('127.0.0.1', 0), _SinkHandler)
+    server.latency = latency
+    server.received = server.rejected = server.connections = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_messages(count, recipient='client{}@example.com'):
+    messages = []
+    for i in range(count):
+        message = MIMEText(f"<p>Reminder {i}</p>", 'html')
+        message['Subject'] = 'Barbershop Appointment Reminder'
+        message['From'] = 'shop@example.com'
+        message['To'] = recipient.format(i)
+        messages.append(message)
+    return messages
+
+
+def check_rejections():
+    """Problems with how the pool handles a 550 reply to DATA (empty if none)"""
+    from email_service import SMTPConnectionPool
+
+    server = _start_builtin_sink()
+    pool = SMTPConnectionPool('127.0.0.1', server.server_address[1], size=1, starttls=False)
+    problems = []
+    try:
+        refused = make_messages(1, f"{REJECTED_RECIPIENT}{{}}@example.com")[0]
+        try:
+            pool.send(refused)
+            problems.append("send: a refused message raised no error")
+        except smtplib.SMTPDataError:
+            pass
+        results = pool.send_many([*make_messages(2), refused, *make_messages(2)])
+        outcomes = [type(result).__name__ if result else 'sent' for result in results]
+        if outcomes != ['sent', 'sent', 'SMTPDataError', 'sent', 'sent']:
+            problems.append(f"send_many: outcomes {outcomes}")
+    finally:
+        pool.close()
+        server.shutdown()
+    if server.rejected != 2:
+        problems.append(f"the refused message was sent {server.rejected} times, expected once per call")
+    if server.connections != 1:
+        problems.append(f"{server.connections} connections opened, expected 1 (refusals must not reconnect)")
+    return problems
+
+
+def send_per_message(port, messages):
+    for message in messages:
+        with smtplib.SMTP('127.0.0.1', port) as smtp:
+            smtp.ehlo()
+            smtp.send_message(message)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    args = parser.parse_args()
+
+    from email_service import SMTPConnectionPool
+
+    port, stop, received = start_sink(args.latency_ms / 1000)
+    messages = make_messages(args.messages)
+    results = {}
+
+    started = time.perf_counter()
+    send_per_message(port, messages)
+    results['per-message'] = time.perf_counter() - started
+
+    pool = SMTPConnectionPool('127.0.0.1', port, size=args.threads, starttls=False)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        list(executor.map(pool.send, messages))
+    results[f'pool ({args.threads} threads)'] = time.perf_counter() - started
+    pool.close()
+
+    pool = SMTPConnectionPool('127.0.0.1', port, size=1, starttls=False, max_messages=len(messages))
+    started = time.perf_counter()
+    failures = [result for result in pool.send_many(messages) if result is not None]
+    results['batch (1 session)'] = time.perf_counter() - started
+    pool.close()
+
+    stop()
+    print(f"{args.messages} messages per run, {args.latency_ms} ms server latency, "
+          f"{received()} received in total, {len(failures)} batch failures")
+    baseline = results['per-message']
+    for name, elapsed in results.items():
+        print(f"  {name:<22}{args.messages / elapsed:>10.0f} messages/s{baseline / elapsed:>8.1f}x")
+
+    problems = check_rejections()
+    for problem in problems:
+        print(f"FAIL {problem}")
+    if problems:
+        sys.exit(1)
+    print("OK: refused messages fail without a retry or reconnect")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Read/write contention on SQLite: default settings vs the tuned pragmas
+
+Writer threads book appointments through POST /book/confirm while reader
+threads page through GET /admin/dashboard, all against one SQLite file,
+first with SQLite's defaults (rollback journal, synchronous=FULL), then
+with the pragmas db.init_db applies (WAL, synchronous=NORMAL, larger page
+cache, mmap) and finally with the dashboard also routed to the read-only
+engine. Reports throughput and latency per route plus how many requests
+failed or were turned away because the database was locked.
+
+Run from the barbershop directory:
+
+    python -m benchmarks.bench_sqlite_contention --writers 4 --readers 8 --seconds 10
+"""
+import argparse
+import os
+import random
+import statistics
+import threading
+import time
+from datetime import date, timedelta
+from benchmarks.fixtures import fixture_database
+
+DEFAULT_PRAGMAS = {'busy_timeout': '', 'journal_mode': 'DELETE', 'synchronous': 'FULL',
+                   'cache_size': '', 'mmap_size': ''}
+
+SLOT_TIMES = [f"{hour:02d}:{minute:02d}" for hour in range(9, 19) for minute in (0, 30)]
+
+
+def _catalog(app):
+    from models import Barber, Service
+
+    with app.app_context():
+        return ([(barber.id, barber.location_id) for barber in Barber.query.all()],
+                [service.id for service in Service.query.all()])
+
+
+def _writer(app, barbers, services, stop, results, seed):
+    rng = random.Random(seed)
+    client = app.test_client()
+    while not stop.is_set():
+        barber_id, location_id = rng.choice(barbers)
+        started = time.perf_counter()
+        response = client.post('/book/confirm', data={
+            'first_name': 'Load', 'last_name': f"Test {seed}", 'email': 'load@example.com',
+            'location_id': location_id, 'barber_id': barber_id, 'services': [rng.choice(services)],
+            'date': (date.today() + timedelta(days=rng.randint(1, 90))).isoformat(),
+            'time': rng.choice(SLOT_TIMES)})
+        elapsed = time.perf_counter() - started
+        # A redirect back to the time picker means the slot was taken or the database stayed locked
+        results.append(('book', response.status_code == 200, elapsed))
+
+
+def _reader(app, history_days, stop, results, seed):
+    rng = random.Random(seed)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['admin'] = True
+    while not stop.is_set():
+        day = date.today() - timedelta(days=rng.randint(1, history_days))
+        started = time.perf_counter()
+        response = client.get(f"/admin/dashboard?date={day.isoformat()}")
+        results.append(('dashboard', response.status_code == 200, time.perf_counter() - started))
+
+
+def run(label, config, args):
+    from app import create_app
+
+    uri = fixture_database(config=config, locations=args.locations, barbers_per_location=2,
+                           history_days=args.history_days, future_days=0)
+    app = create_app({'SQLALCHEMY_DATABASE_URI': uri, 'EMAIL_OUTBOX_AUTOSTART': False, **config})
+    barbers, services = _catalog(app)
+
+    stop = threading.Event()
+    results = []
+    threads = [threading.Thread(target=_writer, args=(app, barbers, services, stop, results, i))
+               for i in range(args.writers)]
+    threads += [threading.Thread(target=_reader, args=(app, args.history_days, stop, results, 1000 + i))
+                for i in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    print(f"{label}:")
+    for route in ('book', 'dashboard'):
+        samples = [(ok, elapsed) for name, ok, elapsed in results if name == route]
+        latencies = sorted(elapsed * 1000 for _, elapsed in samples)
+        failed = sum(1 for ok, _ in samples if not ok)
+        p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0
+        print(f"  {route:<10}{len(samples) / args.seconds:>8.1f} req/s  "
+              f"p50 {statistics.median(latencies) if latencies else 0:7.1f} ms  "
+              f"p95 {p95:7.1f} ms  max {latencies[-1] if latencies else 0:7.1f} ms  "
+              f"{failed} rejected/failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--locations', type=int, default=2, help="Locations with two barbers each")
+    parser.add_argument('--history-days', type=int, default=365, help="Days of existing appointments")
+    args = parser.parse_args()
+
+    os.environ['EMAIL_TEST_MODE'] = 'true'
+    import logging
+    logging.disable(logging.WARNING)  # locked-database errors are counted, not printed
+
+    print(f"{args.writers} writers and {args.readers} readers for {args.seconds:.0f}s, "
+          f"{args.locations * 2} barbers with {args.history_days} days of appointments")
+    run("SQLite defaults (rollback journal, synchronous=FULL)",
+        {'SQLITE_PRAGMAS': DEFAULT_PRAGMAS, 'READ_ONLY_ROUTING': False}, args)
+    run("Tuned (WAL, synchronous=NORMAL, cache_size, mmap_size)", {'READ_ONLY_ROUTING': False}, args)
+    run("Tuned, dashboard on the read-only engine", {'READ_ONLY_ROUTING': True}, args)
+
+
+if __name__ == '__main__':
+    main()
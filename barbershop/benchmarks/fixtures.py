@@ -0,0 +1,69 @@
+"""Synthetic databases shared by the benchmarks
+
+Every benchmark builds its data with synthetic_data.generate, so results
+are comparable between runs and machines: the same parameters give the
+same rows.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+from datetime import date
+
+# Appointments per barber per calendar day that generate() books at its default utilisation
+APPOINTMENTS_PER_BARBER_DAY = 5.8
+
+
+def history_days_for(appointments, barbers):
+    """Days of history that give roughly ``appointments`` appointments for ``barbers`` barbers"""
+    return max(1, round(appointments / (barbers * APPOINTMENTS_PER_BARBER_DAY)))
+
+
+def _build(path, config, params):
+    from app import create_app
+    from db import db, create_schema
+    from synthetic_data import generate
+
+    app = create_app({**(config or {}), 'SQLALCHEMY_DATABASE_URI': f"sqlite:///{path}",
+                      'EMAIL_OUTBOX_AUTOSTART': False})
+    with app.app_context():
+        create_schema()
+        generate(**params)
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()  # the last connection to close folds the WAL into the file
+
+
+def _cache_key(config, params):
+    import synthetic_data
+
+    with open(synthetic_data.__file__, 'rb') as source:
+        generator = hashlib.sha1(source.read()).hexdigest()
+    params = {'today': date.today(), **params}
+    key = repr((generator, sorted((config or {}).items()), sorted(params.items())))
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def fixture_database(prefix='barbershop-bench-', config=None, cache_dir=None, **params):
+    """Create a temporary SQLite database filled by synthetic_data.generate
+
+    ``config`` is applied to the app that writes the data (e.g. the SQLite
+    pragmas the benchmark will use, since the journal mode sticks to the
+    file); other keyword arguments go to generate(). With ``cache_dir`` the
+    generated file is kept there and copied for later calls with the same
+    arguments on the same day, which saves minutes for the large datasets.
+    Returns the database URI.
+    """
+    db_file = os.path.join(tempfile.mkdtemp(prefix=prefix), 'bench.db')
+    if cache_dir is None:
+        _build(db_file, config, params)
+        return f"sqlite:///{db_file}"
+
+    cached = os.path.join(cache_dir, f"fixture-{_cache_key(config, params)}.db")
+    if not os.path.exists(cached):
+        os.makedirs(cache_dir, exist_ok=True)
+        building = f"{cached}.{os.getpid()}.tmp"
+        _build(building, config, params)
+        os.replace(building, cached)
+    shutil.copyfile(cached, db_file)
+    return f"sqlite:///{db_file}"
@@ -0,0 +1,112 @@
+"""Query budget check for every route
+
+Runs each route in app.py and a full assistant booking conversation
+against a synthetic database with query auditing on, then prints how many
+statements each request issued against its budget and any statement
+repeated often enough to look like an N+1. Exits with status 1 if a
+request goes over budget, repeats a statement, or a route has no request
+here (so new routes can't skip the check).
+
+Run from the barbershop directory:
+
+    python -m benchmarks.query_budgets
+"""
+import argparse
+import os
+import sys
+from datetime import date, timedelta
+from benchmarks.fixtures import fixture_database
+
+
+def _next_weekday(weekday, after):
+    return after + timedelta(days=(weekday - after.weekday() - 1) % 7 + 1)
+
+
+def _requests(app, barber_name):
+    """(method, url, options) for every route, in an order where each step's data exists"""
+    today = date.today()
+    monday = _next_weekday(0, today).isoformat()
+    tuesday = _next_weekday(1, today).isoformat()
+    booking = {'location_id': 1, 'barber_id': 1, 'services': [1, 2], 'date': tuesday, 'time': '10:00'}
+    chat = [('/api/assistant/start', {'session_id': 'budget'})]
+    chat += [('/api/assistant/message', {'session_id': 'budget', 'message': message})
+             for message in ("I want to book a haircut", f"with {barber_name} on monday", "3pm",
+                             "my name is Alex Morgan", "yes")]
+    chat += [('/api/assistant/history', {'session_id': 'budget', 'cursor': 0})]
+
+    yield 'GET', '/', {}
+    yield 'GET', '/assistant', {}
+    for url, payload in chat:
+        yield 'POST', url, {'json': payload}
+    # Twice: the first request fills the catalog caches, the second should be served from them
+    for _ in range(2):
+        yield 'GET', '/book', {}
+        yield 'GET', '/book/specialist?location_id=1', {}
+        yield 'GET', '/book/services?location_id=1&barber_id=1', {}
+    yield 'GET', '/book/datetime?location_id=1&barber_id=1&services=1', {}
+    yield 'GET', f"/api/availability?location_id=1&barber_id=1&services=1&date={monday}&days=7", {}
+    yield 'GET', f"/api/availability?location_id=1&barber_id=any&services=1&services=2&date={monday}&days=7", {}
+    yield 'GET', f"/book/review?location_id=1&barber_id=1&services=1&services=2&date={tuesday}&time=10:00", {}
+    yield 'POST', '/book/confirm', {'data': {'first_name': 'Query', 'last_name': 'Budget',
+                                            'email': 'budget@example.com', **booking}}
+    yield 'GET', '/admin/login', {}
+    yield 'POST', '/admin/login', {'data': {'username': os.getenv('ADMIN_USERNAME', 'admin'),
+                                            'password': os.getenv('ADMIN_PASSWORD', 'password')}}
+    yield 'GET', '/admin/dashboard', {}
+    yield 'GET', f"/admin/dashboard?date={(today - timedelta(days=1)).isoformat()}&per_page=200", {}
+    yield 'GET', '/admin/cache-stats', {}
+    yield 'GET', '/metrics', {}
+    with app.app_context():
+        from models import Appointment
+        appointment_id = Appointment.query.filter_by(client_email='budget@example.com').one().id
+    yield 'GET', f"/admin/appointment/{appointment_id}", {}
+    yield 'POST', f"/admin/appointment/{appointment_id}", {
+        'data': {'location_id': 1, 'barber_id': 1, 'client_name': 'Query Budget', 'client_email': 'budget@example.com',
+                 'date': tuesday, 'time': '11:00', 'services': [1]}}
+    yield 'POST', f"/admin/appointment/delete/{appointment_id}", {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--history-days', type=int, default=60)
+    parser.add_argument('--verbose', action='store_true', help="Print every statement of failing requests")
+    args = parser.parse_args()
+
+    os.environ['EMAIL_TEST_MODE'] = 'true'
+    # No future appointments, so the booking flows find free slots
+    uri = fixture_database(locations=2, barbers_per_location=3, history_days=args.history_days, future_days=0)
+    from app import create_app
+    from models import Barber
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': uri, 'EMAIL_OUTBOX_AUTOSTART': False, 'QUERY_AUDIT': True})
+    audit = app.extensions['query_audit']
+    with app.app_context():
+        barber_name = Barber.query.order_by(Barber.id).first().name
+
+    client = app.test_client()
+    failures = 0
+    for method, url, options in _requests(app, barber_name):
+        response = client.open(url, method=method, **options)
+        report = audit.reports[-1]
+        problems = report.problems
+        if response.status_code >= 400:
+            problems.append(f"status {response.status_code}")
+        print(f"{'FAIL' if problems else 'ok':<5}{method:<5}{url[:70]:<72}{report.count:>4} / {report.budget:<3}"
+              f"{'  ' + '; '.join(problems) if problems else ''}")
+        if problems:
+            failures += 1
+            if args.verbose:
+                for statement in report.statements:
+                    print(f"        {' '.join(statement.split())[:160]}")
+
+    routes = {rule.rule for rule in app.url_map.iter_rules() if rule.endpoint != 'static'}
+    missing = routes - {report.route for report in audit.reports}
+    for route in sorted(missing):
+        print(f"FAIL {route} has no request in this check")
+    if failures or missing:
+        sys.exit(1)
+    print("OK: every route within its query budget")
+
+
+if __name__ == '__main__':
+    main()
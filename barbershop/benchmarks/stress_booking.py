@@ -0,0 +1,157 @@
+"""Concurrent booking stress test
+
+Fires hundreds of parallel booking attempts at a small set of contested
+slots through booking.book_appointment, then checks that no two stored
+appointments overlap. Some attempts ask for a barber at a location they
+don't work at, which must be rejected. Exits with status 1 if any overlap
+is found or a mismatched booking got through.
+
+Run from the barbershop directory:
+
+    python -m benchmarks.stress_booking --mode thread --workers 32 --attempts 500
+    python -m benchmarks.stress_booking --mode process --workers 8 --attempts 500
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import date, timedelta
+from benchmarks.fixtures import fixture_database
+
+CONTESTED_TIMES = ["09:00", "09:15", "09:30", "09:45", "10:00", "10:15", "10:30", "10:45", "11:00"]
+
+# Share of attempts that book a location 1 barber at location 2
+MISMATCH_SHARE = 0.1
+
+
+def _target_date():
+    """Next Monday, so the shop is open"""
+    today = date.today()
+    return today + timedelta(days=7 - today.weekday())
+
+
+_app = None
+
+
+def _get_app():
+    """The app for this process, created on first use"""
+    global _app
+    if _app is None:
+        from app import create_app
+        _app = create_app()
+    return _app
+
+
+def _attempt(seed):
+    """Try one booking; returns 'booked', 'taken', 'busy', 'rejected' or 'mismatch booked'"""
+    from booking import book_appointment, SlotTakenError, BarberLocationError, BookingError
+
+    rng = random.Random(seed)
+    mismatch = rng.random() < MISMATCH_SHARE
+    location_id = 2 if mismatch else 1
+    barber_id = rng.randint(1, 3) if mismatch or rng.random() >= 0.2 else None
+    services = rng.choice([[1], [2], [1, 2]])
+    with _get_app().app_context():
+        try:
+            book_appointment(location_id=location_id,
+                             barber_id=barber_id,
+                             client_name=f"Client {seed}",
+                             client_email=f"client{seed}@example.com",
+                             appointment_date=_target_date(),
+                             start_time=rng.choice(CONTESTED_TIMES),
+                             service_ids=services)
+            return 'mismatch booked' if mismatch else 'booked'
+        except SlotTakenError:
+            return 'taken'
+        except BarberLocationError:
+            return 'rejected'
+        except BookingError:
+            return 'busy'
+
+
+def _find_overlaps(app):
+    """Return a list of human-readable overlap violations"""
+    from availability import CELLS_PER_DAY, SLOT_GRANULARITY_MINUTES
+    from models import Appointment, Barber
+
+    violations = []
+    with app.app_context():
+        barber_locations = dict(Barber.query.with_entities(Barber.id, Barber.location_id))
+        barber_counts = {}
+        for location_id in barber_locations.values():
+            barber_counts[location_id] = barber_counts.get(location_id, 0) + 1
+        by_barber = {}
+        cell_loads = {}
+        for appointment in Appointment.query.all():
+            start, end = appointment.start_minute, appointment.end_minute
+            if appointment.barber_id:
+                by_barber.setdefault(appointment.barber_id, []).append((start, end, appointment.id))
+                if barber_locations[appointment.barber_id] != appointment.location_id:
+                    violations.append(f"appointment {appointment.id}: barber {appointment.barber_id} "
+                                      f"booked at location {appointment.location_id}")
+            cell_load = cell_loads.setdefault(appointment.location_id, [0] * CELLS_PER_DAY)
+            for cell in range(start // SLOT_GRANULARITY_MINUTES, -(-end // SLOT_GRANULARITY_MINUTES)):
+                cell_load[cell] += 1
+
+        for barber_id, intervals in by_barber.items():
+            intervals.sort()
+            for (s1, e1, id1), (s2, e2, id2) in zip(intervals, intervals[1:]):
+                if s2 < e1:
+                    violations.append(f"barber {barber_id}: appointments {id1} and {id2} overlap")
+
+        for location_id, cell_load in cell_loads.items():
+            barber_count = barber_counts.get(location_id, 0)
+            for cell, load in enumerate(cell_load):
+                if load > barber_count:
+                    minute = cell * SLOT_GRANULARITY_MINUTES
+                    violations.append(f"location {location_id}: {load} appointments at "
+                                      f"{minute // 60:02d}:{minute % 60:02d} for {barber_count} barbers")
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=['thread', 'process'], default='thread')
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--attempts', type=int, default=500)
+    args = parser.parse_args()
+
+    # Two shops, barbers 1-3 at location 1 and 4-6 at location 2, with services 1 (Haircut)
+    # and 2 (Beard Trim) and no appointments yet
+    os.environ['DATABASE_URI'] = fixture_database('barbershop-stress-', locations=2, barbers_per_location=3,
+                                                  services=2, utilisation=0)
+    os.environ['EMAIL_TEST_MODE'] = 'true'
+
+    app = _get_app()
+
+    if args.mode == 'thread':
+        executor = ThreadPoolExecutor(max_workers=args.workers)
+    else:
+        executor = ProcessPoolExecutor(max_workers=args.workers,
+                                       mp_context=multiprocessing.get_context('spawn'))
+
+    started = time.perf_counter()
+    with executor:
+        outcomes = list(executor.map(_attempt, range(args.attempts)))
+    elapsed = time.perf_counter() - started
+
+    violations = _find_overlaps(app)
+    print(f"{args.attempts} attempts with {args.workers} {args.mode} workers in {elapsed:.2f}s")
+    for outcome in ('booked', 'taken', 'busy', 'rejected'):
+        print(f"  {outcome}: {outcomes.count(outcome)}")
+    if 'mismatch booked' in outcomes:
+        violations.append(f"{outcomes.count('mismatch booked')} bookings of a barber at another location went through")
+
+    if violations:
+        print(f"FAILED: {len(violations)} overlaps")
+        for violation in violations[:20]:
+            print(f"  {violation}")
+        sys.exit(1)
+    print("OK: no overlapping appointments")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+"""Benchmark suite: booking funnel, admin dashboard and assistant conversations
+
+Builds synthetic databases of the requested sizes (cached between runs),
+then runs each scenario in a fresh interpreter so its peak RSS is its own:
+
+  * funnel: the whole /book -> /book/confirm flow through the test client,
+    picking a free slot from /api/availability each time
+  * dashboard: /admin/dashboard unfiltered, by date, location, barber,
+    barber and date, and a keyset page deep into the history
+  * assistant: scripted five-turn booking conversations through
+    BarberAssistant.process_message
+
+Every operation reports p50/p95/p99/max latency, requests per second (one
+client, so requests over the time spent in them) and errors, and each
+scenario its peak RSS. Results are written as JSON for comparing commits.
+
+Run from the barbershop directory:
+
+    python -m benchmarks.suite --output before.json
+    python -m benchmarks.suite --scenarios dashboard --sizes 10000 100000 1000000 --output after.json
+    python -m benchmarks.suite --compare before.json after.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from benchmarks.fixtures import fixture_database, history_days_for
+
+SCENARIOS = ('funnel', 'dashboard', 'assistant')
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday']
+TIMES = ['10am', '11:30', '2pm', '3:30pm', '4pm', 'morning', 'afternoon']
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (None where unavailable)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def summarise(latencies, errors):
+    """Latency percentiles (nearest rank) and throughput of one operation"""
+    ordered = sorted(latencies)
+    if not ordered:
+        return {'requests': 0, 'errors': errors}
+
+    def percentile(p):
+        return round(ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)] * 1000, 3)
+
+    return {'requests': len(ordered), 'errors': errors,
+            'req_per_s': round(len(ordered) / sum(ordered), 2),
+            'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+            'p50_ms': percentile(50), 'p95_ms': percentile(95), 'p99_ms': percentile(99),
+            'max_ms': round(ordered[-1] * 1000, 3)}
+
+
+class Recorder:
+    """Latencies and errors per operation; warm-up calls are timed but not kept"""
+
+    def __init__(self, warmup):
+        self.warmup = warmup
+        self.calls = {}
+        self.latencies = {}
+        self.errors = {}
+
+    def call(self, operation, function):
+        """Run ``function`` (returning True on success) and record it; returns its result"""
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        calls = self.calls[operation] = self.calls.get(operation, 0) + 1
+        if calls > self.warmup:
+            self.latencies.setdefault(operation, []).append(elapsed)
+            if not result:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+        return result
+
+    def results(self):
+        return [{'operation': operation, **summarise(latencies, self.errors.get(operation, 0))}
+                for operation, latencies in self.latencies.items()]
+
+
+def _catalog():
+    from models import Barber, Service
+
+    return ([(barber.id, barber.location_id, barber.name) for barber in Barber.query.order_by(Barber.id)],
+            [service.id for service in Service.query.order_by(Service.id)])
+
+
+def run_funnel(app, args, rng):
+    recorder = Recorder(args.warmup)
+    with app.app_context():
+        barbers, services = _catalog()
+    client = app.test_client()
+
+    def get(step, url):
+        response = recorder.call(step, lambda: client.get(url))
+        return response if response.status_code == 200 else None
+
+    for i in range(args.warmup + args.iterations):
+        barber_id, location_id, _ = rng.choice(barbers)
+        chosen = rng.sample(services, rng.choice([1, 1, 2]))
+        query = f"location_id={location_id}&barber_id={barber_id}&" + '&'.join(f"services={s}" for s in chosen)
+        start = (date.today() + timedelta(days=rng.randint(1, 21))).isoformat()
+
+        def funnel():
+            if not (get('location', '/book') and get('barber', f"/book/specialist?location_id={location_id}")
+                    and get('services', f"/book/services?location_id={location_id}&barber_id={barber_id}")
+                    and get('datetime', f"/book/datetime?{query}")):
+                return False
+            availability = get('availability', f"/api/availability?{query}&date={start}&days=7")
+            slots = [(day, slot) for day, times in availability.get_json()['slots'].items() for slot in times] \
+                if availability else []
+            if not slots:
+                return False
+            day, slot = rng.choice(slots)
+            if not get('review', f"/book/review?{query}&date={day}&time={slot}"):
+                return False
+            # A redirect back to the time picker means the slot was taken
+            return recorder.call('confirm', lambda: client.post('/book/confirm', data={
+                'first_name': 'Bench', 'last_name': f"Client {i}", 'email': f"bench{i}@example.com",
+                'location_id': location_id, 'barber_id': barber_id, 'services': chosen, 'date': day, 'time': slot
+            }).status_code == 200)
+
+        recorder.call('funnel', funnel)
+    return recorder.results()
+
+
+def run_dashboard(app, args, rng):
+    recorder = Recorder(args.warmup)
+    with app.app_context():
+        from models import Appointment
+        from sqlalchemy import func
+        barbers, _ = _catalog()
+        first_day, last_day = app.extensions['sqlalchemy'].session.query(
+            func.min(Appointment.date), func.max(Appointment.date)).one()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['admin'] = True
+
+    def random_day():
+        return (first_day + timedelta(days=rng.randint(0, (last_day - first_day).days))).isoformat()
+
+    def dashboard(query):
+        return lambda: client.get(f"/admin/dashboard?{query}").status_code == 200
+
+    for _ in range(args.warmup + args.iterations):
+        barber_id, location_id, _ = rng.choice(barbers)
+        recorder.call('first page', dashboard(''))
+        recorder.call('date', dashboard(f"date={random_day()}"))
+        recorder.call('location', dashboard(f"location_id={location_id}"))
+        recorder.call('barber', dashboard(f"barber_id={barber_id}"))
+        recorder.call('barber and date', dashboard(f"barber_id={barber_id}&date={random_day()}"))
+        recorder.call('keyset page', dashboard(f"after={random_day()},0,0"))
+    return recorder.results()
+
+
+def run_assistant(app, args, rng):
+    from session_store import MemorySessionStore
+    from voice_assistant import BarberAssistant
+
+    recorder = Recorder(args.warmup)
+    with app.app_context():
+        barbers, _ = _catalog()
+    assistant = BarberAssistant(app, session_store=MemorySessionStore())
+    first_names = ['Alex', 'Sam', 'Jordan', 'Chris', 'Taylor', 'Morgan']
+    last_names = ['Reed', 'Lopez', 'Kim', 'Patel', 'Nowak', 'Ferreira']
+
+    for i in range(args.warmup + args.iterations):
+        session_id = f"bench-{i}"
+        barber_name = rng.choice(barbers)[2]
+        turns = [("intent", "Hi, I'd like to book a haircut"),
+                 ("barber and date", f"with {barber_name} on {rng.choice(WEEKDAYS)}"),
+                 ("time", rng.choice(TIMES)),
+                 ("name", f"my name is {rng.choice(first_names)} {rng.choice(last_names)}"),
+                 ("confirm", "yes")]
+
+        def conversation():
+            assistant.start_conversation(session_id)
+            for stage, message in turns:
+                reply = recorder.call(f"turn: {stage}", lambda: assistant.process_message(session_id, message))
+            return 'confirmed' in reply  # otherwise the time was taken or not understood
+
+        recorder.call('conversation', conversation)
+    return recorder.results()
+
+
+RUNNERS = {'funnel': run_funnel, 'dashboard': run_dashboard, 'assistant': run_assistant}
+
+
+def run_child(args):
+    """Run one scenario against ``args.database`` and print its results as JSON"""
+    import logging
+    logging.disable(logging.WARNING)
+    from app import create_app
+
+    from models import Appointment
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database, 'EMAIL_OUTBOX_AUTOSTART': False})
+    with app.app_context():
+        appointments = Appointment.query.count()
+    started = time.perf_counter()
+    results = RUNNERS[args.child](app, args, random.Random(args.seed))
+    print(json.dumps({'seconds': round(time.perf_counter() - started, 2), 'peak_rss_mb': peak_rss_mb(),
+                      'appointments': appointments, 'results': results}))
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(args):
+    barbers = args.locations * args.barbers_per_location
+    document = {'created': datetime.now().isoformat(timespec='seconds'), 'commit': _commit(),
+                'python': platform.python_version(), 'platform': platform.platform(),
+                'settings': {key: getattr(args, key) for key in ('scenarios', 'sizes', 'iterations', 'warmup', 'seed',
+                                                                 'locations', 'barbers_per_location')},
+                'results': []}
+    env = dict(os.environ, EMAIL_TEST_MODE='true', PYTHONPATH=os.getcwd())
+    for size in args.sizes:
+        # Only history, so the size is the table size and the funnel finds the future open
+        params = {'locations': args.locations, 'barbers_per_location': args.barbers_per_location,
+                  'history_days': history_days_for(size, barbers), 'future_days': 0, 'seed': args.seed}
+        for scenario in args.scenarios:
+            started = time.perf_counter()
+            uri = fixture_database(cache_dir=args.cache_dir, **params)  # a fresh copy, the funnel books into it
+            print(f"{scenario} with ~{size} appointments (fixture ready in {time.perf_counter() - started:.1f}s)",
+                  file=sys.stderr)
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.suite', '--child', scenario, '--database', uri,
+                 '--iterations', str(args.iterations), '--warmup', str(args.warmup), '--seed', str(args.seed)],
+                env=env, check=True, capture_output=True, text=True).stdout
+            run = json.loads(output.splitlines()[-1])
+            for result in run['results']:
+                document['results'].append({'scenario': scenario, 'appointments': size,
+                                            'appointments_generated': run['appointments'],
+                                            'peak_rss_mb': run['peak_rss_mb'], **result})
+                print(f"  {result['operation']:<24}{result.get('req_per_s', 0):>9.1f} req/s  "
+                      f"p50 {result.get('p50_ms', 0):8.2f}  p95 {result.get('p95_ms', 0):8.2f}  "
+                      f"p99 {result.get('p99_ms', 0):8.2f} ms  {result['errors']} errors", file=sys.stderr)
+            print(f"  {run['appointments']} appointments, peak RSS {run['peak_rss_mb']} MB", file=sys.stderr)
+
+    text = json.dumps(document, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+def compare(old_path, new_path):
+    """Print how p50, p95 and req/s moved between two result files"""
+    def load(path):
+        with open(path) as f:
+            document = json.load(f)
+        return document, {(r['scenario'], r['appointments'], r['operation']): r for r in document['results']}
+
+    (old_document, old), (new_document, new) = load(old_path), load(new_path)
+    print(f"{old_document.get('commit')} -> {new_document.get('commit')}")
+    for key in sorted(old.keys() & new.keys(), key=lambda k: (k[0], k[1], k[2])):
+        scenario, size, operation = key
+        changes = []
+        for field in ('p50_ms', 'p95_ms', 'req_per_s'):
+            before, after = old[key].get(field), new[key].get(field)
+            if before and after:
+                changes.append(f"{field} {before:g} -> {after:g} ({(after - before) / before * 100:+.1f}%)")
+        print(f"  {scenario:<10}{size:>9} {operation:<24}" + "  ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10000], help="Appointments in the database")
+    parser.add_argument('--iterations', type=int, default=100, help="Measured runs of each operation")
+    parser.add_argument('--warmup', type=int, default=10, help="Unmeasured runs of each operation first")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--locations', type=int, default=10)
+    parser.add_argument('--barbers-per-location', type=int, default=6)
+    parser.add_argument('--cache-dir', default=os.path.join(tempfile.gettempdir(), 'barbershop-bench-fixtures'),
+                        help="Where generated databases are kept between runs")
+    parser.add_argument('--output', help="Write the JSON results here instead of stdout")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="Compare two result files and exit")
+    parser.add_argument('--child', choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument('--database', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    elif args.child:
+        run_child(args)
+    else:
+        run_suite(args)
+
+
+if __name__ == '__main__':
+    main()
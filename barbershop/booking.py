@@ -0,0 +1,131 @@
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import joinedload
+from db import db
+from models import Barber, Location, Appointment
+from outbox import enqueue_confirmation
+from availability import (
+    AvailabilityIndex, occupancy_cache, occupancy_mask, parse_service_ids, time_to_minutes
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class BookingError(Exception):
+    """An appointment could not be booked"""
+
+
+class SlotTakenError(BookingError):
+    """The requested slot overlaps an existing appointment"""
+
+
+class BarberLocationError(BookingError):
+    """The requested barber doesn't work at the requested location"""
+
+
+def _lock_schedule(barber_id, location_id):
+    """Take a write lock that serialises competing bookings
+
+    SQLite gets an exclusive write transaction (BEGIN IMMEDIATE) so the
+    overlap check and the insert cannot interleave with another writer.
+    Other databases always lock the location row first, because specific-
+    barber and "any barber" bookings share the location's capacity, and
+    then the barber row if one is given. Taking them in this fixed order
+    keeps competing bookings from deadlocking. A missing row is left to
+    the checks in book_appointment.
+    """
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite':
+        if not connection.connection.dbapi_connection.in_transaction:
+            connection.exec_driver_sql('BEGIN IMMEDIATE')
+        return
+    db.session.query(Location.id).filter(Location.id == location_id).with_for_update().one_or_none()
+    if barber_id:
+        db.session.query(Barber.id).filter(Barber.id == barber_id).with_for_update().one_or_none()
+
+
+def check_slot_free(location_id, barber_id, appointment_date, start_time, service_ids, moving=None):
+    """Lock the schedule and check that a slot is free
+
+    Call it in the transaction that writes the appointment, before anything
+    is flushed, and commit or roll back straight after. ``moving`` is the
+    appointment_cell() of an appointment being moved, which doesn't count
+    against its new slot.
+
+    Raises:
+        SlotTakenError: If the slot overlaps an existing appointment
+        BarberLocationError: If the barber doesn't work at the location
+    """
+    _lock_schedule(barber_id, location_id)
+
+    index = AvailabilityIndex.load(appointment_date, appointment_date,
+                                   location_id=location_id,
+                                   barber_id=barber_id,
+                                   use_cache=False)
+    # The index holds the location's barbers only, so another location's barber would look free
+    if barber_id and barber_id not in index.barbers_by_location.get(location_id, ()):
+        raise BarberLocationError("That barber doesn't work at the selected location")
+    index.release_cell(moving)
+    mask = occupancy_mask(time_to_minutes(start_time), index.duration_for(service_ids))
+    if not index.is_free(appointment_date, mask, barber_id=barber_id, location_id=location_id):
+        raise SlotTakenError("That time slot is no longer available")
+
+
+def book_appointment(location_id, barber_id, client_name, client_email, appointment_date, start_time, service_ids,
+                     send_confirmation=False):
+    """Atomically create an appointment if its time slot is still free
+
+    The overlap check against existing appointments (using service
+    durations) and the insert run in one locked transaction, and the
+    unique (barber_id, date, start_time) constraint backs it up. There is
+    no retry: a lost race is reported to the caller straight away.
+    
+    With ``send_confirmation`` a confirmation email is queued in the email
+    outbox as part of the same transaction.
+
+    Returns:
+        The new Appointment
+
+    Raises:
+        SlotTakenError: If the slot overlaps an existing appointment
+        BarberLocationError: If the barber doesn't work at the location
+        BookingError: If the database stayed locked for too long
+    """
+    barber_id = int(barber_id) if barber_id else None
+    location_id = int(location_id)
+    service_ids = parse_service_ids(service_ids)
+
+    try:
+        check_slot_free(location_id, barber_id, appointment_date, start_time, service_ids)
+
+        appointment = Appointment(
+            location_id=location_id,
+            barber_id=barber_id,  # None for "any barber"
+            client_name=client_name,
+            client_email=client_email,
+            date=appointment_date,
+            start_time=start_time
+        )
+        appointment.set_services(service_ids)
+        db.session.add(appointment)
+        if send_confirmation:
+            enqueue_confirmation(appointment)
+        db.session.commit()
+    except BookingError:
+        db.session.rollback()
+        raise
+    except IntegrityError:
+        db.session.rollback()
+        raise SlotTakenError("That time slot is no longer available")
+    except OperationalError as e:
+        db.session.rollback()
+        logger.warning(f"Booking lock not acquired: {str(e)}")
+        raise BookingError("We are handling a lot of bookings right now. Please try again in a moment.")
+
+    # The commit expired the appointment; refresh it together with its location, which
+    # confirmation pages and emails show, instead of loading that separately afterwards
+    appointment = db.session.get(Appointment, inspect(appointment).identity, populate_existing=True,
+                                 options=[joinedload(Appointment.location)])
+    occupancy_cache.add_appointment(appointment)
+    return appointment
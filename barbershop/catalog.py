@@ -0,0 +1,180 @@
+from collections import namedtuple
+from itertools import chain
+import os
+import threading
+import time
+from sqlalchemy import event, select, update, insert
+from sqlalchemy.orm import Session
+from db import db
+from models import Location, Barber, Service, catalog_version
+import logging
+
+logger = logging.getLogger(__name__)
+
+# How often (seconds) a process checks whether another process changed the catalog
+CATALOG_REFRESH_SECONDS = float(os.getenv('CATALOG_REFRESH_SECONDS', 60))
+
+CATALOG_MODELS = (Location, Barber, Service)
+
+BarberEntry = namedtuple('BarberEntry', 'id name name_lower location_id')
+ServiceEntry = namedtuple('ServiceEntry', 'id name name_lower duration_minutes')
+LocationEntry = namedtuple('LocationEntry', 'id name name_lower')
+
+
+class CatalogSnapshot:
+    """Read-only copy of the barbers, services and locations at one version"""
+
+    def __init__(self, version, barbers, services, locations):
+        self.version = version
+        self.barbers = barbers
+        self.services = services
+        self.locations = locations
+        self.barbers_by_id = {barber.id: barber for barber in barbers}
+        self.services_by_id = {service.id: service for service in services}
+
+    @property
+    def default_location_id(self):
+        """Location used when a booking doesn't name one"""
+        return self.locations[0].id if self.locations else None
+
+    @classmethod
+    def load(cls, version):
+        """Read the catalog from the database (call inside an app context)"""
+        barbers = tuple(BarberEntry(id, name, name.lower(), location_id) for id, name, location_id in
+                        db.session.execute(select(Barber.id, Barber.name, Barber.location_id).order_by(Barber.id)))
+        services = tuple(ServiceEntry(id, name, name.lower(), duration) for id, name, duration in
+                         db.session.execute(select(Service.id, Service.name, Service.duration_minutes).order_by(Service.id)))
+        locations = tuple(LocationEntry(id, name, name.lower()) for id, name in
+                          db.session.execute(select(Location.id, Location.name).order_by(Location.id)))
+        return cls(version, barbers, services, locations)
+
+
+def read_catalog_version():
+    """Current catalog version stored in the database"""
+    return db.session.execute(
+        select(catalog_version.c.version).where(catalog_version.c.id == 1)
+    ).scalar() or 0
+
+
+def bump_catalog_version(connection):
+    """Record a catalog change so every process reloads its snapshot
+
+    Runs on the connection of the writing transaction, so the new version
+    becomes visible together with the change.
+    """
+    result = connection.execute(update(catalog_version)
+                                .where(catalog_version.c.id == 1)
+                                .values(version=catalog_version.c.version + 1))
+    if result.rowcount == 0:
+        connection.execute(insert(catalog_version).values(id=1, version=1))
+
+
+class CatalogCache:
+    """Process-wide catalog snapshot, reloaded when the version changes
+
+    Changes made by this process invalidate the snapshot as soon as they
+    are committed; changes made by other processes are picked up the next
+    time the version is checked, at most every ``refresh_seconds``.
+    """
+
+    def __init__(self, refresh_seconds=CATALOG_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._stale = True
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._stale = True
+
+    def get(self):
+        """Return the current snapshot (call inside an app context)"""
+        snapshot = self._snapshot
+        if (snapshot is not None and not self._stale
+                and time.monotonic() - self._checked_at < self.refresh_seconds):
+            return snapshot
+
+        with self._lock:
+            if self._snapshot is not snapshot:
+                return self._snapshot  # another thread just refreshed it
+            version = read_catalog_version()
+            if snapshot is None or self._stale or version != snapshot.version:
+                self._stale = False
+                snapshot = CatalogSnapshot.load(version)
+                logger.info(f"Loaded catalog version {version}: {len(snapshot.barbers)} barbers, "
+                            f"{len(snapshot.services)} services, {len(snapshot.locations)} locations")
+                self._snapshot = snapshot
+            self._checked_at = time.monotonic()
+        return snapshot
+
+
+catalog = CatalogCache()
+
+
+class FragmentCache:
+    """Rendered catalog page fragments, keyed by (template, location_id)
+
+    Each entry remembers the catalog version it was rendered from and is
+    rendered again on first use after the version changes, so reseeding or
+    editing the catalog invalidates every fragment.
+    """
+
+    def __init__(self):
+        self._fragments = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, template, location_id, version, render):
+        """Cached fragment for this version, calling ``render()`` to build it if needed"""
+        key = (template, location_id)
+        entry = self._fragments.get(key)
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        html = render()
+        self._fragments[key] = (version, html)
+        return html
+
+    def clear(self):
+        self._fragments.clear()
+
+    def stats(self):
+        return {'fragments': len(self._fragments), 'hits': self.hits, 'misses': self.misses}
+
+
+fragments = FragmentCache()
+
+
+def _mark_catalog_changed(session):
+    if not session.info.get('catalog_changed'):
+        session.info['catalog_changed'] = True
+        bump_catalog_version(session.connection())
+
+
+@event.listens_for(Session, 'before_flush')
+def _track_catalog_flush(session, flush_context, instances):
+    changed = chain(session.new, session.deleted,
+                    (obj for obj in session.dirty if session.is_modified(obj, include_collections=False)))
+    if any(isinstance(obj, CATALOG_MODELS) for obj in changed):
+        _mark_catalog_changed(session)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_catalog_bulk_write(orm_execute_state):
+    # Bulk query(...).update()/delete() bypass the flush
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and issubclass(mapper.class_, CATALOG_MODELS):
+            _mark_catalog_changed(orm_execute_state.session)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_catalog(session):
+    if session.info.pop('catalog_changed', False):
+        catalog.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_catalog_change(session):
+    session.info.pop('catalog_changed', None)
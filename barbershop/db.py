@@ -1,16 +1,99 @@
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql.dml import UpdateBase
+import functools
 import os
+import re
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Bind key of the engine that read-only views query
+READ_ONLY_BIND = 'read_only'
+
+# Replica to read from; SQLite databases default to a read-only (mode=ro)
+# connection to the same file unless READ_ONLY_ROUTING is false
+DATABASE_READ_URI = os.getenv('DATABASE_READ_URI', '')
+READ_ONLY_ROUTING = os.getenv('READ_ONLY_ROUTING', 'true').lower() == 'true'
+
+
+class RoutingSession(Session):
+    """Session that sends the queries of ``read_only`` views to the read-only engine
+
+    Flushes and INSERT/UPDATE/DELETE statements always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and self.info.get('read_only') and not self._flushing
+                and not isinstance(clause, UpdateBase)):
+            engine = self._db.engines.get(READ_ONLY_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
 # Create database instance
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# Applied to every new SQLite connection, in this order; an empty value keeps
+# SQLite's default. WAL lets the dashboard read while a booking writes, and
+# synchronous=NORMAL is durable in WAL mode except on power loss. SQLite
+# only enforces foreign keys (and their ON DELETE actions) with foreign_keys on.
+SQLITE_PRAGMAS = {
+    'busy_timeout': os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'),
+    'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'cache_size': os.getenv('SQLITE_CACHE_SIZE', '-16384'),  # negative means KiB
+    'mmap_size': os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)),
+    'foreign_keys': os.getenv('SQLITE_FOREIGN_KEYS', 'ON'),
+}
+
+# Connections kept per worker process; size it to the worker's thread count
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+
 
 def init_db(app):
-    """Initialize the database with the app"""
+    """Initialize the database with the app
+
+    Sets up the connection pool, the read-only engine and, for SQLite, the
+    connection pragmas. They can be overridden with the
+    SQLALCHEMY_ENGINE_OPTIONS, SQLALCHEMY_READ_URI, READ_ONLY_ROUTING and
+    SQLITE_PRAGMAS config keys.
+    """
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    is_sqlite = url.get_backend_name() == 'sqlite'
+    in_memory = is_sqlite and url.database in (None, '', ':memory:')
+    
+    if not in_memory:
+        engine_options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+        engine_options.setdefault('pool_size', DB_POOL_SIZE)
+        engine_options.setdefault('max_overflow', DB_MAX_OVERFLOW)
+        engine_options.setdefault('pool_timeout', DB_POOL_TIMEOUT)
+    pragmas = {**SQLITE_PRAGMAS, **app.config.get('SQLITE_PRAGMAS', {})}
+    if in_memory:
+        pragmas.pop('journal_mode')  # always "memory"
+    
+    read_uri = app.config.setdefault('SQLALCHEMY_READ_URI', DATABASE_READ_URI or None)
+    if not read_uri and is_sqlite and not in_memory and app.config.get('READ_ONLY_ROUTING', READ_ONLY_ROUTING):
+        read_uri = sqlite_read_only_uri(url)
+    if read_uri:
+        app.config.setdefault('SQLALCHEMY_BINDS', {})[READ_ONLY_BIND] = read_uri
+    
     db.init_app(app)
     
+    with app.app_context():
+        if is_sqlite:
+            event.listen(db.engine, 'connect', sqlite_pragma_listener(pragmas))
+        read_engine = db.engines.get(READ_ONLY_BIND)
+        if read_engine is not None and read_engine.dialect.name == 'sqlite':
+            # The journal mode belongs to the file and can't be set read-only
+            read_pragmas = {name: value for name, value in pragmas.items() if name != 'journal_mode'}
+            event.listen(read_engine, 'connect', sqlite_pragma_listener(read_pragmas))
+    
     # Check if database file exists for SQLite
     if 'sqlite:///' in app.config['SQLALCHEMY_DATABASE_URI']:
         db_path = app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '')
@@ -18,11 +101,83 @@ def init_db(app):
             logger.info(f"Database file {db_path} does not exist, will be created")
         else:
             logger.info(f"Using existing database file: {db_path}")
+
+
+def sqlite_read_only_uri(url):
+    """URI that opens the same SQLite file read-only"""
+    database = url.database
+    if not database.startswith('file:'):
+        database = f"file:{database}"
+    return url.set(database=database,
+                   query={**url.query, 'mode': 'ro', 'uri': 'true'}).render_as_string(hide_password=False)
+
+
+def read_only(view):
+    """Run a view's queries on the read-only engine, when one is configured
+
+    For views that only read, such as the catalog pages and the admin
+    dashboard, so they don't compete with bookings for the primary's
+    connections. Anything the view writes still goes to the primary.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        db.session.info['read_only'] = True
+        try:
+            return view(*args, **kwargs)
+        finally:
+            db.session.info.pop('read_only', None)
+    return wrapper
+
+
+def sqlite_pragma_listener(pragmas):
+    """Engine 'connect' listener that applies ``pragmas`` to new connections"""
+    statements = []
+    for name, value in pragmas.items():
+        value = str(value).strip() if value is not None else ''
+        if not value:
+            continue
+        if not re.fullmatch(r'-?\w+', value):
+            raise ValueError(f"Invalid value for SQLite pragma {name}: {value!r}")
+        statements.append((name, f"PRAGMA {name}={value}"))
     
-    # Create tables if they don't exist
-    try:
-        with app.app_context():
-            db.create_all()
-            logger.info("Database tables created successfully")
-    except Exception as e:
-        logger.error(f"Error creating database tables: {str(e)}") 
\ No newline at end of file
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, statement in statements:
+                result = cursor.execute(statement).fetchone()
+                if name == 'journal_mode' and result and result[0].lower() != pragmas[name].lower():
+                    logger.warning(f"SQLite journal_mode is {result[0]}, not {pragmas[name]}")
+        finally:
+            cursor.close()
+    
+    return apply_pragmas
+
+
+def create_schema():
+    """Create missing tables, run pending migrations and add missing indexes
+
+    Needs an app context. Run it once per deployment (``flask --app app
+    init-db``) rather than in every worker at startup, where concurrent
+    workers would race on the same SQLite file.
+    """
+    from migrations import run_migrations
+    db.create_all()
+    run_migrations()
+    create_missing_indexes()
+    logger.info("Database tables created successfully")
+
+
+def create_missing_indexes():
+    """Create indexes declared on models that existing tables lack
+
+    ``create_all`` only creates indexes together with new tables, so
+    databases created by older versions need them added separately. A
+    failure is raised, since unique indexes back up the booking checks.
+    """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(db.engine, checkfirst=True)
+            except Exception as e:
+                logger.error(f"Error creating index {index.name}: {str(e)}")
+                raise
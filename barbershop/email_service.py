@@ -1,160 +1,389 @@
 import os
 import smtplib
+import threading
+import time
+from contextlib import contextmanager
 from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from dotenv import load_dotenv
 from datetime import datetime
+from jinja2 import ChainableUndefined, Environment, FileSystemLoader, select_autoescape
+from metrics import EMAIL_SEND_SECONDS, SMTP_CONNECT_SECONDS
 
 # Load environment variables
 load_dotenv()
 
+# Email templates are compiled once, at import, and reused for every message;
+# their static text (inline CSS, header, footer) is part of the compiled code
+_email_templates = Environment(
+    loader=FileSystemLoader(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'email')),
+    autoescape=select_autoescape(['html']),
+    keep_trailing_newline=True,
+    auto_reload=False,  # no file checks per render, including the {% extends %} layout
+    undefined=ChainableUndefined,  # lets the macros be imported without a context
+)
+
+CONFIRMATION_SUBJECT = 'Barbershop Appointment Confirmation'
+CONFIRMATION_HTML = _email_templates.get_template('confirmation.html')
+CONFIRMATION_TEXT = _email_templates.get_template('confirmation.txt')
+
+REMINDER_SUBJECT = 'Barbershop Appointment Reminder'
+REMINDER_HTML = _email_templates.get_template('reminder.html')
+REMINDER_TEXT = _email_templates.get_template('reminder.txt')
+
+# Reply code of a server that is closing the session
+SERVICE_CLOSING = 421
+
+
+def is_connection_error(error):
+    """Whether the SMTP session is gone, so the message may be retried on a new one
+
+    Every SMTP error is an OSError, so the check can't be a plain except
+    clause: a server's 5xx reply (message, sender or login refused) is a
+    permanent failure of the message, not a dropped connection.
+    """
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code == SERVICE_CLOSING
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+def is_rejection(error):
+    """Whether the server refused a message but the session is still usable"""
+    return (isinstance(error, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused))
+            and not is_connection_error(error))
+
+
+class SMTPConnectionPool:
+    """Keeps authenticated SMTP sessions open and reuses them across messages
+    
+    At most ``size`` connections exist at once; callers wait for a free one.
+    A connection is replaced after ``max_messages`` messages, checked with
+    NOOP if it sat idle for ``idle_seconds`` and dropped on any connection
+    error, so the next message reconnects. A message the server refuses
+    leaves the connection in the pool.
+    """
+    
+    def __init__(self, server, port, username=None, password=None, size=4, starttls=True,
+                 debug_level=0, max_messages=100, idle_seconds=60, timeout=30):
+        self.server = server
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.debug_level = debug_level
+        self.max_messages = max_messages
+        self.idle_seconds = idle_seconds
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = []  # [(smtp, messages_sent, last_used)]
+        self._lock = threading.Lock()
+    
+    @SMTP_CONNECT_SECONDS.time()
+    def _connect(self):
+        smtp = smtplib.SMTP(self.server, self.port, timeout=self.timeout)
+        smtp.set_debuglevel(self.debug_level)
+        smtp.ehlo()  # Identify ourselves to the server
+        if self.starttls:
+            smtp.starttls()
+            smtp.ehlo()  # Re-identify ourselves over TLS connection
+        if self.username:
+            smtp.login(self.username, self.password)
+        return smtp
+    
+    def _close(self, smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            smtp.close()
+    
+    def _checkout(self):
+        """Take an idle connection that still works, or open a new one"""
+        with self._lock:
+            idle = self._idle.pop() if self._idle else None
+        if idle is not None:
+            smtp, sent, last_used = idle
+            if time.monotonic() - last_used < self.idle_seconds:
+                return smtp, sent
+            try:
+                if smtp.noop()[0] == 250:
+                    return smtp, sent
+            except OSError:
+                pass
+            self._close(smtp)
+        return self._connect(), 0
+    
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; yields a one-item list [messages_sent] to update"""
+        self._slots.acquire()
+        try:
+            smtp, sent = self._checkout()
+            counter = [sent]
+            try:
+                yield smtp, counter
+            except Exception as e:
+                if is_rejection(e):
+                    self._release(smtp, counter[0])
+                elif is_connection_error(e):
+                    smtp.close()
+                else:
+                    self._close(smtp)  # unknown protocol state
+                raise
+            self._release(smtp, counter[0])
+        finally:
+            self._slots.release()
+    
+    def _release(self, smtp, sent):
+        """Return a connection to the pool, or close it once it has sent ``max_messages``"""
+        if sent >= self.max_messages:
+            self._close(smtp)
+        else:
+            with self._lock:
+                self._idle.append((smtp, sent, time.monotonic()))
+    
+    def send(self, message):
+        """Send one message, reconnecting once if the session was dropped"""
+        for attempt in range(2):
+            try:
+                with self.connection() as (smtp, counter):
+                    _timed_send(smtp, message)
+                    counter[0] += 1
+                return
+            except OSError as e:
+                if attempt or not is_connection_error(e):
+                    raise
+    
+    def send_many(self, messages):
+        """Send messages over as few sessions as possible
+        
+        Returns one entry per message: None if it was sent, otherwise the
+        exception. A refused message is not retried; a dropped session is
+        reopened and the batch continues.
+        """
+        results = [None] * len(messages)
+        position = 0
+        reconnects = 0
+        while position < len(messages):
+            try:
+                with self.connection() as (smtp, counter):
+                    while position < len(messages):
+                        try:
+                            _timed_send(smtp, messages[position])
+                            counter[0] += 1
+                            reconnects = 0
+                        except OSError as e:
+                            if not is_rejection(e):
+                                raise
+                            results[position] = e  # the session is still fine
+                        position += 1
+                        if counter[0] >= self.max_messages:
+                            break
+            except OSError as e:
+                if is_connection_error(e):
+                    reconnects += 1
+                    if reconnects <= 1:
+                        continue
+                results[position] = e  # give up on this message, carry on with the rest
+                position += 1
+                reconnects = 0
+        return results
+    
+    def close(self):
+        """Close all idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for smtp, _, _ in idle:
+            self._close(smtp)
+
+
+def _timed_send(smtp, message):
+    started = time.perf_counter()
+    outcome = 'failed'
+    try:
+        smtp.send_message(message)
+        outcome = 'sent'
+    finally:
+        EMAIL_SEND_SECONDS.observe(time.perf_counter() - started, outcome)
+
+
+_pool = None
+_pool_settings = None
+_pool_lock = threading.Lock()
+
+def _smtp_settings():
+    """SMTP settings from the environment, or None if email isn't configured"""
+    settings = (os.getenv('SMTP_SERVER'), int(os.getenv('SMTP_PORT', 587)),
+                os.getenv('SMTP_USERNAME'), os.getenv('SMTP_PASSWORD'), os.getenv('SENDER_EMAIL'))
+    return settings if all(settings) else None
+
+def get_smtp_pool():
+    """Shared connection pool for the configured SMTP server (None if not configured)
+    
+    The pool is rebuilt when the SMTP settings change.
+    """
+    global _pool, _pool_settings
+    settings = _smtp_settings()
+    with _pool_lock:
+        if settings != _pool_settings:
+            if _pool is not None:
+                _pool.close()
+            _pool, _pool_settings = None, settings
+            if settings:
+                server, port, username, password, _ = settings
+                _pool = SMTPConnectionPool(server, port, username, password,
+                                           size=int(os.getenv('SMTP_POOL_SIZE', 4)),
+                                           starttls=os.getenv('SMTP_STARTTLS', 'true').lower() == 'true',
+                                           debug_level=int(os.getenv('SMTP_DEBUG_LEVEL', 0)),
+                                           max_messages=int(os.getenv('SMTP_MAX_MESSAGES_PER_CONNECTION', 100)))
+        return _pool
+
 def send_confirmation_email(appointment, services, test_mode=False):
     """Send a confirmation email for a new appointment
     
     Args:
         appointment: The Appointment model instance
-        services: List of Service model instances
+        services: Service model instances booked for the appointment
+                  (e.g. ``appointment.service_items``)
         test_mode: If True, forces email to be printed to console
     """
     try:
-        # Email configuration from environment variables
-        smtp_server = os.getenv('SMTP_SERVER')
-        smtp_port = int(os.getenv('SMTP_PORT', 587))
-        smtp_username = os.getenv('SMTP_USERNAME')
-        smtp_password = os.getenv('SMTP_PASSWORD')
-        sender_email = os.getenv('SENDER_EMAIL')
-        
-        # Print confirmation to console in test mode or if settings not configured
-        if test_mode or not all([smtp_server, smtp_username, smtp_password, sender_email]):
-            print_confirmation_to_console(appointment, services)
-            return
-            
-        print(f"Attempting to send email via {smtp_server}:{smtp_port}")
-        print(f"Using credentials: {smtp_username}")
-
-        # Setup email
-        message = MIMEMultipart()
-        message['Subject'] = 'Barbershop Appointment Confirmation'
-        message['From'] = sender_email
-        message['To'] = appointment.client_email
-
-        # Email HTML content
-        html_content = get_email_template(appointment, services)
-        message.attach(MIMEText(html_content, 'html'))
-
-        # Send email
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.set_debuglevel(1)  # Enable debug output
-            server.ehlo()  # Identify ourselves to the server
-            server.starttls()
-            server.ehlo()  # Re-identify ourselves over TLS connection
-            server.login(smtp_username, smtp_password)
-            server.send_message(message)
-            
-        print(f"✓ Confirmation email sent successfully to {appointment.client_email}")
-        
+        deliver_confirmation_email(appointment, services, test_mode=test_mode)
     except Exception as e:
         print(f"Failed to send confirmation email: {str(e)}")
         # Fall back to console output in case of errors
         print_confirmation_to_console(appointment, services)
 
+def deliver_confirmation_email(appointment, services, test_mode=False):
+    """Send a confirmation email, raising if it can't be delivered
+    
+    Takes the same arguments as ``send_confirmation_email``. The outbox
+    workers use this so that failed deliveries can be retried.
+    """
+    pool = get_smtp_pool()
+    
+    # Print confirmation to console in test mode or if settings not configured
+    if test_mode or pool is None:
+        print_confirmation_to_console(appointment, services)
+        return
+    
+    pool.send(build_confirmation_message(appointment, services))
+    print(f"✓ Confirmation email sent successfully to {appointment.client_email}")
+
+def send_confirmation_emails(appointments, test_mode=False):
+    """Send confirmation emails for many appointments over pooled sessions
+    
+    Args:
+        appointments: (appointment, services) pairs
+        test_mode: If True, forces emails to be printed to console
+    
+    Returns:
+        One entry per appointment: None if sent, otherwise the exception
+    """
+    return _send_many(appointments, CONFIRMATION_HTML, CONFIRMATION_TEXT, CONFIRMATION_SUBJECT, test_mode)
+
+def send_reminder_emails(appointments, test_mode=False):
+    """Send reminder emails for many appointments over pooled sessions
+    
+    Takes and returns the same as ``send_confirmation_emails``.
+    """
+    return _send_many(appointments, REMINDER_HTML, REMINDER_TEXT, REMINDER_SUBJECT, test_mode)
+
+def _send_many(appointments, html_template, text_template, subject, test_mode):
+    pool = get_smtp_pool()
+    if test_mode or pool is None:
+        for text_content in render_emails(appointments, text_template, subject):
+            print(text_content)
+        return [None] * len(appointments)
+    
+    html_contents = render_emails(appointments, html_template, subject)
+    return pool.send_many([_build_message(appointment.client_email, subject, html_content)
+                           for (appointment, _), html_content in zip(appointments, html_contents)])
+
+def build_confirmation_message(appointment, services, html_content=None):
+    """Build the confirmation email for an appointment"""
+    # Email HTML content
+    if html_content is None:
+        html_content = get_email_template(appointment, services)
+    return _build_message(appointment.client_email, CONFIRMATION_SUBJECT, html_content)
+
+def _build_message(recipient, subject, html_content):
+    # A single-part message: cheaper to serialise than multipart with one part
+    message = MIMEText(html_content, 'html')
+    message['Subject'] = subject
+    message['From'] = os.getenv('SENDER_EMAIL')
+    message['To'] = recipient
+    return message
+
 def print_confirmation_to_console(appointment, services):
     """Print confirmation details to console (for development)"""
-    print("\n========== CONFIRMATION EMAIL ==========")
-    print(f"To: {appointment.client_email}")
-    print(f"Subject: Barbershop Appointment Confirmation")
-    print("\nDear " + appointment.client_name + ",")
-    print("\nYour appointment has been confirmed!")
-    print(f"\nDate: {appointment.date.strftime('%B %d, %Y')}")
-    print(f"Time: {appointment.start_time}")
-    print(f"Location: {appointment.location.name}")
-    print(f"Address: {appointment.location.address}")
-    
-    if appointment.barber:
-        print(f"Barber: {appointment.barber.name}")
-    else:
-        print("Barber: Any available specialist")
-        
-    print("\nServices:")
-    for service_id in appointment.service_list:
-        for service in services:
-            if service.id == service_id:
-                print(f"- {service.name} (${service.price_min})")
-                
-    print("\nThank you for choosing Barbershop!")
-    print("=========================================\n")
+    print(render_confirmations([(appointment, services)], text=True)[0])
 
 def get_email_template(appointment, services):
     """Generate HTML email content"""
+    return render_confirmations([(appointment, services)])[0]
+
+def render_confirmations(appointments, text=False):
+    """Render confirmation emails for many appointments in one call
     
-    # Format date nicely
-    formatted_date = appointment.date.strftime('%B %d, %Y')
+    Args:
+        appointments: (appointment, services) pairs; load each appointment's
+                      location and barber up front when rendering thousands
+        text: Render the plain text version instead of HTML
     
-    # Build services list
-    services_html = ""
-    for service_id in appointment.service_list:
+    Returns:
+        The rendered emails, in the same order
+    """
+    return render_emails(appointments, CONFIRMATION_TEXT if text else CONFIRMATION_HTML, CONFIRMATION_SUBJECT)
+
+def render_reminders(appointments, text=False):
+    """Render reminder emails for many appointments in one call
+    
+    Takes and returns the same as ``render_confirmations``.
+    """
+    return render_emails(appointments, REMINDER_TEXT if text else REMINDER_HTML, REMINDER_SUBJECT)
+
+def render_emails(appointments, template, subject):
+    """Render an email template for (appointment, services) pairs
+    
+    Each service line is rendered once per batch, with the template's
+    ``service_item`` macro, and looked up by service ID afterwards.
+    """
+    service_item = template.module.service_item
+    service_lines = {}  # service id -> rendered line
+    year = datetime.now().year
+    
+    rendered = []
+    for appointment, services in appointments:
+        lines = []
         for service in services:
-            if service.id == service_id:
-                price = f"${service.price_min}"
-                if service.price_max:
-                    price = f"${service.price_min}-${service.price_max}"
-                services_html += f"<li>{service.name} ({service.duration_minutes} min) - {price}</li>"
-    
-    # Barber name
-    barber_name = "Any available specialist"
-    if appointment.barber:
-        barber_name = appointment.barber.name
-    
-    # Email HTML template
-    return f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <style>
-            body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-            .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-            .header {{ text-align: center; padding: 20px 0; border-bottom: 1px solid #eee; }}
-            .content {{ padding: 20px 0; }}
-            .appointment-details {{ background-color: #f9f9f9; padding: 15px; border-radius: 4px; margin: 20px 0; }}
-            .footer {{ text-align: center; padding: 20px 0; border-top: 1px solid #eee; font-size: 12px; color: #777; }}
-            h1 {{ color: #2563eb; }}
-            ul {{ padding-left: 20px; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h1>Appointment Confirmation</h1>
-            </div>
-            
-            <div class="content">
-                <p>Dear {appointment.client_name},</p>
-                
-                <p>Your appointment has been successfully booked. Thank you for choosing Barbershop!</p>
-                
-                <div class="appointment-details">
-                    <h2>Appointment Details</h2>
-                    <p><strong>Date:</strong> {formatted_date}</p>
-                    <p><strong>Time:</strong> {appointment.start_time}</p>
-                    <p><strong>Location:</strong> {appointment.location.name}</p>
-                    <p><strong>Address:</strong> {appointment.location.address}</p>
-                    <p><strong>Barber:</strong> {barber_name}</p>
-                    
-                    <h3>Services:</h3>
-                    <ul>
-                        {services_html}
-                    </ul>
-                </div>
-                
-                <p>If you need to modify or cancel your appointment, please call us at {appointment.location.phone}.</p>
-                
-                <p>We look forward to seeing you!</p>
-            </div>
-            
-            <div class="footer">
-                <p>&copy; {datetime.now().year} Barbershop. All rights reserved.</p>
-            </div>
-        </div>
-    </body>
-    </html>
-    """ 
\ No newline at end of file
+            line = service_lines.get(service.id)
+            if line is None:
+                line = service_lines[service.id] = service_item(_service_row(service))
+            lines.append(line)
+        
+        barber = appointment.barber
+        rendered.append(template.render(
+            client_name=appointment.client_name,
+            client_email=appointment.client_email,
+            date=appointment.date.strftime('%B %d, %Y'),
+            start_time=appointment.start_time,
+            location=appointment.location,
+            barber_name=barber.name if barber else "Any available specialist",
+            services=lines,
+            subject=subject,
+            year=year,
+        ))
+    return rendered
+
+def _service_row(service):
+    """Service fields as shown in confirmation emails"""
+    price = f"${service.price_min}"
+    if service.price_max:
+        price = f"${service.price_min}-${service.price_max}"
+    return {
+        'name': service.name,
+        'duration_minutes': service.duration_minutes,
+        'price': price,
+        'price_min': service.price_min,
+    }
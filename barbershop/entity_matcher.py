@@ -0,0 +1,107 @@
+import re
+from collections import namedtuple
+
+# Phrases meaning the client has no barber preference
+ANY_BARBER_PHRASES = ["any barber", "anyone", "any specialist", "doesn't matter", "doesnt matter",
+                      "don't care", "dont care", "any available", "whoever", "anybody"]
+
+# Days from today
+DATE_KEYWORDS = {"today": 0, "tomorrow": 1, "day after tomorrow": 2, "next week": 7}
+
+WEEKDAYS = {'monday': 0, 'tuesday': 1, 'wednesday': 2, 'thursday': 3,
+            'friday': 4, 'saturday': 5, 'sunday': 6}
+
+# Start time offered for a part of the day
+TIME_KEYWORDS = {"morning": "10:00", "afternoon": "14:00", "evening": "18:00"}
+
+# "3pm", "3:30pm", then "15:00", "3:00"
+CLOCK_PATTERN = (r'(?P<ampm_hour>\d{1,2})(?::(?P<ampm_minute>\d{2}))?\s*(?P<suffix>am|pm)'
+                 r'|(?P<hour>\d{1,2}):(?P<minute>\d{2})')
+
+Mention = namedtuple('Mention', 'kind value start end')
+
+
+def trie_pattern(words):
+    """Regex matching any of ``words``, preferring the longest
+
+    The alternation is factored into a prefix trie ("bar(?:ber|n)" rather
+    than "barber|barn") so the engine tests each character once instead of
+    trying every word at every position.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node):
+        ends_here = '' in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if ends_here:
+            pattern = '(?:' + pattern + ')?'
+        return pattern
+
+    return build(trie)
+
+
+class EntityMatcher:
+    """Finds every barber, service, date and time mention in one regex pass
+
+    All keywords and catalog names are compiled into a single trie-shaped
+    alternation that prefers the longest match, so e.g. "day after
+    tomorrow" wins over "tomorrow".
+    Build one per catalog snapshot and match lowercased messages.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self._literals = {}  # lowercased text -> [(kind, value)]
+        for phrase in ANY_BARBER_PHRASES:
+            self._add('any_barber', phrase, True)
+        for keyword, days in DATE_KEYWORDS.items():
+            self._add('date_offset', keyword, days)
+        for day_name, weekday in WEEKDAYS.items():
+            self._add('weekday', day_name, weekday)
+        for keyword, time_value in TIME_KEYWORDS.items():
+            self._add('period', keyword, time_value)
+        for barber in snapshot.barbers:
+            self._add('barber', barber.name_lower, barber)
+        for service in snapshot.services:
+            self._add('service', service.name_lower, service)
+
+        self._pattern = re.compile('(?P<literal>' + trie_pattern(self._literals) + ')|' + CLOCK_PATTERN)
+
+    def _add(self, kind, text, value):
+        if text:
+            kinds = self._literals.setdefault(text, [])
+            if not any(existing == kind for existing, _ in kinds):
+                kinds.append((kind, value))
+
+    def mentions(self, message_lower):
+        """Yield every Mention in a lowercased message, left to right"""
+        for match in self._pattern.finditer(message_lower):
+            if match.group('literal'):
+                for kind, value in self._literals[match.group('literal')]:
+                    yield Mention(kind, value, match.start(), match.end())
+            elif match.group('suffix'):
+                hour = int(match.group('ampm_hour'))
+                if match.group('suffix') == 'pm' and hour < 12:
+                    hour += 12
+                elif match.group('suffix') == 'am' and hour == 12:
+                    hour = 0
+                minute = match.group('ampm_minute') or "00"
+                yield Mention('clock', f"{hour:02d}:{minute}", match.start(), match.end())
+            else:
+                yield Mention('clock', f"{int(match.group('hour')):02d}:{match.group('minute')}",
+                              match.start(), match.end())
+
+    def scan(self, message_lower):
+        """Return the first mention of each kind as {kind: value}"""
+        found = {}
+        for mention in self.mentions(message_lower):
+            found.setdefault(mention.kind, mention.value)
+        return found
@@ -0,0 +1,398 @@
+"""Bulk import and export of appointments as CSV or JSON Lines
+
+    python import_export.py export appointments.csv
+    python import_export.py export - --format jsonl --date-from 2024-01-01 > appointments.jsonl
+    python import_export.py import appointments.csv --chunk-size 5000
+    python import_export.py import appointments.jsonl --dry-run --rejects rejected.jsonl
+    python import_export.py import - --format csv < appointments.csv
+
+Both directions stream, so memory use doesn't depend on the file or table
+size. Imported rows are validated and checked for overlaps with existing
+appointments and with earlier rows of the same file; rows that fail are
+reported (and written to --rejects) and the rest are inserted in chunks.
+Files sorted by date import fastest, since each chunk only loads the
+occupancy of the dates it covers.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from datetime import date, datetime
+from sqlalchemy import func, insert, select
+from db import db
+from models import Appointment, appointment_service, DEFAULT_APPOINTMENT_MINUTES
+from availability import AvailabilityIndex, occupancy_cache, occupancy_mask
+from catalog import catalog
+import logging
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('id', 'location_id', 'barber_id', 'client_name', 'client_email', 'date', 'start_time', 'services',
+          'created_at')
+FORMATS = ('csv', 'jsonl')
+
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', 5000))
+EXPORT_BATCH_SIZE = 10000
+
+# Length limits of the appointment columns
+MAX_NAME_LENGTH = 100
+MAX_EMAIL_LENGTH = 100
+
+
+class ImportRowError(ValueError):
+    """A row that can't be imported"""
+
+
+def detect_format(path, fmt=None):
+    """File format from --format or the file extension"""
+    if fmt:
+        return fmt
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension in ('jsonl', 'ndjson', 'json'):
+        return 'jsonl'
+    if extension == 'csv':
+        return 'csv'
+    raise ValueError(f"Can't tell the format of {path!r}, use --format")
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, row dict) from a CSV or JSONL stream"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            row = {'_error': f"invalid JSON: {str(e)}"}
+        yield line_number, row if isinstance(row, dict) else {'_error': "not a JSON object"}
+
+
+class RowWriter:
+    """Write row dicts as CSV (header from the first row's keys) or JSONL"""
+
+    def __init__(self, stream, fmt):
+        self.stream = stream
+        self.fmt = fmt
+        self._csv = None
+
+    def write(self, row):
+        if self.fmt == 'jsonl':
+            self.stream.write(json.dumps(row, default=str) + '\n')
+            return
+        if self._csv is None:
+            self._csv = csv.DictWriter(self.stream, fieldnames=list(row), extrasaction='ignore')
+            self._csv.writeheader()
+        self._csv.writerow({key: ','.join(map(str, value)) if isinstance(value, list) else value
+                            for key, value in row.items()})
+
+
+def export_appointments(stream, fmt, date_from=None, date_to=None, location_id=None, batch_size=EXPORT_BATCH_SIZE,
+                        progress=None):
+    """Write appointments to ``stream`` in ID order; returns the number written
+
+    Pages through the table by primary key, so neither the table nor a
+    long-running read transaction is held while the file is written.
+    """
+    table = Appointment.__table__
+    conditions = []
+    if date_from:
+        conditions.append(table.c.date >= date_from)
+    if date_to:
+        conditions.append(table.c.date <= date_to)
+    if location_id:
+        conditions.append(table.c.location_id == location_id)
+    columns = [table.c[field] for field in FIELDS]
+
+    jsonl = fmt == 'jsonl'
+    if not jsonl:
+        writer = csv.writer(stream)
+        writer.writerow(FIELDS)
+
+    total = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(*columns).where(table.c.id > last_id, *conditions).order_by(table.c.id).limit(batch_size)
+        ).all()
+        db.session.rollback()  # don't hold a read transaction between pages
+        if not rows:
+            return total
+        for id, location_id_, barber_id, client_name, client_email, day, start_time, services, created_at in rows:
+            created_at = created_at.isoformat(sep=' ') if created_at else None
+            if jsonl:
+                stream.write(json.dumps({
+                    'id': id, 'location_id': location_id_, 'barber_id': barber_id, 'client_name': client_name,
+                    'client_email': client_email, 'date': day.isoformat(), 'start_time': start_time,
+                    'services': [int(s) for s in services.split(',') if s], 'created_at': created_at,
+                }) + '\n')
+            else:
+                writer.writerow((id, location_id_, barber_id, client_name, client_email, day.isoformat(), start_time,
+                                 services, created_at))
+        total += len(rows)
+        last_id = rows[-1][0]
+        if progress:
+            progress(total)
+
+
+def _required_int(row, field):
+    try:
+        return int(row.get(field))
+    except (TypeError, ValueError):
+        raise ImportRowError(f"{field} must be an integer, got {row.get(field)!r}")
+
+
+def _required_text(row, field, max_length):
+    value = (row.get(field) or '').strip()
+    if not value:
+        raise ImportRowError(f"{field} is required")
+    if len(value) > max_length:
+        raise ImportRowError(f"{field} is longer than {max_length} characters")
+    return value
+
+
+def parse_row(row, snapshot):
+    """Validate a row against the catalog and return the appointment's column values
+
+    Raises:
+        ImportRowError: If a field is missing or invalid
+    """
+    if '_error' in row:
+        raise ImportRowError(row['_error'])
+
+    location_id = _required_int(row, 'location_id')
+    if not any(location.id == location_id for location in snapshot.locations):
+        raise ImportRowError(f"unknown location {location_id}")
+
+    barber_id = row.get('barber_id')
+    if barber_id in (None, '', 'any'):
+        barber_id = None
+    else:
+        barber_id = _required_int(row, 'barber_id')
+        barber = snapshot.barbers_by_id.get(barber_id)
+        if barber is None:
+            raise ImportRowError(f"unknown barber {barber_id}")
+        if barber.location_id != location_id:
+            raise ImportRowError(f"barber {barber_id} doesn't work at location {location_id}")
+
+    try:
+        day = date.fromisoformat(str(row.get('date')).strip())
+    except ValueError:
+        raise ImportRowError(f"date must be YYYY-MM-DD, got {row.get('date')!r}")
+
+    start_time = str(row.get('start_time') or '').strip()
+    try:
+        hours, minutes = start_time.split(':')
+        start_minute = int(hours) * 60 + int(minutes)
+        if not (0 <= int(hours) < 24 and 0 <= int(minutes) < 60):
+            raise ValueError(start_time)
+    except ValueError:
+        raise ImportRowError(f"start_time must be HH:MM, got {row.get('start_time')!r}")
+    start_time = f"{start_minute // 60:02d}:{start_minute % 60:02d}"
+
+    services = row.get('services') or []
+    if isinstance(services, str):
+        services = services.replace(';', ',').split(',')
+    try:
+        service_ids = sorted({int(s) for s in services if str(s).strip()})
+    except (TypeError, ValueError):
+        raise ImportRowError(f"services must be service IDs, got {row.get('services')!r}")
+    unknown = [s for s in service_ids if s not in snapshot.services_by_id]
+    if unknown:
+        raise ImportRowError(f"unknown services {unknown}")
+    duration = sum(snapshot.services_by_id[s].duration_minutes for s in service_ids) or DEFAULT_APPOINTMENT_MINUTES
+    if start_minute + duration > 24 * 60:
+        raise ImportRowError("appointment runs past midnight")
+
+    created_at = row.get('created_at')
+    try:
+        created_at = datetime.fromisoformat(created_at) if created_at else datetime.utcnow()
+    except ValueError:
+        raise ImportRowError(f"created_at must be an ISO date and time, got {row.get('created_at')!r}")
+
+    return {
+        'location_id': location_id,
+        'barber_id': barber_id,
+        'client_name': _required_text(row, 'client_name', MAX_NAME_LENGTH),
+        'client_email': _required_text(row, 'client_email', MAX_EMAIL_LENGTH),
+        'date': day,
+        'start_time': start_time,
+        'start_minute': start_minute,
+        'end_minute': start_minute + duration,
+        'services': ','.join(map(str, service_ids)),
+        'created_at': created_at,
+    }, service_ids
+
+
+class AppointmentImporter:
+    """Validate, conflict-check and bulk insert appointment rows in chunks
+
+    Each chunk runs in one write transaction: the occupancy of the chunk's
+    dates is loaded inside it, so bookings made during the import are
+    taken into account, and appointment IDs are assigned up front so the
+    appointment_service links can be inserted in bulk too.
+    """
+
+    def __init__(self, chunk_size=IMPORT_CHUNK_SIZE, dry_run=False, rejects=None, progress=None):
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.rejects = rejects
+        self.progress = progress
+        self.read = 0
+        self.imported = 0
+        self.invalid = 0
+        self.conflicts = 0
+
+    def run(self, rows):
+        """Import ``(line number, row)`` pairs; returns self with the counters filled in"""
+        snapshot = catalog.get()
+        chunk = []
+        for line_number, row in rows:
+            self.read += 1
+            try:
+                chunk.append((line_number, row, *parse_row(row, snapshot)))
+            except ImportRowError as e:
+                self.invalid += 1
+                self._reject(line_number, row, str(e))
+            if len(chunk) >= self.chunk_size:
+                self._import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self._import_chunk(chunk)
+        if not self.dry_run:
+            occupancy_cache.clear()
+        return self
+
+    def _reject(self, line_number, row, error):
+        if self.rejects is not None:
+            self.rejects.write({**{k: v for k, v in row.items() if k != '_error'}, 'line': line_number,
+                                'error': error})
+        else:
+            logger.warning(f"Line {line_number} not imported: {error}")
+
+    def _import_chunk(self, chunk):
+        try:
+            if not self.dry_run:
+                self._lock()
+            days = sorted({values['date'] for _, _, values, _ in chunk})
+            index = AvailabilityIndex.load(days[0], days[-1], use_cache=False, days=days)
+            accepted = []
+            for line_number, row, values, service_ids in chunk:
+                mask = occupancy_mask(values['start_minute'], values['end_minute'] - values['start_minute'])
+                if not index.is_free(values['date'], mask, values['barber_id'], values['location_id']):
+                    self.conflicts += 1
+                    self._reject(line_number, row, "overlaps an existing appointment")
+                    continue
+                index.add(values['date'], mask, values['barber_id'], values['location_id'])
+                accepted.append((values, service_ids))
+
+            if accepted and not self.dry_run:
+                self._insert(accepted)
+                db.session.commit()
+            else:
+                db.session.rollback()
+        except Exception:
+            db.session.rollback()
+            raise
+        self.imported += len(accepted)
+        if self.progress:
+            self.progress(self)
+
+    def _lock(self):
+        """Start the chunk's write transaction (see booking._lock_schedule)"""
+        connection = db.session.connection()
+        if connection.dialect.name == 'sqlite' and not connection.connection.dbapi_connection.in_transaction:
+            connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+    def _insert(self, accepted):
+        connection = db.session.connection()
+        table = Appointment.__table__
+        if connection.dialect.name == 'sqlite':
+            # IDs can be assigned up front: BEGIN IMMEDIATE keeps other writers out
+            next_id = (connection.execute(select(func.max(table.c.id))).scalar() or 0) + 1
+            appointments = [{'id': next_id + i, **values} for i, (values, _) in enumerate(accepted)]
+            connection.execute(insert(table), appointments)
+        else:
+            appointments = [{'id': connection.execute(insert(table).returning(table.c.id), values).scalar_one(),
+                             **values} for values, _ in accepted]
+
+        links = [{'appointment_id': appointment['id'], 'service_id': service_id}
+                 for appointment, (_, service_ids) in zip(appointments, accepted) for service_id in service_ids]
+        if links:
+            connection.execute(insert(appointment_service), links)
+
+
+def _open(path, mode):
+    if path == '-':
+        return sys.stdout if 'w' in mode else sys.stdin
+    return open(path, mode, newline='', encoding='utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help="Write appointments to a file ('-' for stdout)")
+    export_parser.add_argument('path')
+    export_parser.add_argument('--format', choices=FORMATS)
+    export_parser.add_argument('--date-from', type=date.fromisoformat)
+    export_parser.add_argument('--date-to', type=date.fromisoformat)
+    export_parser.add_argument('--location-id', type=int)
+
+    import_parser = commands.add_parser('import', help="Add appointments from a file ('-' for stdin)")
+    import_parser.add_argument('path')
+    import_parser.add_argument('--format', choices=FORMATS)
+    import_parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE)
+    import_parser.add_argument('--dry-run', action='store_true', help="Validate and check conflicts, insert nothing")
+    import_parser.add_argument('--rejects', help="Write rows that weren't imported, with the reason, to this file "
+                                                 "(in the input's format)")
+    args = parser.parse_args()
+
+    fmt = args.format or ('jsonl' if args.path == '-' else detect_format(args.path))
+    started = time.perf_counter()
+
+    def rate(count):
+        return count / max(time.perf_counter() - started, 1e-9)
+
+    from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        if args.command == 'export':
+            stream = _open(args.path, 'w')
+            try:
+                total = export_appointments(stream, fmt, args.date_from, args.date_to, args.location_id,
+                                            progress=lambda n: print(f"Exported {n} ({rate(n):.0f}/s)",
+                                                                     file=sys.stderr))
+            finally:
+                if stream is not sys.stdout:
+                    stream.close()
+            print(f"Exported {total} appointments in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+            return
+
+        rejects_stream = _open(args.rejects, 'w') if args.rejects else None
+        try:
+            with _open(args.path, 'r') as stream:
+                importer = AppointmentImporter(
+                    args.chunk_size, args.dry_run,
+                    RowWriter(rejects_stream, fmt) if rejects_stream else None,
+                    progress=lambda i: print(f"Read {i.read} rows, imported {i.imported} ({rate(i.read):.0f} rows/s)",
+                                             file=sys.stderr))
+                importer.run(read_rows(stream, fmt))
+        finally:
+            if rejects_stream is not None and rejects_stream is not sys.stdout:
+                rejects_stream.close()
+        action = "Would import" if args.dry_run else "Imported"
+        print(f"{action} {importer.imported} of {importer.read} appointments in "
+              f"{time.perf_counter() - started:.1f}s ({importer.invalid} invalid, {importer.conflicts} conflicts)",
+              file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
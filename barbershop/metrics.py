@@ -0,0 +1,185 @@
+"""In-process performance metrics in the Prometheus text format
+
+Fixed-bucket histograms for request latency, SQL queries per request and
+per statement, assistant stages and email delivery. Each histogram keeps
+one small array per label set and caps the number of label sets, so
+memory stays fixed however long the process runs. Served at /metrics.
+
+Every process keeps its own numbers; with several workers, scrape each
+one or compare them side by side.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import g, request
+from sqlalchemy import event
+import logging
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+# Queries per request
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+# Label sets per histogram; further ones are folded into a single "other" series
+MAX_SERIES = 200
+OVERFLOW_LABEL = 'other'
+
+REGISTRY = []
+
+# [statements, seconds] of SQL in the current request; not kept on flask.g because
+# the assistant queries from a nested app context, which has a g of its own
+_request_sql = ContextVar('request_sql', default=None)
+
+
+class Histogram:
+    """Thread-safe histogram with fixed buckets, one series per label set"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [count per bucket..., count above the last bucket, sum]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                if len(self._series) >= MAX_SERIES:
+                    labels = (OVERFLOW_LABEL,) * len(self.labelnames)
+                    series = self._series.get(labels)
+                if series is None:
+                    series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """Observe the duration of a block; also works as a decorator"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, list(values)) for labels, values in self._series.items())
+        for labels, values in series:
+            pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels)]
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                bucket_labels = ','.join(pairs + [f'le="{le}"'])
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {cumulative}")
+            label_text = f"{{{','.join(pairs)}}}" if pairs else ''
+            lines.append(f"{self.name}_sum{label_text} {values[-1]!r}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return '\n'.join(lines)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'barbershop_http_request_duration_seconds', "Time to handle a request, by route, method and status",
+    ('route', 'method', 'status'))
+HTTP_REQUEST_SQL_QUERIES = Histogram(
+    'barbershop_http_request_sql_queries', "SQL statements executed per request, by route",
+    ('route',), QUERY_COUNT_BUCKETS)
+HTTP_REQUEST_SQL_SECONDS = Histogram(
+    'barbershop_http_request_sql_duration_seconds', "Time spent in SQL per request, by route",
+    ('route',))
+SQL_QUERY_SECONDS = Histogram(
+    'barbershop_sql_query_duration_seconds', "Time to execute one SQL statement, by statement type",
+    ('operation',), SQL_LATENCY_BUCKETS)
+ASSISTANT_STAGE_SECONDS = Histogram(
+    'barbershop_assistant_stage_duration_seconds', "Time spent in each stage of an assistant reply",
+    ('stage',))
+EMAIL_SEND_SECONDS = Histogram(
+    'barbershop_email_send_duration_seconds', "Time to hand one message to the SMTP server, by outcome",
+    ('outcome',))
+SMTP_CONNECT_SECONDS = Histogram(
+    'barbershop_smtp_connect_duration_seconds', "Time to open and authenticate an SMTP session")
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    return '\n'.join(histogram.render() for histogram in REGISTRY) + '\n'
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['metrics_query_started'].pop()
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER'
+    if operation not in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+        operation = 'OTHER'
+    SQL_QUERY_SECONDS.observe(elapsed, operation)
+    request_sql = _request_sql.get()
+    if request_sql is not None:
+        request_sql[0] += 1
+        request_sql[1] += elapsed
+
+
+def _handle_error(conn_context):
+    # A failed statement never reaches after_cursor_execute
+    started = conn_context.connection.info.get('metrics_query_started') if conn_context.connection else None
+    if started:
+        started.pop()
+
+
+def _start_request():
+    g.metrics_started = time.perf_counter()
+    g.metrics_sql_token = _request_sql.set([0, 0.0])
+
+
+def _finish_request(response):
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        route = _route()
+        queries, seconds = _request_sql.get()
+        _request_sql.reset(g.pop('metrics_sql_token'))
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route, request.method, str(response.status_code))
+        HTTP_REQUEST_SQL_QUERIES.observe(queries, route)
+        HTTP_REQUEST_SQL_SECONDS.observe(seconds, route)
+    return response
+
+
+def init_metrics(app):
+    """Time the app's requests and SQL statements (call after init_db)"""
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    from db import db
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    with app.app_context():
+        for engine in db.engines.values():
+            if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+                event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+                event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+                event.listen(engine, 'handle_error', _handle_error)
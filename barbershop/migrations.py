@@ -0,0 +1,149 @@
+from datetime import datetime
+from sqlalchemy import select, insert, update, inspect, text, bindparam, func
+from db import db
+from models import Service, appointment_service, DEFAULT_APPOINTMENT_MINUTES
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Names of the migrations that have already run on this database
+schema_migration = db.Table(
+    'schema_migration',
+    db.Column('name', db.String(100), primary_key=True),
+    db.Column('applied_at', db.DateTime, nullable=False),
+)
+
+
+BATCH_SIZE = 10000
+
+
+def _batches(connection, table, columns, condition=None):
+    """Yield lists of rows from a table in primary key order, BATCH_SIZE at a time
+
+    Keyset paging keeps memory flat on large tables and lets the caller
+    write while reading.
+    """
+    last_id = 0
+    while True:
+        query = select(table.c.id, *columns).where(table.c.id > last_id)
+        if condition is not None:
+            query = query.where(condition)
+        rows = connection.execute(query.order_by(table.c.id).limit(BATCH_SIZE)).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def backfill_appointment_services(connection):
+    """Populate appointment_service from the legacy Appointment.services CSV"""
+    appointment = db.metadata.tables['appointment']
+    service_ids = set(connection.execute(select(Service.id)).scalars())
+    already_linked = select(appointment_service.c.appointment_id)
+
+    total = 0
+    for rows in _batches(connection, appointment, [appointment.c.services],
+                         appointment.c.id.not_in(already_linked)):
+        links = []
+        for appointment_id, services in rows:
+            for service_id in {int(s) for s in (services or '').split(',') if s.strip()}:
+                if service_id in service_ids:
+                    links.append({'appointment_id': appointment_id, 'service_id': service_id})
+        if links:
+            connection.execute(insert(appointment_service), links)
+        total += len(links)
+    logger.info(f"Backfilled {total} appointment services")
+
+
+def add_appointment_minute_columns(connection):
+    """Add integer start/end minute columns to appointment and backfill them"""
+    appointment = db.metadata.tables['appointment']
+    existing = {column['name'] for column in inspect(connection).get_columns('appointment')}
+    for column in ('start_minute', 'end_minute'):
+        if column not in existing:
+            connection.execute(text(f"ALTER TABLE appointment ADD COLUMN {column} INTEGER"))
+
+    # Parse "HH:MM" in Python and write the results back in batches
+    statement = (update(appointment)
+                 .where(appointment.c.id == bindparam('appointment_id'))
+                 .values(start_minute=bindparam('minute')))
+    total = 0
+    for rows in _batches(connection, appointment, [appointment.c.start_time],
+                         appointment.c.start_minute.is_(None)):
+        values = []
+        for appointment_id, start_time in rows:
+            try:
+                hours, minutes = start_time.strip().split(':')
+                values.append({'appointment_id': appointment_id, 'minute': int(hours) * 60 + int(minutes)})
+            except (ValueError, AttributeError):
+                logger.warning(f"Appointment {appointment_id} has invalid start time {start_time!r}")
+        if values:
+            connection.execute(statement, values)
+        total += len(values)
+
+    # End times come from the booked services' durations
+    connection.execute(text(
+        "UPDATE appointment SET end_minute = start_minute + COALESCE(("
+        " SELECT SUM(service.duration_minutes) FROM appointment_service"
+        " JOIN service ON service.id = appointment_service.service_id"
+        " WHERE appointment_service.appointment_id = appointment.id), 0)"
+        " WHERE start_minute IS NOT NULL AND end_minute IS NULL"
+    ))
+    connection.execute(text(
+        "UPDATE appointment SET end_minute = start_minute + :default_minutes"
+        " WHERE start_minute IS NOT NULL AND end_minute = start_minute"
+    ), {'default_minutes': DEFAULT_APPOINTMENT_MINUTES})
+    logger.info(f"Backfilled start/end minutes for {total} appointments")
+
+
+def add_appointment_reminder_column(connection):
+    """Add the reminder_sent_at idempotency marker to appointment"""
+    existing = {column['name'] for column in inspect(connection).get_columns('appointment')}
+    if 'reminder_sent_at' not in existing:
+        connection.execute(text("ALTER TABLE appointment ADD COLUMN reminder_sent_at DATETIME"))
+
+
+def unassign_duplicate_slots(connection):
+    """Move appointments that share a barber's start time to "any barber"
+
+    uq_appointment_barber_slot can't be created while two appointments of
+    a barber start at the same time. The earliest booking keeps the slot;
+    the others stay booked for the location without a barber, and are
+    logged so they can be reassigned from the admin dashboard.
+    """
+    appointment = db.metadata.tables['appointment']
+    slot = (appointment.c.barber_id, appointment.c.date, appointment.c.start_time)
+    duplicates = connection.execute(
+        select(*slot).where(appointment.c.barber_id.is_not(None)).group_by(*slot).having(func.count() > 1)
+    ).all()
+    for barber_id, day, start_time in duplicates:
+        ids = connection.execute(
+            select(appointment.c.id)
+            .where(appointment.c.barber_id == barber_id, appointment.c.date == day,
+                   appointment.c.start_time == start_time)
+            .order_by(appointment.c.id)
+        ).scalars().all()
+        connection.execute(update(appointment).where(appointment.c.id.in_(ids[1:])).values(barber_id=None))
+        logger.warning(f"Barber {barber_id} had appointments {ids} at {day} {start_time}; "
+                       f"kept {ids[0]}, moved {ids[1:]} to any barber")
+
+
+# Migrations in the order they must run; each runs once per database
+MIGRATIONS = [
+    ('0001_backfill_appointment_services', backfill_appointment_services),
+    ('0002_appointment_minute_columns', add_appointment_minute_columns),
+    ('0003_appointment_reminder_column', add_appointment_reminder_column),
+    ('0004_unassign_duplicate_slots', unassign_duplicate_slots),
+]
+
+
+def run_migrations():
+    """Apply pending migrations (call inside an app context)"""
+    with db.engine.begin() as connection:
+        applied = set(connection.execute(select(schema_migration.c.name)).scalars())
+        for name, migration in MIGRATIONS:
+            if name in applied:
+                continue
+            logger.info(f"Applying migration {name}")
+            migration(connection)
+            connection.execute(insert(schema_migration).values(name=name, applied_at=datetime.utcnow()))
@@ -1,6 +1,10 @@
 from datetime import datetime
+from sqlalchemy.orm import validates
 from db import db
 
+# Length assumed for an appointment without any (known) services
+DEFAULT_APPOINTMENT_MINUTES = 30
+
 class Location(db.Model):
     """Barbershop location model"""
     id = db.Column(db.Integer, primary_key=True)
@@ -41,8 +45,32 @@ class Service(db.Model):
     def __repr__(self):
         return f'<Service {self.name}>'
 
+# Bumped whenever barbers, services or locations change so cached copies can refresh
+catalog_version = db.Table(
+    'catalog_version',
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('version', db.Integer, nullable=False),
+)
+
+# Services booked for each appointment
+appointment_service = db.Table(
+    'appointment_service',
+    db.Column('appointment_id', db.Integer, db.ForeignKey('appointment.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('service_id', db.Integer, db.ForeignKey('service.id'), primary_key=True),
+    db.Index('ix_appointment_service_service_id', 'service_id'),
+)
+
 class Appointment(db.Model):
     """Customer appointment"""
+    __table_args__ = (
+        # A barber can only start one appointment at a given time
+        db.Index('uq_appointment_barber_slot', 'barber_id', 'date', 'start_time', unique=True),
+        # Match the admin dashboard filters, all sorted by start time
+        db.Index('ix_appointment_date_start', 'date', 'start_minute'),
+        db.Index('ix_appointment_location_date_start', 'location_id', 'date', 'start_minute'),
+        db.Index('ix_appointment_barber_date_start', 'barber_id', 'date', 'start_minute'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     location_id = db.Column(db.Integer, db.ForeignKey('location.id'), nullable=False)
     barber_id = db.Column(db.Integer, db.ForeignKey('barber.id'), nullable=True)  # NULL means "any barber"
@@ -50,8 +78,14 @@ class Appointment(db.Model):
     client_email = db.Column(db.String(100), nullable=False)
     date = db.Column(db.Date, nullable=False)
     start_time = db.Column(db.String(5), nullable=False)  # Format: "HH:MM"
-    services = db.Column(db.Text, nullable=False)  # Comma-separated list of service IDs
+    start_minute = db.Column(db.Integer)  # Minutes since midnight, derived from start_time
+    end_minute = db.Column(db.Integer)  # start_minute plus the booked services' duration
+    services = db.Column(db.Text, nullable=False)  # Legacy comma-separated copy of the service IDs
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    reminder_sent_at = db.Column(db.DateTime)  # Set when the reminder email was claimed for sending
+    
+    # Relationships
+    service_items = db.relationship('Service', secondary=appointment_service, order_by='Service.id', lazy=True)
     
     def __repr__(self):
         return f'<Appointment {self.id}: {self.client_name}>'
@@ -59,6 +93,63 @@ class Appointment(db.Model):
     @property
     def service_list(self):
         """Return list of service IDs"""
+        if self.service_items:
+            return [service.id for service in self.service_items]
         if not self.services:
             return []
-        return [int(s) for s in self.services.split(',')] 
\ No newline at end of file
+        return [int(s) for s in self.services.split(',')]
+    
+    @property
+    def duration_minutes(self):
+        """Total length of the booked services"""
+        return sum(service.duration_minutes for service in self.service_items) or DEFAULT_APPOINTMENT_MINUTES
+    
+    def set_services(self, service_ids):
+        """Set the booked services, keeping the legacy CSV column in sync"""
+        service_ids = sorted({int(s) for s in service_ids})
+        self.services = ','.join(str(s) for s in service_ids)
+        self.service_items = Service.query.filter(Service.id.in_(service_ids)).all() if service_ids else []
+        self._update_end_minute()
+    
+    @validates('start_time')
+    def _validate_start_time(self, key, value):
+        """Keep the integer start_minute/end_minute columns in sync"""
+        try:
+            hours, minutes = value.strip().split(':')
+            self.start_minute = int(hours) * 60 + int(minutes)
+        except (ValueError, AttributeError):
+            self.start_minute = None
+        self._update_end_minute()
+        return value
+    
+    def _update_end_minute(self):
+        if self.start_minute is None:
+            self.end_minute = None
+            return
+        # Loading service_items must not flush half-edited changes
+        with db.session.no_autoflush:
+            self.end_minute = self.start_minute + self.duration_minutes
+
+class EmailOutbox(db.Model):
+    """Email waiting to be delivered by the outbox workers"""
+    __table_args__ = (
+        # Workers look for due messages
+        db.Index('ix_email_outbox_status_due', 'status', 'next_attempt_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # e.g. "confirmation"
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id', ondelete='SET NULL'))
+    recipient = db.Column(db.String(100), nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending, sending, sent or dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    
+    # Relationships
+    appointment = db.relationship('Appointment')
+    
+    def __repr__(self):
+        return f'<EmailOutbox {self.id}: {self.kind} to {self.recipient} ({self.status})>'
@@ -0,0 +1,221 @@
+import os
+import queue
+import random
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from sqlalchemy.orm import joinedload, selectinload
+from db import db
+from models import Appointment, EmailOutbox
+import email_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Outbox message states
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+DEAD = 'dead'
+
+EMAIL_OUTBOX_WORKERS = int(os.getenv('EMAIL_OUTBOX_WORKERS', 2))
+EMAIL_OUTBOX_POLL_SECONDS = float(os.getenv('EMAIL_OUTBOX_POLL_SECONDS', 5))
+EMAIL_MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', 8))
+EMAIL_RETRY_BASE_SECONDS = float(os.getenv('EMAIL_RETRY_BASE_SECONDS', 30))
+EMAIL_RETRY_MAX_SECONDS = float(os.getenv('EMAIL_RETRY_MAX_SECONDS', 3600))
+
+# A claimed message is handed to another worker if not finished within this time
+CLAIM_LEASE_SECONDS = 300
+
+
+def _test_mode():
+    return os.getenv('EMAIL_TEST_MODE', 'true').lower() == 'true'
+
+
+def _send_confirmation(message):
+    appointment = message.appointment
+    if appointment is None:
+        raise LookupError("the appointment no longer exists")
+    email_service.deliver_confirmation_email(appointment, appointment.service_items, test_mode=_test_mode())
+
+
+# How each kind of outbox message is delivered
+SENDERS = {
+    'confirmation': _send_confirmation,
+}
+
+
+def enqueue_confirmation(appointment):
+    """Queue a confirmation email in the current transaction
+
+    The message is only visible to the workers once the caller commits, so
+    it exists exactly when the appointment does.
+    """
+    message = EmailOutbox(kind='confirmation', appointment=appointment, recipient=appointment.client_email)
+    db.session.add(message)
+    return message
+
+
+def cancel_appointment_messages(appointment_id):
+    """Stop the appointment's undelivered emails in the current transaction
+
+    Call it before deleting the appointment: SQLite can reuse the ID, and a
+    message still pointing at it would go out for someone else's booking.
+    """
+    db.session.execute(
+        update(EmailOutbox)
+        .where(EmailOutbox.appointment_id == appointment_id, EmailOutbox.status.in_((PENDING, SENDING)))
+        .values(status=DEAD, appointment_id=None, last_error="the appointment was deleted")
+    )
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter after ``attempts`` failed deliveries"""
+    delay = min(EMAIL_RETRY_MAX_SECONDS, EMAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+
+def claim_due_messages(limit):
+    """Mark up to ``limit`` due messages as being sent and return their IDs
+
+    Each claim is a conditional update, so several processes can drain the
+    same outbox without sending a message twice. Claims expire after
+    CLAIM_LEASE_SECONDS in case a worker dies mid-delivery.
+    """
+    now = datetime.utcnow()
+    due = (EmailOutbox.status.in_((PENDING, SENDING)), EmailOutbox.next_attempt_at <= now)
+    candidates = db.session.execute(
+        select(EmailOutbox.id).where(*due).order_by(EmailOutbox.next_attempt_at).limit(limit)
+    ).scalars().all()
+
+    claimed = []
+    for message_id in candidates:
+        result = db.session.execute(
+            update(EmailOutbox)
+            .where(EmailOutbox.id == message_id, *due)
+            .values(status=SENDING, next_attempt_at=now + timedelta(seconds=CLAIM_LEASE_SECONDS))
+        )
+        if result.rowcount:
+            claimed.append(message_id)
+    db.session.commit()
+    return claimed
+
+
+def deliver_message(message_id):
+    """Try to deliver one claimed message and record the outcome"""
+    # Everything the email shows comes with the message, rather than one lazy load per relationship
+    appointment = joinedload(EmailOutbox.appointment)
+    message = db.session.get(EmailOutbox, message_id,
+                             options=[appointment.joinedload(Appointment.location),
+                                      appointment.joinedload(Appointment.barber),
+                                      appointment.selectinload(Appointment.service_items)])
+    if message is None or message.status != SENDING:
+        return
+
+    message.attempts += 1
+    try:
+        SENDERS[message.kind](message)
+    except Exception as e:
+        message.last_error = str(e)[:1000]
+        if isinstance(e, LookupError) or message.attempts >= EMAIL_MAX_ATTEMPTS:
+            message.status = DEAD
+            logger.error(f"Giving up on {message} after {message.attempts} attempts: {str(e)}")
+        else:
+            message.status = PENDING
+            message.next_attempt_at = datetime.utcnow() + retry_delay(message.attempts)
+            logger.warning(f"Delivery of {message} failed, retrying at {message.next_attempt_at}: {str(e)}")
+    else:
+        message.status = SENT
+        message.sent_at = datetime.utcnow()
+    db.session.commit()
+
+
+class OutboxDispatcher:
+    """Drains the email outbox on background threads
+
+    A dispatcher thread claims due messages and hands them to a fixed set
+    of delivery threads. It polls every ``poll_seconds`` and wakes up
+    straight away when ``notify`` is called after a commit.
+    """
+
+    def __init__(self, app, workers=EMAIL_OUTBOX_WORKERS, poll_seconds=EMAIL_OUTBOX_POLL_SECONDS):
+        self.app = app
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self._queue = queue.Queue()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        if self._threads:
+            return
+        with self._start_lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            threads = [threading.Thread(target=self._work, name=f"outbox-worker-{i}", daemon=True)
+                       for i in range(self.workers)]
+            threads.append(threading.Thread(target=self._dispatch, name="outbox-dispatcher", daemon=True))
+            for thread in threads:
+                thread.start()
+            self._threads = threads
+        logger.info(f"Started email outbox with {self.workers} delivery workers")
+
+    def stop(self, timeout=None):
+        """Finish the messages in hand and stop all threads"""
+        self._stop.set()
+        self._wake.set()
+        for _ in range(self.workers):
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def notify(self):
+        """Deliver newly committed messages without waiting for the next poll"""
+        self._wake.set()
+
+    def _dispatch(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    claimed = claim_due_messages(self.workers)
+            except Exception as e:
+                logger.error(f"Error claiming outbox messages: {str(e)}")
+                claimed = []
+
+            for message_id in claimed:
+                self._queue.put(message_id)
+            if claimed:
+                self._queue.join()
+                continue
+            self._wake.wait(self.poll_seconds)
+
+    def _work(self):
+        while True:
+            message_id = self._queue.get()
+            try:
+                if message_id is None:
+                    return
+                with self.app.app_context():
+                    deliver_message(message_id)
+            except Exception as e:
+                logger.error(f"Error delivering outbox message {message_id}: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+
+if __name__ == "__main__":
+    # Run delivery workers as a separate process: python outbox.py
+    # (set EMAIL_OUTBOX_AUTOSTART=false for the web workers)
+    from app import create_app
+
+    outbox_dispatcher = create_app().extensions['email_outbox']
+    outbox_dispatcher.start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        outbox_dispatcher.stop()
@@ -0,0 +1,149 @@
+"""Per-request SQL auditing for development and tests
+
+With QUERY_AUDIT on, every statement a request issues is recorded. After
+the request the statements are checked for:
+
+  * N+1 patterns: the same statement (ignoring parameter values and the
+    length of IN lists) run N_PLUS_ONE_THRESHOLD or more times, typically
+    a lazy relationship loaded once per row of a list
+  * the route's query budget (ROUTE_QUERY_BUDGETS, else the default)
+
+Problems are logged; with QUERY_AUDIT_STRICT the request fails with
+QueryBudgetExceeded instead, so test runs catch regressions. Each response
+carries an X-Query-Count header. python -m benchmarks.query_budgets runs
+every route against a synthetic database and reports the numbers.
+"""
+import os
+import re
+from collections import Counter, deque
+from contextvars import ContextVar
+from flask import g, request
+from sqlalchemy import event
+import logging
+
+logger = logging.getLogger(__name__)
+
+QUERY_BUDGET_DEFAULT = int(os.getenv('QUERY_BUDGET_DEFAULT', 10))
+N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', 3))
+
+# Most statements a request to the route may issue, with the catalog and occupancy caches cold
+ROUTE_QUERY_BUDGETS = {
+    '/': 0,
+    '/assistant': 0,
+    '/api/assistant/start': 1,
+    '/api/assistant/message': 10,
+    '/api/assistant/history': 1,
+    '/book': 5,
+    '/book/specialist': 5,
+    '/book/services': 5,
+    '/book/datetime': 0,
+    '/api/availability': 4,
+    '/book/review': 3,
+    '/book/confirm': 10,
+    '/admin/login': 0,
+    '/admin/dashboard': 4,
+    '/admin/cache-stats': 0,
+    '/metrics': 0,
+    '/admin/appointment/<int:id>': 11,
+    '/admin/appointment/delete/<int:id>': 5,
+}
+
+# Reports kept for inspection (app.extensions['query_audit'].reports)
+REPORT_HISTORY = 1000
+
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+# Statements of the current request; a context variable rather than flask.g because
+# the assistant runs its queries in a nested app context, which has a g of its own
+_statements = ContextVar('audit_statements', default=None)
+
+
+class QueryBudgetExceeded(RuntimeError):
+    """A request issued more SQL than its budget allows, or repeated a statement"""
+
+
+def normalise(statement):
+    """Statement text with IN lists collapsed, so one query shape maps to one key"""
+    return _IN_LIST.sub('(?)', _WHITESPACE.sub(' ', statement).strip())
+
+
+class QueryReport:
+    """Statements issued by one request and what was wrong with them"""
+
+    def __init__(self, method, route, statements, budget, threshold):
+        self.method = method
+        self.route = route
+        self.statements = statements
+        self.budget = budget
+        self.repeated = [(statement, count) for statement, count in Counter(map(normalise, statements)).most_common()
+                         if count >= threshold]
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def problems(self):
+        problems = []
+        if self.count > self.budget:
+            problems.append(f"{self.count} queries, budget {self.budget}")
+        problems.extend(f"possible N+1: {count}x {statement[:200]}" for statement, count in self.repeated)
+        return problems
+
+
+class QueryAudit:
+    """Collects the statements of each request and checks them after it"""
+
+    def __init__(self, app):
+        self.budgets = {**ROUTE_QUERY_BUDGETS, **app.config.get('QUERY_BUDGETS', {})}
+        self.default_budget = app.config.get('QUERY_BUDGET_DEFAULT', QUERY_BUDGET_DEFAULT)
+        self.threshold = app.config.get('N_PLUS_ONE_THRESHOLD', N_PLUS_ONE_THRESHOLD)
+        self.strict = app.config.get('QUERY_AUDIT_STRICT', False)
+        self.reports = deque(maxlen=REPORT_HISTORY)
+
+    def budget(self, route):
+        return self.budgets.get(route, self.default_budget)
+
+    def start_request(self):
+        g.audit_token = _statements.set([])
+
+    def finish_request(self, response):
+        token = g.pop('audit_token', None)
+        if token is None:
+            return response
+        statements = _statements.get()
+        _statements.reset(token)
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        report = QueryReport(request.method, route, statements, self.budget(route), self.threshold)
+        self.reports.append(report)
+        response.headers['X-Query-Count'] = str(report.count)
+        problems = report.problems
+        if problems:
+            message = f"{request.method} {route}: " + "; ".join(problems)
+            if self.strict:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+
+def _record_statement(conn, cursor, statement, parameters, context, executemany):
+    statements = _statements.get()
+    if statements is not None:
+        statements.append(statement)
+
+
+def init_query_audit(app):
+    """Audit the app's requests if QUERY_AUDIT is set (call after init_db)"""
+    if not app.config.get('QUERY_AUDIT'):
+        return None
+    from db import db
+
+    audit = app.extensions['query_audit'] = QueryAudit(app)
+    app.before_request(audit.start_request)
+    app.after_request(audit.finish_request)
+    with app.app_context():
+        for engine in db.engines.values():
+            if not event.contains(engine, 'before_cursor_execute', _record_statement):
+                event.listen(engine, 'before_cursor_execute', _record_statement)
+    return audit
@@ -0,0 +1,181 @@
+"""Send reminder emails for the next day's appointments
+
+Run once a day, e.g. from cron:
+
+    python reminders.py                    # tomorrow's appointments
+    python reminders.py --date 2024-06-01 --workers 8 --chunk-size 500
+    python reminders.py --dry-run          # count and render, send nothing
+"""
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from sqlalchemy import select, update
+from sqlalchemy.orm import joinedload, selectinload
+from db import db
+from models import Appointment
+import email_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+REMINDER_CHUNK_SIZE = int(os.getenv('REMINDER_CHUNK_SIZE', 500))
+REMINDER_WORKERS = int(os.getenv('REMINDER_WORKERS', 4))
+
+
+def pending_reminder_ids(day, chunk_size):
+    """Yield lists of IDs of the day's appointments that haven't had a reminder
+
+    Pages through the appointments by primary key, so memory stays flat
+    however many there are and no read transaction is held open while the
+    workers write their markers (SQLite allows only one writer at a time).
+    """
+    last_id = 0
+    while True:
+        ids = db.session.execute(
+            select(Appointment.id)
+            .where(Appointment.date == day,
+                   Appointment.reminder_sent_at.is_(None),
+                   Appointment.id > last_id)
+            .order_by(Appointment.id)
+            .limit(chunk_size)
+        ).scalars().all()
+        db.session.rollback()  # end the read transaction between pages
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def claim(appointment_ids):
+    """Set reminder_sent_at on appointments not yet claimed; returns the claimed IDs
+
+    Claiming before sending means a rerun (or a second concurrent run)
+    never sends the same reminder twice.
+    """
+    now = datetime.utcnow()
+    unclaimed = (Appointment.id.in_(appointment_ids), Appointment.reminder_sent_at.is_(None))
+    if db.engine.dialect.update_returning:
+        claimed = db.session.execute(
+            update(Appointment).where(*unclaimed).values(reminder_sent_at=now).returning(Appointment.id)
+        ).scalars().all()
+        db.session.commit()
+        return claimed
+
+    claimed = []
+    for appointment_id in appointment_ids:
+        result = db.session.execute(
+            update(Appointment)
+            .where(Appointment.id == appointment_id, Appointment.reminder_sent_at.is_(None))
+            .values(reminder_sent_at=now)
+        )
+        if result.rowcount:
+            claimed.append(appointment_id)
+    db.session.commit()
+    return claimed
+
+
+def release(appointment_ids):
+    """Clear the marker of reminders that failed so the next run retries them"""
+    if appointment_ids:
+        db.session.execute(update(Appointment)
+                           .where(Appointment.id.in_(appointment_ids))
+                           .values(reminder_sent_at=None))
+        db.session.commit()
+
+
+def load_appointments(appointment_ids):
+    """Appointments with everything the reminder email shows, in a few queries"""
+    return db.session.execute(
+        select(Appointment)
+        .where(Appointment.id.in_(appointment_ids))
+        .options(joinedload(Appointment.location),
+                 joinedload(Appointment.barber),
+                 selectinload(Appointment.service_items))
+        .order_by(Appointment.id)
+    ).scalars().all()
+
+
+def send_chunk(app, appointment_ids, dry_run=False, test_mode=False):
+    """Claim, render and send one chunk of reminders; returns (sent, failed)"""
+    with app.app_context():
+        if dry_run:
+            appointments = load_appointments(appointment_ids)
+            email_service.render_reminders([(a, a.service_items) for a in appointments])
+            return len(appointments), 0
+
+        claimed = claim(appointment_ids)
+        if not claimed:
+            return 0, 0
+        appointments = load_appointments(claimed)
+        db.session.close()  # keep the loaded objects but don't hold a read lock while sending
+        try:
+            results = email_service.send_reminder_emails([(a, a.service_items) for a in appointments],
+                                                         test_mode=test_mode)
+        except Exception as e:
+            logger.error(f"Reminder chunk of {len(claimed)} failed: {str(e)}")
+            release(claimed)
+            return 0, len(claimed)
+
+        failed = [appointment.id for appointment, error in zip(appointments, results) if error is not None]
+        for appointment, error in zip(appointments, results):
+            if error is not None:
+                logger.warning(f"Reminder for appointment {appointment.id} failed: {str(error)}")
+        release(failed)
+        return len(claimed) - len(failed), len(failed)
+
+
+def send_reminders(app, day, chunk_size=REMINDER_CHUNK_SIZE, workers=REMINDER_WORKERS, dry_run=False):
+    """Send reminders for every appointment on ``day``; returns (sent, failed)
+
+    Chunks of appointments are sent in parallel, with at most two chunks
+    per worker in flight so memory use doesn't depend on the day's volume.
+    """
+    test_mode = os.getenv('EMAIL_TEST_MODE', 'true').lower() == 'true'
+    in_flight = threading.BoundedSemaphore(workers * 2)
+    totals = [0, 0]
+    lock = threading.Lock()
+
+    def done(future):
+        in_flight.release()
+        try:
+            sent, failed = future.result()
+        except Exception as e:
+            # Unclaimed appointments are picked up by the next run
+            logger.error(f"Reminder chunk failed: {str(e)}")
+            return
+        with lock:
+            totals[0] += sent
+            totals[1] += failed
+
+    with ThreadPoolExecutor(max_workers=workers) as executor, app.app_context():
+        for appointment_ids in pending_reminder_ids(day, chunk_size):
+            in_flight.acquire()
+            future = executor.submit(send_chunk, app, appointment_ids, dry_run, test_mode)
+            future.add_done_callback(done)
+    return tuple(totals)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--date', type=date.fromisoformat, default=date.today() + timedelta(days=1),
+                        help="Appointment date (default: tomorrow)")
+    parser.add_argument('--chunk-size', type=int, default=REMINDER_CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=REMINDER_WORKERS)
+    parser.add_argument('--dry-run', action='store_true', help="Render the reminders without sending them")
+    args = parser.parse_args()
+
+    from app import create_app
+
+    app = create_app()
+    started = time.perf_counter()
+    sent, failed = send_reminders(app, args.date, args.chunk_size, args.workers, args.dry_run)
+    action = "Rendered" if args.dry_run else "Sent"
+    print(f"{action} {sent} reminders for {args.date.isoformat()} in {time.perf_counter() - started:.1f}s"
+          f" ({failed} failed)")
+
+
+if __name__ == "__main__":
+    main()
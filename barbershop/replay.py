@@ -0,0 +1,188 @@
+"""Replay recorded assistant conversations in bulk
+
+Each line of the input is one JSON transcript:
+
+    {"id": "t-1", "recorded_on": "2024-06-03",
+     "turns": [{"user": "I need a haircut tomorrow", "entities": {"date": "2024-06-04"}}, ...]}
+
+Transcripts are spread over a pool of worker processes, each with its own
+BarberAssistant and in-memory sessions, and their turns are replayed in
+order. Every turn's latency, time spent extracting entities, reply and
+extracted entities are written out in the same format, so a run's output
+is the baseline for the next. Where a turn carries ``entities``, any that
+differ are reported (dates are compared relative to the day of the run).
+
+    python replay.py transcripts.jsonl --workers 8 --dry-run
+    python replay.py transcripts.jsonl --output replayed.jsonl --limit 1000
+
+--dry-run answers confirmations without calling _create_booking, so
+nothing is written to the database.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+REPLAY_WORKERS = int(os.getenv('REPLAY_WORKERS') or os.cpu_count() or 1)
+
+# Transcripts handed to a worker at a time
+REPLAY_CHUNK_SIZE = 8
+
+_assistant = None
+
+
+def read_transcripts(path, limit=None):
+    """Yield transcripts from a JSONL file, numbering those without an id"""
+    with open(path, encoding='utf-8') as f:
+        count = 0
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            if limit is not None and count >= limit:
+                return
+            transcript = json.loads(line)
+            transcript.setdefault('id', f"line-{line_number}")
+            count += 1
+            yield transcript
+
+
+def comparable(entities, day):
+    """Entities with the date as an offset from ``day``, so runs on different days compare equal"""
+    entities = dict(entities)
+    if entities.get('date'):
+        try:
+            offset = (date.fromisoformat(entities['date']) - day).days
+        except ValueError:
+            return entities
+        entities['date'] = f"day{offset:+d}"
+    return entities
+
+
+def entity_diff(expected, actual, expected_day, actual_day):
+    """{entity: [expected, actual]} for entities that differ"""
+    expected = comparable(expected, expected_day)
+    actual = comparable(actual, actual_day)
+    return {key: [expected.get(key), actual.get(key)]
+            for key in sorted(expected.keys() | actual.keys()) if expected.get(key) != actual.get(key)}
+
+
+def _init_worker(dry_run):
+    """Build this worker's app and assistant"""
+    global _assistant
+    logging.disable(logging.INFO)
+    from app import create_app
+    from session_store import MemorySessionStore
+    from voice_assistant import BarberAssistant
+
+    app = create_app({'EMAIL_OUTBOX_AUTOSTART': False})
+    _assistant = BarberAssistant(app, session_store=MemorySessionStore(max_sessions=REPLAY_CHUNK_SIZE * 4))
+
+    # Keep each turn's entities and how long extracting them took
+    extract = _assistant._extract_entities
+
+    def recording_extract(message):
+        started = time.perf_counter()
+        entities = extract(message)
+        _assistant.last_extraction = (entities, time.perf_counter() - started)
+        return entities
+
+    _assistant._extract_entities = recording_extract
+    if dry_run:
+        _assistant._create_booking = lambda state: True
+
+
+def replay_transcript(transcript):
+    """Replay one transcript in a fresh session; returns it with the observed turns"""
+    session_id = f"replay-{transcript['id']}"
+    today = date.today()
+    recorded_on = date.fromisoformat(transcript['recorded_on']) if transcript.get('recorded_on') else today
+    _assistant.conversation_state.delete(session_id)
+    _assistant.start_conversation(session_id)
+
+    turns = []
+    for turn in transcript['turns']:
+        _assistant.last_extraction = (None, 0.0)
+        started = time.perf_counter()
+        try:
+            reply = _assistant.process_message(session_id, turn['user'])
+            error = None
+        except Exception as e:
+            reply, error = None, str(e)
+        latency = time.perf_counter() - started
+        entities, extract_seconds = _assistant.last_extraction
+
+        result = {'user': turn['user'], 'reply': reply, 'entities': entities,
+                  'stage': _assistant.conversation_state[session_id].get('current_stage'),
+                  'latency_ms': round(latency * 1000, 3), 'extract_ms': round(extract_seconds * 1000, 3)}
+        if error:
+            result['error'] = error
+        if 'entities' in turn and entities is not None:
+            diff = entity_diff(turn['entities'] or {}, entities, recorded_on, today)
+            if diff:
+                result['entity_diff'] = diff
+        turns.append(result)
+    _assistant.conversation_state.delete(session_id)
+    return {**transcript, 'recorded_on': today.isoformat(), 'turns': turns}
+
+
+def percentile(ordered, p):
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)] if ordered else 0.0
+
+
+def replay(path, workers=REPLAY_WORKERS, dry_run=False, limit=None, output=None):
+    """Replay every transcript in ``path``; returns summary statistics"""
+    latencies = []
+    extract_latencies = []
+    transcripts = mismatched_turns = errors = 0
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(dry_run,)) as executor:
+        for replayed in executor.map(replay_transcript, read_transcripts(path, limit), chunksize=REPLAY_CHUNK_SIZE):
+            transcripts += 1
+            for turn in replayed['turns']:
+                latencies.append(turn['latency_ms'])
+                extract_latencies.append(turn['extract_ms'])
+                mismatched_turns += 'entity_diff' in turn
+                errors += 'error' in turn
+            if output:
+                output.write(json.dumps(replayed) + '\n')
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    extract_latencies.sort()
+    return {'transcripts': transcripts, 'turns': len(latencies), 'seconds': round(elapsed, 2),
+            'messages_per_second': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+            'latency_ms': {f"p{p}": percentile(latencies, p) for p in (50, 95, 99)},
+            'extract_ms': {f"p{p}": percentile(extract_latencies, p) for p in (50, 95, 99)},
+            'entity_mismatches': mismatched_turns, 'errors': errors, 'dry_run': dry_run,
+            'finished': datetime.now().isoformat(timespec='seconds')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('transcripts', help="JSONL file, one transcript per line")
+    parser.add_argument('--workers', type=int, default=REPLAY_WORKERS)
+    parser.add_argument('--dry-run', action='store_true', help="Don't create bookings")
+    parser.add_argument('--limit', type=int, help="Replay only the first N transcripts")
+    parser.add_argument('--output', help="Write the replayed transcripts (turn latencies, entities, diffs) here")
+    args = parser.parse_args()
+
+    output = open(args.output, 'w', encoding='utf-8') if args.output else None
+    try:
+        summary = replay(args.transcripts, args.workers, args.dry_run, args.limit, output)
+    finally:
+        if output:
+            output.close()
+    print(json.dumps(summary, indent=2))
+    if summary['entity_mismatches'] or summary['errors']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
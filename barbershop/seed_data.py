@@ -1,17 +1,16 @@
-from app import app
-from db import db
+import argparse
+from app import create_app
+from db import db, create_schema
 from models import Location, Barber, Service
 from datetime import datetime
+import synthetic_data
 
 def seed_database():
     """Add initial data to the database"""
     
     print("Clearing existing data...")
-    # Clear existing data
-    db.session.query(Barber).delete()
-    db.session.query(Service).delete()
-    db.session.query(Location).delete()
-    db.session.commit()
+    # Clear existing data, appointments first so none points at a removed barber
+    synthetic_data.reset_database()
     
     print("Adding locations...")
     # Add locations
@@ -109,6 +108,36 @@ def seed_database():
     db.session.commit()
     print("Database seeded successfully!")
 
-if __name__ == "__main__":
+def main():
+    parser = argparse.ArgumentParser(description="Seed the database with demo or synthetic data")
+    parser.add_argument('--synthetic', action='store_true',
+                        help="Generate a large deterministic dataset instead of the demo shop")
+    parser.add_argument('--locations', type=int, default=10)
+    parser.add_argument('--barbers-per-location', type=int, default=6)
+    parser.add_argument('--services', type=int, default=12)
+    parser.add_argument('--years', type=float, default=2.0, help="Years of appointment history")
+    parser.add_argument('--future-days', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--reset', action='store_true', help="Delete all existing data first")
+    args = parser.parse_args()
+
+    app = create_app()
     with app.app_context():
-        seed_database() 
\ No newline at end of file
+        create_schema()
+        if not args.synthetic:
+            seed_database()
+            return
+        if args.reset:
+            synthetic_data.reset_database()
+        counts = synthetic_data.generate(locations=args.locations,
+                                         barbers_per_location=args.barbers_per_location,
+                                         services=args.services,
+                                         history_days=int(args.years * 365),
+                                         future_days=args.future_days,
+                                         seed=args.seed,
+                                         progress=lambda day, count: print(f"  {count} appointments up to {day}"))
+        print("Generated " + ", ".join(f"{count} {table}" for table, count in counts.items()))
+
+if __name__ == "__main__":
+    main()
+ 
\ No newline at end of file
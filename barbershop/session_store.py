@@ -0,0 +1,265 @@
+import asyncio
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def trim_history(state, max_history):
+    """Drop the oldest messages beyond ``max_history``
+
+    ``history_offset`` counts the dropped messages so message indexes stay
+    stable for clients that track how far they have read.
+    """
+    history = state.get("history", [])
+    excess = len(history) - max_history
+    if max_history and excess > 0:
+        del history[:excess]
+        state["history_offset"] = state.get("history_offset", 0) + excess
+
+
+def history_cursor(payload):
+    """Client's history cursor: 0 on resync, None if it didn't send one"""
+    if payload.get('resync'):
+        return 0
+    cursor = payload.get('cursor')
+    if cursor is None:
+        return None
+    if isinstance(cursor, bool) or not isinstance(cursor, int) or cursor < 0:
+        raise ValueError(cursor)
+    return cursor
+
+
+class MemorySessionStore:
+    """In-process conversation store with TTL expiry and LRU eviction
+
+    Sessions idle for longer than ``ttl_seconds`` expire, the least
+    recently used session is evicted once ``max_sessions`` is reached and
+    each session keeps at most ``max_history`` messages.
+    """
+
+    def __init__(self, ttl_seconds=3600, max_sessions=10000, max_history=100):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_history = max_history
+        self._sessions = OrderedDict()  # session_id -> (last_access, state)
+        self._lock = threading.RLock()
+
+    def _expired(self, last_access, now):
+        return now - last_access > self.ttl_seconds
+
+    def get(self, session_id, default=None):
+        """Return a session's state and mark it as recently used"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return default
+            if self._expired(entry[0], now):
+                del self._sessions[session_id]
+                return default
+            self._sessions[session_id] = (now, entry[1])
+            self._sessions.move_to_end(session_id)
+            return entry[1]
+
+    def load(self, session_id):
+        """Return the latest state of a session (None if unknown)"""
+        return self.get(session_id)
+
+    def save(self, session_id, state):
+        """Store a session's state after it was modified, applying the history cap"""
+        trim_history(state, self.max_history)
+        self[session_id] = state
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def purge_expired(self):
+        """Remove all expired sessions; returns how many were removed"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [session_id for session_id, (last_access, _) in self._sessions.items()
+                       if self._expired(last_access, now)]
+            for session_id in expired:
+                del self._sessions[session_id]
+        return len(expired)
+
+    def __getitem__(self, session_id):
+        state = self.get(session_id)
+        if state is None:
+            raise KeyError(session_id)
+        return state
+
+    def __setitem__(self, session_id, state):
+        with self._lock:
+            self._sessions[session_id] = (time.monotonic(), state)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SQLiteSessionStore:
+    """Conversation store persisted in a SQLite file
+
+    Sessions survive restarts and are shared by every worker process that
+    points at the same file. Every read goes to the database, so the turn
+    another worker handled last is never missed: callers ``load`` a
+    session, change the returned state and ``save`` it back.
+    """
+
+    def __init__(self, path, ttl_seconds=3600, max_sessions=10000, max_history=100, cleanup_every=500):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_history = max_history
+        self.cleanup_every = cleanup_every
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS assistant_session ("
+                " session_id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS ix_assistant_session_updated_at ON assistant_session (updated_at)"
+            )
+
+    def _connection(self):
+        """One connection per thread, in WAL mode so workers don't block readers"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, session_id, default=None):
+        """Return a session's state as stored in the database"""
+        state = self.load(session_id)
+        return default if state is None else state
+
+    def load(self, session_id):
+        """Read a session from the database (None if unknown or expired)"""
+        row = self._connection().execute(
+            "SELECT state FROM assistant_session WHERE session_id = ? AND updated_at > ?",
+            (session_id, time.time() - self.ttl_seconds)
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def save(self, session_id, state):
+        """Write a session's state to the database"""
+        trim_history(state, self.max_history)
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT INTO assistant_session (session_id, state, updated_at) VALUES (?, ?, ?)"
+                " ON CONFLICT(session_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                (session_id, json.dumps(state), time.time())
+            )
+
+        with self._lock:
+            self._writes += 1
+            cleanup = self._writes % self.cleanup_every == 0
+        if cleanup:
+            self.purge_expired()
+
+    def delete(self, session_id):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM assistant_session WHERE session_id = ?", (session_id,))
+
+    def purge_expired(self):
+        """Remove expired sessions and the oldest ones beyond ``max_sessions``"""
+        with self._connection() as connection:
+            removed = connection.execute(
+                "DELETE FROM assistant_session WHERE updated_at <= ?", (time.time() - self.ttl_seconds,)
+            ).rowcount
+            removed += connection.execute(
+                "DELETE FROM assistant_session WHERE session_id IN ("
+                " SELECT session_id FROM assistant_session ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_sessions,)
+            ).rowcount
+        if removed:
+            logger.info(f"Removed {removed} expired assistant sessions")
+        return removed
+
+    def __getitem__(self, session_id):
+        state = self.get(session_id)
+        if state is None:
+            raise KeyError(session_id)
+        return state
+
+    def __setitem__(self, session_id, state):
+        self.save(session_id, state)
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM assistant_session").fetchone()[0]
+
+
+class AsyncSessionStore:
+    """Asyncio front for a session store, used by the ASGI assistant
+
+    Turns of one session are serialised with a per-session lock, which only
+    exists while someone holds or waits for it, so idle sessions cost
+    nothing here. Calls to a store that does I/O (SQLite) run in
+    ``executor``; the in-memory store is called directly on the event loop.
+    """
+
+    def __init__(self, store, executor=None):
+        self.store = store
+        self.executor = executor
+        self._blocking = not isinstance(store, MemorySessionStore)
+        self._locks = weakref.WeakValueDictionary()  # session_id -> asyncio.Lock
+
+    def lock(self, session_id):
+        """Lock to hold while a session is loaded, changed and saved"""
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        return lock
+
+    async def call(self, function, *args):
+        """Run ``function``, which touches the store, without blocking the event loop"""
+        if not self._blocking:
+            return function(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(function, *args))
+
+    async def load(self, session_id):
+        return await self.call(self.store.load, session_id)
+
+    async def save(self, session_id, state):
+        return await self.call(self.store.save, session_id, state)
+
+    async def delete(self, session_id):
+        return await self.call(self.store.delete, session_id)
+
+
+def create_session_store():
+    """Build the session store selected by the ASSISTANT_SESSION_* settings"""
+    options = {
+        'ttl_seconds': float(os.getenv('ASSISTANT_SESSION_TTL', 3600)),
+        'max_sessions': int(os.getenv('ASSISTANT_MAX_SESSIONS', 10000)),
+        'max_history': int(os.getenv('ASSISTANT_MAX_HISTORY', 100)),
+    }
+    if os.getenv('ASSISTANT_SESSION_STORE', 'memory').lower() == 'sqlite':
+        path = os.getenv('ASSISTANT_SESSION_DB', 'assistant_sessions.db')
+        logger.info(f"Using SQLite assistant session store at {path}")
+        return SQLiteSessionStore(path, **options)
+    return MemorySessionStore(**options)
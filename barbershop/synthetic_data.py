@@ -0,0 +1,250 @@
+"""Deterministic synthetic data at production scale
+
+Generates locations, barbers, a service menu and years of appointments
+from a seeded RNG, so the same parameters (and ``today``) always give the
+same database. Appointments follow the shop's opening hours with busier
+Fridays and Saturdays, after-work peaks and seasonal swings, never overlap
+for a barber, and are written with bulk inserts.
+
+Used by ``python seed_data.py --synthetic`` and as the fixture for the
+benchmarks.
+"""
+
+import random
+import time
+from datetime import date, datetime, timedelta
+from sqlalchemy import delete, func, insert, select
+from db import db
+from models import Location, Barber, Service, Appointment, EmailOutbox, appointment_service
+from availability import OPENING_MINUTE, CLOSING_MINUTE, CLOSED_WEEKDAYS
+from catalog import bump_catalog_version, catalog
+import logging
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 10000
+
+# Appointments start on this grid
+START_STEP_MINUTES = 15
+
+NEIGHBOURHOODS = ["Downtown", "Uptown", "Riverside", "Old Town", "Harbor", "Midtown", "Westside", "Eastside",
+                  "Northgate", "Southpark", "University", "Market Square", "Hillcrest", "Lakeside", "Station"]
+STREETS = ["Main", "High", "Oak", "Maple", "Cedar", "Park", "Elm", "Church", "Mill", "Bridge", "King", "Queen"]
+FIRST_NAMES = ["John", "Michael", "Robert", "James", "David", "Daniel", "Carlos", "Ahmed", "Luca", "Kenji", "Omar",
+               "Mateo", "Ivan", "Samuel", "Noah", "Elijah", "Marcus", "Andre", "Tomas", "Rafael", "Yusuf", "Leo",
+               "Hugo", "Felix", "Arjun", "Dmitri", "Kwame", "Sean", "Pablo", "Victor"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Garcia", "Martinez", "Silva", "Rossi", "Tanaka", "Khan",
+              "Novak", "Murphy", "Okafor", "Petrov", "Haddad", "Nguyen", "Kowalski", "Costa", "Fischer", "Moreau",
+              "Jensen", "Alvarez", "Sato", "Mensah", "Byrne", "Romero", "Weber", "Dubois", "Larsen", "Ibrahim"]
+LANGUAGES = ["English", "Spanish", "French", "Portuguese", "Italian", "Arabic", "Russian", "Japanese", "German"]
+
+# (name, minutes, price_min, price_max, share of bookings)
+SERVICE_MENU = [
+    ("Haircut", 45, 35.0, None, 30),
+    ("Beard Trim", 20, 20.0, None, 12),
+    ("Hair & Beard Combo", 60, 50.0, None, 12),
+    ("Skin Fade", 45, 40.0, None, 15),
+    ("Hot Towel Shave", 30, 30.0, None, 5),
+    ("Kid's Haircut (Under 12)", 30, 25.0, None, 8),
+    ("Buzz Cut", 20, 20.0, None, 8),
+    ("Premium Style", 60, 65.0, 85.0, 4),
+    ("Line Up", 15, 15.0, None, 3),
+    ("Long Hair Cut", 60, 45.0, 60.0, 3),
+    ("Hair Colour", 90, 70.0, 120.0, 2),
+    ("Scalp Treatment", 30, 35.0, None, 1),
+]
+SERVICE_VARIANTS = ["Express", "Deluxe", "Signature", "Classic", "Executive", "Student", "Weekend", "Senior"]
+
+# Chance that a booking adds a beard trim to its main service
+ADD_ON_SHARE = 0.12
+
+# Relative demand by weekday (Monday first) and by hour of the day
+WEEKDAY_DEMAND = [0.55, 0.6, 0.65, 0.75, 0.9, 1.0, 0.0]
+HOUR_DEMAND = {9: 0.5, 10: 0.6, 11: 0.7, 12: 0.85, 13: 0.75, 14: 0.7, 15: 0.8, 16: 0.95, 17: 1.0}
+MONTH_DEMAND = [0.85, 0.9, 1.0, 1.0, 1.05, 1.1, 0.95, 0.85, 1.0, 1.0, 1.05, 1.2]
+
+
+def _service_menu(count):
+    """``count`` services: the menu, then variants of it"""
+    services = []
+    for i in range(count):
+        name, minutes, price_min, price_max, weight = SERVICE_MENU[i % len(SERVICE_MENU)]
+        round_ = i // len(SERVICE_MENU)
+        if round_:
+            variant = SERVICE_VARIANTS[(round_ - 1) % len(SERVICE_VARIANTS)]
+            cycle = (round_ - 1) // len(SERVICE_VARIANTS)
+            name = f"{variant} {name}" + (f" {cycle + 1}" if cycle else "")
+            weight = max(weight / (round_ + 1), 0.2)
+        services.append((name, minutes, price_min, price_max, weight))
+    return services
+
+
+def _barber_names(count, rng):
+    names = [f"{first} {last}" for first in FIRST_NAMES for last in LAST_NAMES]
+    rng.shuffle(names)
+    return [names[i % len(names)] + (f" {i // len(names) + 1}" if i >= len(names) else "") for i in range(count)]
+
+
+def reset_database():
+    """Delete all appointments, emails, barbers, services and locations"""
+    connection = db.session.connection()
+    for table in (appointment_service, EmailOutbox.__table__, Appointment.__table__, Barber.__table__,
+                  Service.__table__, Location.__table__):
+        connection.execute(delete(table))
+    bump_catalog_version(connection)
+    db.session.commit()
+    catalog.invalidate()
+
+
+class _Writer:
+    """Buffered bulk inserts into one table
+
+    IDs are assigned up front so dependent rows can reference them without
+    reading anything back.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.rows = []
+        self.count = 0
+        self.next_id = None
+        if 'id' in table.c:
+            self.next_id = (db.session.execute(select(func.max(table.c.id))).scalar() or 0) + 1
+
+    def add(self, **values):
+        if self.next_id is not None:
+            values['id'] = self.next_id
+            self.next_id += 1
+        self.rows.append(values)
+        return values.get('id')
+
+    def flush(self):
+        if self.rows:
+            db.session.execute(insert(self.table), self.rows)
+            self.count += len(self.rows)
+            self.rows = []
+
+
+def _flush(*writers):
+    for writer in writers:
+        writer.flush()
+    db.session.commit()
+
+
+def generate(locations=10, barbers_per_location=6, services=len(SERVICE_MENU), history_days=730, future_days=30,
+             utilisation=0.6, any_barber_share=0.05, seed=42, today=None, batch_size=BATCH_SIZE, progress=None):
+    """Add a synthetic catalog and appointment history to the database
+
+    Appointments cover the ``history_days`` before ``today`` (default: the
+    current date) and, thinning out, the ``future_days`` after it.
+    ``utilisation`` is roughly the share of a barber's busiest hours that
+    is booked. Existing data is kept; call :func:`reset_database` first
+    for a clean slate.
+
+    Returns:
+        Dict with the number of rows created per table
+    """
+    rng = random.Random(seed)
+    today = today or date.today()
+    started = time.perf_counter()
+
+    # Catalog
+    location_writer = _Writer(Location.__table__)
+    location_ids = []
+    for i in range(locations):
+        name = NEIGHBOURHOODS[i % len(NEIGHBOURHOODS)]
+        if i >= len(NEIGHBOURHOODS):
+            name = f"{name} {i // len(NEIGHBOURHOODS) + 1}"
+        location_ids.append(location_writer.add(
+            name=f"{name} Barbershop",
+            address=f"{rng.randint(1, 999)} {rng.choice(STREETS)} Street, {name}",
+            phone=f"(555) {rng.randint(100, 999)}-{rng.randint(1000, 9999)}"))
+    location_writer.flush()
+
+    barber_writer = _Writer(Barber.__table__)
+    barbers = []  # (barber id, location id, speed factor)
+    for i, name in enumerate(_barber_names(locations * barbers_per_location, rng)):
+        location_id = location_ids[i // barbers_per_location]
+        languages = ["English"] + rng.sample(LANGUAGES[1:], rng.choice([0, 0, 1, 1, 2]))
+        barber_id = barber_writer.add(name=name, photo=None, languages=", ".join(languages),
+                                      rating=round(rng.uniform(3.8, 5.0), 1), location_id=location_id)
+        barbers.append((barber_id, location_id, rng.uniform(0.8, 1.15)))
+    barber_writer.flush()
+
+    service_writer = _Writer(Service.__table__)
+    menu = []  # (service id, minutes, weight)
+    for name, minutes, price_min, price_max, weight in _service_menu(services):
+        service_id = service_writer.add(name=name, duration_minutes=minutes, price_min=price_min, price_max=price_max)
+        menu.append((service_id, minutes, weight))
+    service_writer.flush()
+    bump_catalog_version(db.session.connection())
+    db.session.commit()
+    catalog.invalidate()
+
+    # Appointments, one barber-day at a time
+    appointment_writer = _Writer(Appointment.__table__)
+    link_writer = _Writer(appointment_service)
+    service_ids = [service_id for service_id, _, _ in menu]
+    minutes_by_service = {service_id: minutes for service_id, minutes, _ in menu}
+    cumulative_weights = []
+    total = 0
+    for _, _, weight in menu:
+        total += weight
+        cumulative_weights.append(total)
+    add_on = service_ids[1] if len(service_ids) > 1 else None  # Beard Trim
+    clients = max(1000, int(len(barbers) * (history_days + future_days) * 1.5))
+
+    now = datetime.combine(today, datetime.min.time()) + timedelta(hours=12)
+    for offset in range(-history_days, future_days + 1):
+        day = today + timedelta(days=offset)
+        if day.weekday() in CLOSED_WEEKDAYS:
+            continue
+        demand = utilisation * WEEKDAY_DEMAND[day.weekday()] * MONTH_DEMAND[day.month - 1]
+        if offset > 0:
+            demand *= max(0.1, 1 - offset / max(future_days, 1))  # fewer bookings made this far ahead
+        for barber_id, location_id, speed in barbers:
+            minute = OPENING_MINUTE
+            while minute < CLOSING_MINUTE:
+                if rng.random() >= demand * speed * HOUR_DEMAND.get(minute // 60, 0.5):
+                    minute += START_STEP_MINUTES
+                    continue
+                booked = rng.choices(service_ids, cum_weights=cumulative_weights)
+                if add_on and booked[0] != add_on and rng.random() < ADD_ON_SHARE:
+                    booked.append(add_on)
+                duration = sum(minutes_by_service[service_id] for service_id in booked)
+                if minute + duration > CLOSING_MINUTE:
+                    minute += START_STEP_MINUTES
+                    continue
+
+                client = rng.randrange(clients)
+                first, last = FIRST_NAMES[client % len(FIRST_NAMES)], LAST_NAMES[client // len(FIRST_NAMES) % len(LAST_NAMES)]
+                starts_at = datetime.combine(day, datetime.min.time()) + timedelta(minutes=minute)
+                created_at = min(starts_at - timedelta(hours=rng.expovariate(1 / 120) + 1), now)
+                appointment_id = appointment_writer.add(
+                    location_id=location_id,
+                    # "Any barber" bookings still take up this barber's time, so capacity holds
+                    barber_id=None if rng.random() < any_barber_share else barber_id,
+                    client_name=f"{first} {last}",
+                    client_email=f"{first.lower()}.{last.lower()}{client}@example.com",
+                    date=day,
+                    start_time=f"{minute // 60:02d}:{minute % 60:02d}",
+                    start_minute=minute,
+                    end_minute=minute + duration,
+                    services=','.join(map(str, sorted(set(booked)))),
+                    created_at=created_at,
+                    reminder_sent_at=starts_at - timedelta(hours=18) if offset < 0 else None)
+                for service_id in set(booked):
+                    link_writer.add(appointment_id=appointment_id, service_id=service_id)
+                minute += -(-duration // START_STEP_MINUTES) * START_STEP_MINUTES
+
+        if len(appointment_writer.rows) >= batch_size:
+            _flush(appointment_writer, link_writer)
+            if progress:
+                progress(day, appointment_writer.count)
+    _flush(appointment_writer, link_writer)
+
+    counts = {'locations': location_writer.count, 'barbers': barber_writer.count, 'services': service_writer.count,
+              'appointments': appointment_writer.count, 'appointment_services': link_writer.count}
+    logger.info(f"Generated {counts} in {time.perf_counter() - started:.1f}s")
+    return counts
+
@@ -1,21 +1,35 @@
 import os
 import json
 import random
+import re
+import string
 from datetime import datetime, timedelta
 from db import db
 from models import Location, Barber, Service, Appointment
+from catalog import catalog
+from entity_matcher import EntityMatcher
+from availability import find_available_slots
+from booking import book_appointment, BookingError, SlotTakenError
+from session_store import create_session_store
+from metrics import ASSISTANT_STAGE_SECONDS
 import logging
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# A reply that is only a time, like "16:00" or "9"
+BARE_TIME_PATTERN = re.compile(r'^(\d{1,2})(?::(\d{2}))?$')
+PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+
 class BarberAssistant:
     """AI assistant for handling barbershop appointment bookings"""
     
-    def __init__(self, app=None):
+    def __init__(self, app=None, session_store=None):
         self.app = app
-        self.conversation_state = {}
+        # Bounded, expiring store; dict-like access by session id
+        self.conversation_state = session_store if session_store is not None else create_session_store()
+        self._matcher = None
         
         # Standard responses
         self.greetings = [
@@ -24,53 +38,75 @@ class BarberAssistant:
             "Welcome to our barbershop! What can I do for you today?"
         ]
     
-    def start_conversation(self, session_id):
-        """Start a new conversation"""
-        if session_id not in self.conversation_state:
-            self.conversation_state[session_id] = {
-                "history": [],
-                "booking_data": {},
-                "confirmation_step": False
-            }
-        
+    def new_conversation(self):
+        """State of a conversation that has just been greeted"""
+        state = {
+            "history": [],
+            "history_offset": 0,
+            "booking_data": {},
+            "confirmation_step": False
+        }
+        self._greet(state)
+        return state
+    
+    def _greet(self, state):
         greeting = random.choice(self.greetings)
-        self.conversation_state[session_id]["history"].append({"role": "assistant", "content": greeting})
+        state["history"].append({"role": "assistant", "content": greeting})
         return greeting
     
+    def start_conversation(self, session_id):
+        """Start a new conversation (or greet again in an existing one)"""
+        state = self.conversation_state.load(session_id)
+        if state is None:
+            state = self.new_conversation()
+        else:
+            self._greet(state)
+        self.conversation_state.save(session_id, state)
+        return state["history"][-1]["content"]
+    
     def process_message(self, session_id, user_message):
         """Process a user message and generate a response"""
         logger.info(f"Processing message for session {session_id}: {user_message}")
         
-        # Start conversation if it doesn't exist
-        if session_id not in self.conversation_state:
-            self.start_conversation(session_id)
+        # Pick up the latest state (another worker may have handled the last turn)
+        with ASSISTANT_STAGE_SECONDS.time('session_load'):
+            state = self.conversation_state.load(session_id)
+            if state is None:
+                state = self.new_conversation()
+        
+        response = self.take_turn(state, user_message)
+        with ASSISTANT_STAGE_SECONDS.time('session_save'):
+            self.conversation_state.save(session_id, state)
         
+        return response
+
+    def take_turn(self, state, user_message):
+        """Answer a message in a loaded conversation ``state``, without saving it"""
         # Track which question we're answering to handle unexpected responses better
-        current_stage = self.conversation_state[session_id].get("current_stage", None)
+        current_stage = state.get("current_stage", None)
         
         # Add user message to history
-        self.conversation_state[session_id]["history"].append({"role": "user", "content": user_message})
+        state["history"].append({"role": "user", "content": user_message})
         
         # Process the message
-        with self.app.app_context():
-            response = self._generate_response(session_id, user_message, current_stage)
+        with self.app.app_context(), ASSISTANT_STAGE_SECONDS.time('generate_response'):
+            response = self._generate_response(state, user_message, current_stage)
         
         # Add assistant response to history
-        self.conversation_state[session_id]["history"].append({"role": "assistant", "content": response})
-        
+        state["history"].append({"role": "assistant", "content": response})
         return response
 
-    def _generate_response(self, session_id, user_message, current_stage=None):
+    def _generate_response(self, state, user_message, current_stage=None):
         """Generate a response based on the user message and conversation state"""
-        state = self.conversation_state[session_id]
         booking_data = state["booking_data"]
         
         # Handle confirmation step
         if state.get("confirmation_step"):
-            return self._handle_confirmation(session_id, user_message)
+            return self._handle_confirmation(state, user_message)
         
         # Extract entities and intents
-        extracted_data = self._extract_entities(user_message)
+        with ASSISTANT_STAGE_SECONDS.time('extract_entities'):
+            extracted_data = self._extract_entities(user_message)
         logger.info(f"Extracted data: {extracted_data}")
         
         # Determine previous stage
@@ -83,7 +119,7 @@ class BarberAssistant:
             
             # Important: Move to the name stage explicitly
             state["current_stage"] = "need_name"
-            return self._ask_for_name(session_id)
+            return self._ask_for_name()
         
         # Update booking data with other extracted information
         if extracted_data:
@@ -102,23 +138,23 @@ class BarberAssistant:
         # Handle different conversation stages based on what information we have
         if "barber_name" in booking_data and "date" in booking_data and "time" in booking_data and "client_name" not in booking_data:
             state["current_stage"] = "need_name"
-            return self._ask_for_name(session_id)
+            return self._ask_for_name()
             
         elif "barber_name" in booking_data and "date" in booking_data and "time" in booking_data and "client_name" in booking_data:
             state["current_stage"] = "confirmation"
-            return self._prepare_confirmation(session_id)
+            return self._prepare_confirmation(state)
             
         elif "barber_name" in booking_data and "date" in booking_data and "time" not in booking_data:
             state["current_stage"] = "need_time"
-            return self._suggest_available_times(session_id)
+            return self._suggest_available_times(state)
             
         elif "barber_name" in booking_data and "date" not in booking_data:
             state["current_stage"] = "need_date"
-            return self._ask_for_date(session_id)
+            return self._ask_for_date()
             
         elif "date" in booking_data and "barber_name" not in booking_data:
             state["current_stage"] = "need_barber"
-            return self._ask_for_barber(session_id)
+            return self._ask_for_barber()
         
         # If we have partial booking information but didn't extract what we needed
         if booking_data and previous_stage:
@@ -127,7 +163,7 @@ class BarberAssistant:
             
             elif previous_stage == "need_barber" and "barber_name" not in extracted_data:
                 # Get list of barbers for hint
-                barbers = Barber.query.all()
+                barbers = catalog.get().barbers
                 barber_options = ", ".join([barber.name for barber in barbers[:3]])
                 return f"I need to know which barber you'd like. Please choose from our barbers like {barber_options}."
                 
@@ -149,122 +185,56 @@ class BarberAssistant:
     def _extract_entities(self, message):
         """Extract relevant entities from the message (barber name, date, time, etc.)"""
         extracted = {}
+        message_lower = message.lower()
+        found = self._entity_matcher().scan(message_lower)
         
         # Extract barber name or "any barber" preference
-        any_barber_phrases = ["any barber", "anyone", "any specialist", "doesn't matter", "doesnt matter", "don't care", "dont care", "any available", "whoever", "anybody"]
-        
-        # Check if user wants any barber
-        if any(phrase in message.lower() for phrase in any_barber_phrases):
+        if "any_barber" in found:
             extracted["barber_name"] = "Any Available Barber"
             extracted["any_barber"] = True
-        else:
-            # Try to extract specific barber
-            barbers = Barber.query.all()
-            for barber in barbers:
-                if barber.name.lower() in message.lower():
-                    extracted["barber_name"] = barber.name
-                    extracted["barber_id"] = barber.id
-                    break
-        
-        # Extract date - improved to handle more date formats
-        # Check for special keywords first
-        date_keywords = {
-            "today": 0,
-            "tomorrow": 1,
-            "day after tomorrow": 2,
-            "next week": 7
-        }
-        
-        date_found = False
-        for keyword, days_offset in date_keywords.items():
-            if keyword.lower() in message.lower():
-                extracted["date"] = (datetime.now() + timedelta(days=days_offset)).strftime("%Y-%m-%d")
-                date_found = True
-                break
-        
-        # Check for day names (Monday, Tuesday, etc.)
-        if not date_found:
-            days_of_week = {
-                'monday': 0, 'tuesday': 1, 'wednesday': 2, 
-                'thursday': 3, 'friday': 4, 'saturday': 5, 'sunday': 6
-            }
-            
-            message_lower = message.lower()
-            for day_name, day_num in days_of_week.items():
-                if day_name in message_lower:
-                    # Calculate days until the next occurrence of this day
-                    today = datetime.now().weekday()
-                    days_until = (day_num - today) % 7
-                    if days_until == 0:  # If it's the same day, assume next week
-                        days_until = 7
-                    
-                    target_date = datetime.now() + timedelta(days=days_until)
-                    extracted["date"] = target_date.strftime("%Y-%m-%d")
-                    date_found = True
-                    break
-        
-        # Extract time - improved to handle more time formats
-        # Simple time extraction for common formats
-        time_found = False
-        time_keywords = {"morning": "10:00", "afternoon": "14:00", "evening": "18:00"}
-        for keyword, time_val in time_keywords.items():
-            if keyword.lower() in message.lower():
-                extracted["time"] = time_val
-                time_found = True
-                break
-        
-        # Try to extract specific times like "3pm" or "3:30"
-        if not time_found:
-            import re
-            # Match patterns like "3pm", "3:30pm", "15:00", etc.
-            time_patterns = [
-                r'(\d{1,2})(?::(\d{2}))?\s*(am|pm)',  # 3pm, 3:30pm
-                r'(\d{1,2})(?::(\d{2}))'  # 15:00, 3:00
-            ]
+        elif "barber" in found:
+            extracted["barber_name"] = found["barber"].name
+            extracted["barber_id"] = found["barber"].id
+        
+        # Extract date - keywords like "tomorrow" first, then day names
+        if "date_offset" in found:
+            extracted["date"] = (datetime.now() + timedelta(days=found["date_offset"])).strftime("%Y-%m-%d")
+        elif "weekday" in found:
+            # Calculate days until the next occurrence of this day
+            today = datetime.now().weekday()
+            days_until = (found["weekday"] - today) % 7
+            if days_until == 0:  # If it's the same day, assume next week
+                days_until = 7
             
-            for pattern in time_patterns:
-                matches = re.search(pattern, message.lower())
-                if matches:
-                    hour = int(matches.group(1))
-                    minute = matches.group(2) if matches.group(2) else "00"
-                    
-                    # Handle am/pm if present
-                    if len(matches.groups()) > 2 and matches.group(3):
-                        am_pm = matches.group(3)
-                        if am_pm == "pm" and hour < 12:
-                            hour += 12
-                        elif am_pm == "am" and hour == 12:
-                            hour = 0
-                    
-                    extracted["time"] = f"{hour:02d}:{minute}"
-                    time_found = True
-                    break
+            target_date = datetime.now() + timedelta(days=days_until)
+            extracted["date"] = target_date.strftime("%Y-%m-%d")
         
-        # Check if the message is just a time value (like "16:00" or "9:00")
+        # Extract time - "morning"/"afternoon"/"evening" first, then times like "3pm" or "15:00"
+        time_found = False
+        if "period" in found:
+            extracted["time"] = found["period"]
+            time_found = True
+        elif "clock" in found:
+            extracted["time"] = found["clock"]
+            time_found = True
+        
+        # Check if the message is just a time value (like "16:00" or "9")
         # This helps prevent time-only responses from being interpreted as names
         if not time_found and len(message.split()) == 1:
-            # Check if this looks like a time (HH:MM or H:MM format)
-            time_formats = [r'^\d{1,2}:\d{2}$', r'^\d{1,2}$']
-            for format_pattern in time_formats:
-                if re.match(format_pattern, message.strip()):
-                    # This is likely a time response
-                    parts = message.strip().split(':')
-                    hour = int(parts[0])
-                    minute = int(parts[1]) if len(parts) > 1 else 0
-                    
-                    # Assume hours > 12 are 24-hour format
-                    if 0 <= hour <= 23 and 0 <= minute <= 59:
-                        extracted["time"] = f"{hour:02d}:{minute:02d}"
-                        time_found = True
-                        break
+            match = BARE_TIME_PATTERN.match(message.strip())
+            if match:
+                hour = int(match.group(1))
+                minute = int(match.group(2) or 0)
+                
+                # Assume hours > 12 are 24-hour format
+                if 0 <= hour <= 23 and 0 <= minute <= 59:
+                    extracted["time"] = f"{hour:02d}:{minute:02d}"
+                    time_found = True
         
         # Extract service
-        services = Service.query.all()
-        for service in services:
-            if service.name.lower() in message.lower():
-                extracted["service_name"] = service.name
-                extracted["service_id"] = service.id
-                break
+        if "service" in found:
+            extracted["service_name"] = found["service"].name
+            extracted["service_id"] = found["service"].id
         
         # Extract name - improved to handle direct name responses
         # IMPORTANT: Don't extract name if we found a time in this message
@@ -275,8 +245,8 @@ class BarberAssistant:
             name_found = False
             
             for indicator in name_indicators:
-                if indicator.lower() in message.lower():
-                    parts = message.lower().split(indicator.lower(), 1)
+                if indicator in message_lower:
+                    parts = message_lower.split(indicator, 1)
                     if len(parts) > 1:
                         # Take the words after the indicator
                         name_part = parts[1].strip().split()
@@ -292,12 +262,18 @@ class BarberAssistant:
             if not name_found and len(message.split()) <= 3 and len(message) >= 2:
                 # This is likely a direct response to a name request
                 # Clean up the message (remove punctuation)
-                import string
-                cleaned_message = message.translate(str.maketrans('', '', string.punctuation))
+                cleaned_message = message.translate(PUNCTUATION_TABLE)
                 extracted["client_name"] = cleaned_message.strip().title()
         
         return extracted
     
+    def _entity_matcher(self):
+        """Matcher compiled for the current catalog snapshot"""
+        snapshot = catalog.get()
+        if self._matcher is None or self._matcher.snapshot is not snapshot:
+            self._matcher = EntityMatcher(snapshot)
+        return self._matcher
+    
     def _is_booking_request(self, message):
         """Determine if the message is a booking request"""
         booking_keywords = ["book", "appointment", "schedule", "reserve", "haircut"]
@@ -319,10 +295,9 @@ class BarberAssistant:
         
         return None
     
-    def _ask_for_barber(self, session_id):
+    def _ask_for_barber(self):
         """Ask the user to select a barber"""
-        barbers = Barber.query.all()
-        barber_names = [barber.name for barber in barbers]
+        barber_names = [barber.name for barber in catalog.get().barbers]
         
         if len(barber_names) <= 3:
             # If we have just a few barbers, list them explicitly
@@ -333,7 +308,7 @@ class BarberAssistant:
             examples = ", ".join(barber_names[:3])
             return f"Which barber would you prefer? We have {len(barber_names)} barbers including {examples}. You can also say 'any barber' if you don't have a preference."
     
-    def _ask_for_date(self, session_id):
+    def _ask_for_date(self):
         """Ask the user for a preferred date"""
         today = datetime.now().strftime("%A, %B %d")
         tomorrow = (datetime.now() + timedelta(days=1)).strftime("%A, %B %d")
@@ -341,9 +316,10 @@ class BarberAssistant:
         
         return f"What day would you like to book your appointment? You can say 'today', 'tomorrow', or a specific date like '{next_week}'."
     
-    def _suggest_available_times(self, session_id):
+    @ASSISTANT_STAGE_SECONDS.time('availability')
+    def _suggest_available_times(self, state):
         """Suggest available times based on date and barber"""
-        booking_data = self.conversation_state[session_id]["booking_data"]
+        booking_data = state["booking_data"]
         barber_name = booking_data.get("barber_name")
         date_str = booking_data.get("date")
         
@@ -354,25 +330,44 @@ class BarberAssistant:
         except:
             formatted_date = date_str
         
-        # Get barber by name
-        barber = Barber.query.filter_by(name=barber_name).first()
+        # Look up real availability for the requested barber (or any barber)
+        barber_id = None if booking_data.get("any_barber") else booking_data.get("barber_id")
+        location_id = None
+        if not barber_id:
+            location_id = catalog.get().default_location_id
         
-        # Simulate available times (in a real app, query database for actual availability)
-        available_times = ["9:00", "10:30", "11:00", "14:00", "15:30", "17:00"]
-        time_options = ", ".join(available_times)
+        try:
+            availability = find_available_slots(location_id=location_id,
+                                                barber_id=barber_id,
+                                                service_ids=[booking_data.get("service_id", 1)],
+                                                start_date=date_str)
+            available_times = availability["slots"].get(date_str, [])
+        except ValueError:
+            available_times = []
         
         # Update the booking data with available times for selection
         booking_data["available_times"] = available_times
         
+        if not available_times:
+            # Ask for another day instead of offering times that are taken
+            booking_data.pop("date", None)
+            state["current_stage"] = "need_date"
+            return f"Sorry, {barber_name} has no free times on {formatted_date}. Which other day would suit you?"
+        
+        time_options = ", ".join(available_times[:8])
+        if len(available_times) > 8:
+            time_options += f" and {len(available_times) - 8} more"
+        
         return f"Great! {barber_name} is available on {formatted_date} at: {time_options}. Please select a time or say 'morning', 'afternoon' or 'evening'."
     
-    def _ask_for_name(self, session_id):
+    def _ask_for_name(self):
         """Ask for the client's name"""
         return "What is your name for the appointment? Please just type your name."
     
-    def _prepare_confirmation(self, session_id):
+    @ASSISTANT_STAGE_SECONDS.time('confirmation_summary')
+    def _prepare_confirmation(self, state):
         """Prepare the confirmation summary"""
-        booking_data = self.conversation_state[session_id]["booking_data"]
+        booking_data = state["booking_data"]
         barber_name = booking_data.get("barber_name")
         date_str = booking_data.get("date")
         time_str = booking_data.get("time")
@@ -389,7 +384,7 @@ class BarberAssistant:
         service_name = booking_data.get("service_name", "haircut")
         
         # Set confirmation step flag
-        self.conversation_state[session_id]["confirmation_step"] = True
+        state["confirmation_step"] = True
         
         # Check for any barber option
         is_any_barber = booking_data.get("any_barber", False)
@@ -397,22 +392,30 @@ class BarberAssistant:
         
         return f"Please confirm your appointment details:\n• Name: {client_name}\n• Date: {formatted_date}\n• Time: {time_str}\n• Barber: {barber_display}\n• Service: {service_name}\n\nIs this correct? Please reply with 'yes' to confirm or 'no' to make changes."
     
-    def _handle_confirmation(self, session_id, user_message):
+    def _handle_confirmation(self, state, user_message):
         """Handle the user's response to the confirmation"""
         # Check for affirmative response
         affirmative = ["yes", "correct", "right", "good", "confirm", "confirmed", "ok", "okay", "sure", "yep", "yeah"]
         negative = ["no", "wrong", "incorrect", "not right", "mistake", "error", "cancel"]
         
         if any(word in user_message.lower() for word in affirmative):
-            # Create the appointment
-            booking = self._create_booking(session_id)
-            
             # Reset confirmation step
-            self.conversation_state[session_id]["confirmation_step"] = False
+            state["confirmation_step"] = False
+            
+            # Create the appointment
+            try:
+                booking = self._create_booking(state)
+            except SlotTakenError:
+                # Someone else got the slot first - offer the remaining times
+                state["booking_data"].pop("time", None)
+                state["current_stage"] = "need_time"
+                return "Sorry, that time was just booked by someone else. " + self._suggest_available_times(state)
+            except BookingError as e:
+                return f"I'm sorry, I couldn't complete your booking. {str(e)}"
             
             if booking:
                 # Get the booking details for a personalized confirmation
-                booking_data = self.conversation_state[session_id]["booking_data"]
+                booking_data = state["booking_data"]
                 client_name = booking_data.get("client_name", "").split()[0]  # Just use first name
                 
                 return f"Great! Your appointment has been confirmed, {client_name}. You will receive a confirmation email shortly. Is there anything else I can help you with?"
@@ -421,7 +424,7 @@ class BarberAssistant:
                 
         elif any(word in user_message.lower() for word in negative):
             # Reset confirmation step
-            self.conversation_state[session_id]["confirmation_step"] = False
+            state["confirmation_step"] = False
             
             # Ask which part they want to change
             return "I understand you want to make changes. Which part would you like to change? The date, time, barber, or service?"
@@ -430,9 +433,10 @@ class BarberAssistant:
             # Unclear response
             return "I didn't understand your response. Please say 'yes' to confirm the booking or 'no' to make changes."
     
-    def _create_booking(self, session_id):
+    @ASSISTANT_STAGE_SECONDS.time('booking')
+    def _create_booking(self, state):
         """Create an appointment in the database"""
-        booking_data = self.conversation_state[session_id]["booking_data"]
+        booking_data = state["booking_data"]
         
         try:
             # Get barber or handle "any barber" case
@@ -444,9 +448,10 @@ class BarberAssistant:
                 barber_id = None
             
             # Get barber object if a specific barber was requested
+            snapshot = catalog.get()
             barber = None
             if barber_id:
-                barber = Barber.query.get(barber_id)
+                barber = snapshot.barbers_by_id.get(barber_id)
             
             # Get or set default data
             date_str = booking_data.get("date")
@@ -454,7 +459,7 @@ class BarberAssistant:
             client_name = booking_data.get("client_name")
             
             # Get default location - either from barber or use first location
-            location_id = barber.location_id if barber else Location.query.first().id
+            location_id = barber.location_id if barber else snapshot.default_location_id
             
             # Get service ID or use default
             service_id = booking_data.get("service_id", 1)
@@ -462,32 +467,50 @@ class BarberAssistant:
             # Format the date
             appointment_date = datetime.strptime(date_str, "%Y-%m-%d").date()
             
-            # Create appointment
-            appointment = Appointment(
-                location_id=location_id,
-                barber_id=barber_id,  # Will be None for "any barber"
-                client_name=client_name,
-                client_email="ai_assistant_booking@example.com",  # Placeholder - would get from user
-                date=appointment_date,
-                start_time=time_str,
-                services=str(service_id)
-            )
-            
-            db.session.add(appointment)
-            db.session.commit()
+            # Create appointment atomically - raises SlotTakenError if the time was taken
+            appointment = book_appointment(location_id=location_id,
+                                           barber_id=barber_id,  # Will be None for "any barber"
+                                           client_name=client_name,
+                                           client_email="ai_assistant_booking@example.com",  # Placeholder - would get from user
+                                           appointment_date=appointment_date,
+                                           start_time=time_str,
+                                           service_ids=[service_id])
             
             logger.info(f"Created appointment: {appointment}")
             return appointment
+        except BookingError:
+            raise
         except Exception as e:
             logger.error(f"Error creating appointment: {str(e)}")
             return None
     
     def get_conversation_history(self, session_id):
         """Get the conversation history for a session"""
-        if session_id not in self.conversation_state:
+        state = self.conversation_state.load(session_id)
+        if state is None:
             return []
         
-        return self.conversation_state[session_id]["history"]
+        return state["history"]
+    
+    def get_history_since(self, session_id, cursor=None):
+        """Get the messages after ``cursor`` as (messages, start, next_cursor)
+        
+        Cursors count messages from the start of the conversation, so they stay
+        valid when old messages are trimmed; ``start`` is the index of the first
+        returned message and is greater than ``cursor`` if some were dropped.
+        A ``cursor`` of None returns no messages, only the current cursor.
+        """
+        state = self.conversation_state.load(session_id)
+        if state is None:
+            return [], 0, 0
+        
+        offset = state.get("history_offset", 0)
+        history = state["history"]
+        end = offset + len(history)
+        if cursor is None:
+            return [], end, end
+        start = min(max(cursor, offset), end)
+        return history[start - offset:], start, end
 
     def _is_help_request(self, message):
         """Check if the message is a help request or greeting"""
@@ -521,5 +544,5 @@ def run_cli_interface(app):
 
 if __name__ == "__main__":
     # This allows running the assistant directly for testing
-    from app import app
-    run_cli_interface(app)
+    from app import create_app
+    run_cli_interface(create_app())